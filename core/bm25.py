@@ -0,0 +1,186 @@
+"""Sparse keyword index with BM25 scoring (the `.bm25` index sidecar).
+
+Terms are kept sorted in a utf-8 blob with a uint64 offset table, so a term is
+found by binary search over the mmap without loading the vocabulary. Each
+term's postings are a contiguous run of (uint32 row, uint16 tf) in the
+`rows` / `tf` arrays, addressed through the `post.off` table. Rows are
+metastore row positions, so hits map to chunk metadata exactly like dense hits.
+The file uses the metastore's section layout (see core.metastore.write_sections).
+
+Tokens are lowercased word runs. Dotted or underscored identifiers
+(`bt.Cerebro.adddata`, `add_data`, `PROJ-1234`) are indexed whole and also
+split into their parts, so exact identifier queries match.
+"""
+
+import math, os, re, tempfile
+from array import array
+from collections import Counter
+import numpy as np
+from core.metastore import read_sections, section_array, write_sections
+
+MAGIC = b'RAGBM25\x01'
+WORD = re.compile(r'\w+(?:[.\-:]\w+)*')
+PARTS = re.compile(r'[^\W_]+')
+
+
+def bm25_path(index_path):
+    return index_path + '.bm25'
+
+
+def tokenize(text):
+    out = WORD.findall((text or '').lower())
+    # only compound tokens (dots, dashes, underscores) need splitting
+    for tok in [t for t in out if not t.isalnum()]:
+        parts = PARTS.findall(tok)
+        if len(parts) > 1:
+            out.extend(parts)
+    return out
+
+
+class BM25Writer:
+    """Add chunk texts in row order; `close()` writes the index atomically.
+
+    Postings are collected as flat (term id, row, tf) columns and grouped by
+    term with one numpy sort at close, keeping per-token Python work minimal.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._term_ids = {}
+        self._terms = array('I')
+        self._rows = array('I')
+        self._tfs = array('I')
+        self._lengths = array('I')
+
+    def add(self, text):
+        row = len(self._lengths)
+        tokens = tokenize(text)
+        self._lengths.append(len(tokens))
+        counts = Counter(tokens)
+        ids = self._term_ids
+        self._terms.extend([ids.setdefault(t, len(ids)) for t in counts])
+        self._tfs.extend(counts.values())
+        self._rows.extend(array('I', [row]) * len(counts))
+
+    def add_many(self, texts):
+        for t in texts:
+            self.add(t)
+
+    def close(self):
+        terms = sorted(self._term_ids)
+        rank = np.empty(len(terms), dtype=np.uint32)
+        rank[[self._term_ids[t] for t in terms]] = np.arange(len(terms), dtype=np.uint32)
+        keys = rank[np.frombuffer(self._terms, dtype=np.uint32)]
+        # stable sort keeps each term's rows ascending
+        order = np.argsort(keys, kind='stable')
+        rows = np.frombuffer(self._rows, dtype=np.uint32)[order]
+        tfs = np.minimum(np.frombuffer(self._tfs, dtype=np.uint32)[order], 65535).astype(np.uint16)
+        post_off = np.zeros(len(terms) + 1, dtype=np.uint64)
+        np.cumsum(np.bincount(keys, minlength=len(terms)), out=post_off[1:])
+        term_off = array('Q', [0])
+        with tempfile.TemporaryFile() as blob:
+            for t in terms:
+                blob.write(t.encode('utf-8'))
+                term_off.append(blob.tell())
+            write_sections(self.path, MAGIC, [
+                ('terms.off', term_off.tobytes()), ('terms.blob', blob),
+                ('post.off', post_off.tobytes()), ('rows', rows.tobytes()), ('tf', tfs.tobytes()),
+                ('lengths', self._lengths.tobytes()),
+            ])
+        self._term_ids = {}
+        self._terms, self._rows, self._tfs = array('I'), array('I'), array('I')
+        return self.path
+
+
+def write_bm25(path, texts):
+    w = BM25Writer(path)
+    w.add_many(texts)
+    return w.close()
+
+
+class BM25Index:
+    """Read-only, mmap-backed BM25 index; `search` returns (rows, scores) best first."""
+
+    def __init__(self, path, k1=1.2, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._mm, sec = read_sections(path, MAGIC)
+        self._term_off = section_array(self._mm, sec, 'terms.off', np.uint64)
+        self._terms_base = sec['terms.blob'][0]
+        self._post_off = section_array(self._mm, sec, 'post.off', np.uint64)
+        self._rows = section_array(self._mm, sec, 'rows', np.uint32)
+        self._tf = section_array(self._mm, sec, 'tf', np.uint16)
+        self.lengths = section_array(self._mm, sec, 'lengths', np.uint32)
+        self.avgdl = float(self.lengths.mean()) if len(self.lengths) else 0.0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def _term(self, i):
+        a, b = int(self._term_off[i]), int(self._term_off[i + 1])
+        return self._mm[self._terms_base + a:self._terms_base + b]
+
+    def _find(self, term):
+        key = term.encode('utf-8')
+        lo, hi = 0, len(self._term_off) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo if lo < len(self._term_off) - 1 and self._term(lo) == key else None
+
+    def postings(self, term):
+        i = self._find(term)
+        if i is None:
+            return self._rows[:0], self._tf[:0]
+        a, b = int(self._post_off[i]), int(self._post_off[i + 1])
+        return self._rows[a:b], self._tf[a:b]
+
+    def search(self, query, top_k=10, allow=None):
+        """`allow` is an optional boolean mask over rows; other rows never score."""
+        n = len(self)
+        rows_all, scores_all = [], []
+        for term in set(tokenize(query)):
+            rows, tf = self.postings(term)
+            if not len(rows):
+                continue
+            idf = math.log(1.0 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            tf = tf.astype(np.float32)
+            norm = self.k1 * (1.0 - self.b + self.b * self.lengths[rows] / max(self.avgdl, 1e-9))
+            rows_all.append(rows)
+            scores_all.append(idf * tf * (self.k1 + 1.0) / (tf + norm))
+        if not rows_all:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows, inverse = np.unique(np.concatenate(rows_all), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(scores_all)).astype(np.float32)
+        if allow is not None:
+            keep = allow[rows]
+            rows, scores = rows[keep], scores[keep]
+        if len(rows) > top_k:
+            top = np.argpartition(-scores, top_k)[:top_k]
+            rows, scores = rows[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return rows[order].astype(np.int64), scores[order]
+
+    def close(self):
+        self._mm.close()
+
+
+def write_for_index(index_path, texts, enabled=True):
+    """Write `<index>.bm25`, or remove a stale one when keyword indexing is disabled."""
+    path = bm25_path(index_path)
+    if enabled:
+        return write_bm25(path, texts)
+    if os.path.exists(path):
+        os.remove(path)
+    return None
+
+
+def load_bm25(index_path):
+    try:
+        return BM25Index(bm25_path(index_path))
+    except FileNotFoundError:
+        return None
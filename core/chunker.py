@@ -1,59 +1,150 @@
+"""Sentence-aware chunking over character offsets.
+
+`chunk_spans` makes one pass over the sentence boundaries of a text and returns
+(start, end) offsets; text is only sliced when a chunk is emitted. Chunk sizes
+are measured either in characters or, when a `count_tokens` callable is given,
+in tokenizer tokens (each sentence is tokenized once). Overlap is made of whole
+trailing sentences of the previous chunk and always counts against the size
+budget, so no chunk exceeds the maximum. Sentences longer than the budget are
+cut into overlapping windows.
+"""
+
 import re
+from functools import partial
+from itertools import accumulate
+from core.procpool import process_pool
 
 SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_LEADING_WS = re.compile(r'\s*')
 
 def split_into_sentences(text):
+    return [text[a:b] for a, b in sentence_spans(text)]
+
+def sentence_spans(text):
+    spans = []
     if not text:
-        return []
-    parts = SENTENCE_END.split(text.strip())
-    return [p.strip() for p in parts if p.strip()]
-
-def chunk_text(text, max_chars=2000, overlap=200):
-    sentences = split_into_sentences(text)
-    chunks = []
-    cur = []
-    cur_len = 0
-    for s in sentences:
-        if cur_len + len(s) + 1 <= max_chars:
-            cur.append(s)
-            cur_len += len(s) + 1
-        else:
-            if cur:
-                chunks.append(' '.join(cur))
-            if len(s) > max_chars:
-                start = 0
-                while start < len(s):
-                    chunks.append(s[start:start+max_chars])
-                    start += max_chars - overlap
-                cur = []
-                cur_len = 0
-            else:
-                cur = [s]
-                cur_len = len(s) + 1
-    if cur:
-        chunks.append(' '.join(cur))
-    if overlap and len(chunks) > 1:
-        out = []
-        for i, c in enumerate(chunks):
-            if i == 0:
-                out.append(c)
-            else:
-                prev = out[-1]
-                tail = prev[-overlap:] if len(prev) > overlap else prev
-                out.append(tail + '\n' + c)
-        return out
-    return chunks
-
-def docs_to_chunks(docs, max_chars=2000, overlap=200):
+        return spans
+    pos = 0
+    for m in SENTENCE_END.finditer(text):
+        _add_span(text, pos, m.start(), spans)
+        pos = m.end()
+    _add_span(text, pos, len(text), spans)
+    return spans
+
+def _add_span(text, a, b, spans):
+    a = _LEADING_WS.match(text, a, b).end()
+    while b > a and text[b - 1].isspace():
+        b -= 1
+    if b > a:
+        spans.append((a, b))
+
+def _windows(a, b, size, max_size, overlap):
+    """Overlapping windows over one oversized sentence [a, b) of `size` units."""
+    per_unit = (b - a) / float(size)
+    width = max(1, int(max_size * per_unit))
+    step = max(1, width - int(overlap * per_unit))
+    out = []
+    while True:
+        out.append((a, min(a + width, b)))
+        if a + width >= b:
+            return out
+        a += step
+
+def chunk_spans(text, max_size=2000, overlap=200, count_tokens=None):
+    spans = sentence_spans(text)
+    n = len(spans)
+    if count_tokens is None:
+        def cost(i, j):
+            return spans[j - 1][1] - spans[i][0]
+    else:
+        cum = list(accumulate((count_tokens(text[a:b]) for a, b in spans), initial=0))
+        def cost(i, j):
+            return cum[j] - cum[i]
+    out = []
+    i = 0
+    for j in range(n):
+        size = cost(j, j + 1)
+        if size > max_size:
+            if i < j:
+                out.append((spans[i][0], spans[j - 1][1]))
+            out.extend(_windows(spans[j][0], spans[j][1], size, max_size, overlap))
+            i = j + 1
+            continue
+        if cost(i, j + 1) <= max_size:
+            continue
+        out.append((spans[i][0], spans[j - 1][1]))
+        # carry trailing sentences of the emitted chunk while they fit both budgets
+        k = j
+        while k > i and cost(k - 1, j) <= overlap and cost(k - 1, j + 1) <= max_size:
+            k -= 1
+        i = k
+    if i < n:
+        out.append((spans[i][0], spans[n - 1][1]))
+    return out
+
+def chunk_text(text, max_chars=2000, overlap=200, max_tokens=None, count_tokens=None):
+    if max_tokens and count_tokens is not None:
+        return [text[a:b] for a, b in chunk_spans(text, max_tokens, overlap, count_tokens)]
+    return [text[a:b] for a, b in chunk_spans(text, max_chars, overlap)]
+
+def _doc_chunks(doc, max_size, overlap, count_tokens):
+    text = doc['text']
+    meta = doc.get('meta', {})
+    out = []
+    for i, (a, b) in enumerate(chunk_spans(text, max_size, overlap, count_tokens)):
+        out.append({
+            'id': f"{doc['id']}#chunk-{i}",
+            'source': meta.get('source', doc['id']),
+            'title': meta.get('title'),
+            'text': text[a:b],
+            'meta': meta,
+            'char_start': a,
+            'char_end': b,
+        })
+    return out
+
+def _chunk_docs(docs, max_size, overlap, count_tokens):
     out = []
     for doc in docs:
-        chunks = chunk_text(doc['text'], max_chars, overlap)
-        for i, c in enumerate(chunks):
-            out.append({
-                'id': f"{doc['id']}#chunk-{i}",
-                'source': doc.get('meta', {}).get('source', doc['id']),
-                'title': doc.get('meta', {}).get('title'),
-                'text': c,
-                'meta': doc.get('meta', {})
-            })
+        out.extend(_doc_chunks(doc, max_size, overlap, count_tokens))
     return out
+
+def docs_to_chunks(docs, max_chars=2000, overlap=200, max_tokens=None, count_tokens=None, workers=None):
+    """Chunk documents, skipping 'unchanged' stubs.
+
+    With `max_tokens` and a `count_tokens` callable, sizes and `overlap` are in
+    tokens. With `workers` > 1, documents are chunked on a shared process pool
+    (`count_tokens` must then be picklable); output order is unchanged.
+    """
+    docs = [d for d in docs if not (d.get('unchanged') or d.get('error'))]
+    if not (max_tokens and count_tokens is not None):
+        max_tokens, count_tokens = None, None
+    fn = partial(_chunk_docs, max_size=max_tokens or max_chars, overlap=overlap, count_tokens=count_tokens)
+    if not workers or workers < 2 or len(docs) < 2:
+        return fn(docs)
+    step = max(1, len(docs) // (workers * 4))
+    out = []
+    for part in process_pool(workers).map(fn, [docs[i:i + step] for i in range(0, len(docs), step)]):
+        out.extend(part)
+    return out
+
+def chunk_docs(docs, config):
+    """docs_to_chunks with the sizing from the config's `pipeline` section.
+
+    `chunk_max_tokens` switches to token budgets measured with the embedding
+    model's tokenizer (`chunk_overlap_tokens`, default 10%); `chunk_workers`
+    enables the process pool.
+    """
+    pipe = config.get('pipeline', {})
+    kw = {'max_chars': pipe.get('chunk_max_chars', 2000), 'overlap': pipe.get('chunk_overlap', 200),
+          'workers': pipe.get('chunk_workers')}
+    if pipe.get('chunk_max_tokens'):
+        from core.embedder import token_counter
+        counter = token_counter(config)
+        if counter is None:
+            print('no tokenizer for the embedding model, sizing chunks by characters')
+        else:
+            max_tokens = int(pipe['chunk_max_tokens'])
+            kw.update(max_tokens=max_tokens, count_tokens=counter,
+                      overlap=pipe.get('chunk_overlap_tokens', max_tokens // 10))
+    return docs_to_chunks(docs, **kw)
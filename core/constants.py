@@ -8,9 +8,28 @@ INDEX = 'index'
 PROVIDER = 'provider'
 MODEL = 'model'
 API_KEY = 'api_key'
+REMOTE_URL = 'remote_url'
+ONNX_PATH = 'onnx_path'
+BATCH_SIZE = 'batch_size'
 PATH = 'path'
+METRIC = 'metric'
+HYBRID = 'hybrid'
+MMAP = 'mmap'
+RELOAD_INTERVAL = 'reload_interval'
+CACHE = 'cache'
+SERVICE = 'service'
+QUERY_CACHE = 'query_cache'
+MODE = 'mode'
+RERANK = 'rerank'
+PROFILE_DIR = 'profile_dir'
+PROFILER = 'profiler'
 
 # Provider types
 PROVIDER_AUTO = 'auto'
 PROVIDER_OPENAI = 'openai'
-PROVIDER_SENTENCE_TRANSFORMERS = 'sentence-transformers'
\ No newline at end of file
+PROVIDER_SENTENCE_TRANSFORMERS = 'sentence-transformers'
+PROVIDER_ONNX = 'onnx'
+
+# Service modes
+MODE_SYNC = 'sync'
+MODE_ASYNC = 'async'
\ No newline at end of file
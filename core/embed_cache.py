@@ -0,0 +1,141 @@
+"""Persistent, content-addressed embedding cache.
+
+Vectors are stored as raw float32 blobs in SQLite, keyed by (model, sha1 of the
+normalized chunk text), so unchanged chunks are never embedded twice across
+pipeline runs. When the cache grows past `max_bytes`, the least recently used
+entries are evicted.
+"""
+
+import hashlib, os, re, sqlite3, threading, time, unicodedata
+import numpy as np
+from core import constants
+
+_WS = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    return _WS.sub(' ', unicodedata.normalize('NFC', text)).strip()
+
+
+def text_key(text):
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path, max_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS embeddings ('
+                         'model TEXT NOT NULL, key BLOB NOT NULL, vec BLOB NOT NULL, last_used REAL NOT NULL, '
+                         'PRIMARY KEY (model, key))')
+        self._db.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+        self._db.commit()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = self._db.execute('SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM embeddings').fetchone()[0]
+
+    def get_many(self, model, keys):
+        """Return one float32 vector (or None on a miss) per key."""
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                part = keys[i:i + 500]
+                q = 'SELECT key, vec FROM embeddings WHERE model = ? AND key IN (%s)' % ','.join('?' * len(part))
+                for k, v in self._db.execute(q, [model] + part):
+                    found[k] = v
+            if found:
+                now = time.time()
+                self._db.executemany('UPDATE embeddings SET last_used = ? WHERE model = ? AND key = ?',
+                                     [(now, model, k) for k in found])
+                self._db.commit()
+            n_hit = sum(k in found for k in keys)
+            self.hits += n_hit
+            self.misses += len(keys) - n_hit
+        return [np.frombuffer(found[k], dtype=np.float32) if k in found else None for k in keys]
+
+    def _stored_bytes(self, model, keys):
+        """Bytes already stored under `keys`, which an INSERT OR REPLACE of them gives back."""
+        n = 0
+        for i in range(0, len(keys), 500):
+            part = keys[i:i + 500]
+            q = 'SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM embeddings WHERE model = ? AND key IN (%s)' % ','.join(
+                '?' * len(part))
+            n += self._db.execute(q, [model] + part).fetchone()[0]
+        return n
+
+    def put_many(self, model, keys, vecs):
+        now = time.time()
+        # one row per key (the last vector wins, as it would in the table)
+        rows = list({k: (model, k, np.ascontiguousarray(v, dtype=np.float32).tobytes(), now)
+                     for k, v in zip(keys, vecs)}.values())
+        with self._lock:
+            replaced = self._stored_bytes(model, [r[1] for r in rows])
+            self._db.executemany('INSERT OR REPLACE INTO embeddings (model, key, vec, last_used) VALUES (?, ?, ?, ?)',
+                                 rows)
+            self._db.commit()
+            self._size += sum(len(r[2]) for r in rows) - replaced
+            if self.max_bytes and self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        target = int(self.max_bytes * 0.9)
+        while self._size > target:
+            rows = self._db.execute('SELECT model, key, LENGTH(vec) FROM embeddings '
+                                    'ORDER BY last_used, rowid LIMIT 1000').fetchall()
+            if not rows:
+                break
+            victims = []
+            for m, k, n in rows:
+                if self._size <= target:
+                    break
+                victims.append((m, k))
+                self._size -= n
+            self._db.executemany('DELETE FROM embeddings WHERE model = ? AND key = ?', victims)
+            self.evictions += len(victims)
+        self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            hits, misses, evictions, size = self.hits, self.misses, self.evictions, self._size
+        total = hits + misses
+        return {'hits': hits, 'misses': misses, 'hit_rate': round(hits / total, 4) if total else 0.0,
+                'evictions': evictions, 'entries': entries, 'bytes': size}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def cached_embed(embedder, texts, cache):
+    """Embed `texts` through `cache`: only misses reach the embedder, each distinct text once."""
+    model = embedder.cache_key
+    keys = [text_key(t) for t in texts]
+    vecs = cache.get_many(model, keys)
+    todo = {}
+    for i, (k, v) in enumerate(zip(keys, vecs)):
+        if v is None:
+            todo.setdefault(k, i)
+    if todo:
+        fresh = np.asarray(embedder.embed([texts[i] for i in todo.values()]), dtype=np.float32)
+        cache.put_many(model, list(todo), fresh)
+        by_key = dict(zip(todo, fresh))
+        vecs = [by_key[k] if v is None else v for k, v in zip(keys, vecs)]
+    if not vecs:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.vstack(vecs)
+
+
+def get_embed_cache(config):
+    cfg = (config.get(constants.EMBEDDING) or {}).get(constants.CACHE)
+    if not cfg or not cfg.get('path'):
+        return None
+    max_mb = cfg.get('max_mb')
+    return EmbeddingCache(cfg['path'], max_bytes=int(max_mb * 1024 * 1024) if max_mb else None)
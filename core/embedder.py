@@ -1,7 +1,9 @@
-import os, time, numpy as np
-from core.utils import load_config
+import base64, json, os, threading, numpy as np
+from concurrent.futures import ThreadPoolExecutor
 import abc
 from core import constants
+from core.embed_cache import cached_embed, get_embed_cache
+from core.ratelimit import TokenBucket, parse_duration, retry_call
 
 class Embedder(abc.ABC):
     def __init__(self, model_name):
@@ -11,49 +13,352 @@ class Embedder(abc.ABC):
     def embed(self, texts):
         pass
 
+    @property
+    def cache_key(self):
+        """Identifies this embedder's vector space in the embedding cache."""
+        return self.model_name
+
     def embed_query(self, query):
         return self.embed([query])[0]
 
 class OpenAIEmbedder(Embedder):
-    def __init__(self, model_name, api_key):
+    """Concurrent, token-packed embedding requests under an RPM / TPM budget.
+
+    Texts are packed into requests of at most `batch_size` inputs and
+    `batch_tokens` tokens (the API caps both per request). Up to
+    `concurrency` requests run at once, paced by two shared token buckets
+    for `rpm` and `tpm`. The x-ratelimit-* response headers can lower those
+    rates to the account's real limits, and they hold every worker when a
+    budget is about to run out. 429 / 5xx / connection errors are retried
+    with backoff that honours Retry-After. `base_url` points the client at an
+    OpenAI-compatible server.
+    """
+    def __init__(self, model_name, api_key, base_url=None, concurrency=8, rpm=3000, tpm=1000000, batch_size=512,
+                 batch_tokens=100000, retries=6):
         super().__init__(model_name)
         from openai import OpenAI
-        self.client = OpenAI(api_key=api_key)
-
-    def embed(self, texts, batch_size=16):
-        embs = []
-        for i in range(0, len(texts), batch_size):
-            batch_texts = texts[i:i+batch_size]
-            resp = self.client.embeddings.create(input=batch_texts, model=self.model_name)
-            for d in resp.data:
-                embs.append(d.embedding)
-            time.sleep(0.2)
-        return embs
+        # retries are ours, so they share the rate budget with every other request
+        self.client = OpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.batch_tokens = batch_tokens
+        self.retries = retries
+        self.requests = TokenBucket(rpm / 60.0)
+        self.tokens = TokenBucket(tpm / 60.0, burst=max(tpm / 60.0, batch_tokens))
+        self._count = _api_token_counter(model_name)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _pack(self, texts):
+        """(row indices, token count) per request, in input order."""
+        batches, rows, total = [], [], 0
+        for i, t in enumerate(texts):
+            n = self._count(t)
+            if rows and (len(rows) >= self.batch_size or total + n > self.batch_tokens):
+                batches.append((rows, total))
+                rows, total = [], 0
+            rows.append(i)
+            total += n
+        if rows:
+            batches.append((rows, total))
+        return batches
+
+    def _create(self, texts, n_tokens):
+        self.tokens.acquire(n_tokens)
+        raw = self.client.embeddings.with_raw_response.create(input=texts, model=self.model_name)
+        self._observe(raw.headers)
+        data = sorted(raw.parse().data, key=lambda d: d.index)
+        return np.asarray([d.embedding for d in data], dtype='float32')
+
+    def _observe(self, headers):
+        """Adapt to the server's view of the budget before it starts returning 429s."""
+        for kind, bucket, low in (('requests', self.requests, 1), ('tokens', self.tokens, self.batch_tokens)):
+            limit = headers.get('x-ratelimit-limit-' + kind)
+            if limit and limit.isdigit() and int(limit) / 60.0 < bucket.rate:
+                bucket.rate = int(limit) / 60.0
+            remaining = headers.get('x-ratelimit-remaining-' + kind)
+            reset = parse_duration(headers.get('x-ratelimit-reset-' + kind))
+            if remaining and remaining.isdigit() and int(remaining) < low and reset:
+                # every request passes the request bucket, so pausing it holds all workers
+                self.requests.pause(reset)
+
+    def _send(self, batch, texts):
+        rows, n_tokens = batch
+        return retry_call(self._create, [texts[i] for i in rows], n_tokens, retries=self.retries,
+                          limiter=self.requests)
+
+    def embed(self, texts):
+        texts = list(texts)
+        batches = self._pack(texts)
+        if not batches:
+            return np.zeros((0, 0), dtype='float32')
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='openai-embed')
+        out = None
+        for (rows, _), vecs in zip(batches, self._pool.map(self._send, batches, [texts] * len(batches))):
+            if out is None:
+                out = np.empty((len(texts), vecs.shape[1]), dtype='float32')
+            out[rows] = vecs
+        return out
+
+def _api_token_counter(model_name):
+    """tiktoken counts when available, else a conservative estimate (~3 utf-8 bytes per token)."""
+    counter = TokenCounter('tiktoken', model_name)
+    try:
+        counter('probe')
+        return counter
+    except Exception:
+        return lambda text: len(text.encode('utf-8')) // 3 + 1
 
 class SentenceTransformerEmbedder(Embedder):
-    def __init__(self, model_name):
+    """The model is loaded on first use, so processes that never embed never pay for it."""
+    def __init__(self, model_name, batch_size=32):
         super().__init__(model_name)
-        from sentence_transformers import SentenceTransformer
-        self._st_model = SentenceTransformer(model_name)
+        self.batch_size = batch_size
+        self._model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def _st_model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model
 
     def embed(self, texts):
-        embs = self._st_model.encode(texts, show_progress_bar=False)
-        return [e.tolist() if hasattr(e, 'tolist') else e for e in embs]
+        # encode() already length-sorts its batches; keep the result as one float32 matrix
+        embs = self._st_model.encode(texts, batch_size=self.batch_size, show_progress_bar=False, convert_to_numpy=True)
+        return np.ascontiguousarray(embs, dtype='float32')
+
+class OnnxEmbedder(Embedder):
+    """Sentence embeddings from a model exported by scripts/export_onnx.py (fp32 or int8) on ONNX Runtime.
+
+    `model_dir` holds model.onnx, tokenizer.json and embedder.json (model name,
+    pooling, normalization, max length, pad id). Texts are tokenized once and
+    sorted by length, so each batch pads only to its own longest text. Returns
+    one contiguous float32 matrix.
+    """
+    def __init__(self, model_dir, batch_size=64, threads=None):
+        with open(os.path.join(model_dir, 'embedder.json'), 'r', encoding='utf-8') as f:
+            self.spec = json.load(f)
+        super().__init__(self.spec['model'])
+        self.model_dir = model_dir
+        self.batch_size = batch_size
+        self.threads = threads
+        self._session = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def cache_key(self):
+        # quantized / exported vectors differ slightly from the original model's
+        return '%s#onnx-%s' % (self.model_name, self.spec.get('quantize') or 'fp32')
+
+    def _load(self):
+        with self._load_lock:
+            if self._session is not None:
+                return
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+            opts = ort.SessionOptions()
+            if self.threads:
+                opts.intra_op_num_threads = self.threads
+            tok = Tokenizer.from_file(os.path.join(self.model_dir, 'tokenizer.json'))
+            tok.no_padding()
+            tok.enable_truncation(self.spec['max_length'])
+            self._tokenizer = tok
+            session = ort.InferenceSession(os.path.join(self.model_dir, 'model.onnx'), opts,
+                                           providers=['CPUExecutionProvider'])
+            self._inputs = {i.name for i in session.get_inputs()}
+            self._session = session
+
+    def _pool(self, hidden, mask):
+        if self.spec.get('pooling') == 'cls':
+            out = hidden[:, 0]
+        else:
+            m = mask[:, :, None].astype('float32')
+            out = (hidden * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+        return normalize(out) if self.spec.get('normalize') else out
+
+    def embed(self, texts):
+        if self._session is None:
+            self._load()
+        encs = self._tokenizer.encode_batch(list(texts))
+        lengths = np.fromiter((len(e.ids) for e in encs), dtype=np.int64, count=len(encs))
+        order = np.argsort(lengths, kind='stable')
+        out = np.empty((len(encs), self.spec['dim']), dtype='float32')
+        for start in range(0, len(order), self.batch_size):
+            rows = order[start:start + self.batch_size]
+            ids = np.full((len(rows), int(lengths[rows].max())), self.spec.get('pad_id', 0), dtype=np.int64)
+            mask = np.zeros_like(ids)
+            for j, i in enumerate(rows):
+                ids[j, :lengths[i]] = encs[i].ids
+                mask[j, :lengths[i]] = 1
+            feeds = {'input_ids': ids, 'attention_mask': mask}
+            if 'token_type_ids' in self._inputs:
+                feeds['token_type_ids'] = np.zeros_like(ids)
+            out[rows] = self._pool(self._session.run(None, feeds)[0], mask)
+        return out
+
+def pack_vectors(vectors):
+    """JSON-safe float32 matrix: base64 of the raw bytes plus its shape."""
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    return {'shape': list(vectors.shape), 'data': base64.b64encode(vectors.tobytes()).decode('ascii')}
+
+def unpack_vectors(payload):
+    return np.frombuffer(base64.b64decode(payload['data']), dtype='float32').reshape(payload['shape'])
+
+class RemoteEmbedder(Embedder):
+    """Client of the shared embedding server (mcp/embed_server.py): one model per host instead of per worker.
+
+    The server reports its embedder's cache key, so vectors from an ONNX or
+    quantized server model are cached apart from the original model's.
+    """
+    def __init__(self, url, model_name, timeout=30, session=None):
+        super().__init__(model_name)
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        if session is None:
+            import requests
+            session = requests.Session()
+        self.session = session
+        self._remote_key = None
+
+    @property
+    def cache_key(self):
+        if self._remote_key is None:
+            resp = self.session.get(self.url + '/health', timeout=self.timeout)
+            resp.raise_for_status()
+            self._check(resp.json()['model'])
+        return self._remote_key
+
+    def _check(self, key):
+        if key.split('#')[0] != self.model_name:
+            raise RuntimeError('embedding server runs %r, expected %r' % (key, self.model_name))
+        self._remote_key = key
+
+    def embed(self, texts):
+        resp = self.session.post(self.url + '/embed', json={'texts': list(texts)}, timeout=self.timeout)
+        resp.raise_for_status()
+        body = resp.json()
+        self._check(body['model'])
+        return unpack_vectors(body['embeddings'])
+
+def normalize(vectors):
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class NormalizedEmbedder(Embedder):
+    """Unit-length vectors for the cosine metric; normalized once here, stored and searched as inner products."""
+    def __init__(self, inner):
+        super().__init__(inner.model_name)
+        self.inner = inner
+
+    @property
+    def cache_key(self):
+        return self.inner.cache_key + '#normalized'
+
+    def embed(self, texts):
+        return normalize(self.inner.embed(texts))
+
+def with_metric(embedder, config):
+    """Wrap `embedder` so its vectors match `index.metric` (only cosine needs normalizing)."""
+    metric = config.get(constants.INDEX, {}).get(constants.METRIC, 'l2')
+    if metric == 'cosine' and not isinstance(embedder, NormalizedEmbedder):
+        return NormalizedEmbedder(embedder)
+    return embedder
+
+OPENAI_OPTIONS = ('base_url', 'concurrency', 'rpm', 'tpm', 'batch_size', 'batch_tokens', 'retries')
 
 def get_embedder(config):
     provider = config.get(constants.EMBEDDING, {}).get(constants.PROVIDER, constants.PROVIDER_AUTO)
     model_name = config.get(constants.EMBEDDING, {}).get(constants.MODEL)
     api_key = config.get(constants.EMBEDDING, {}).get(constants.API_KEY)
+    remote_url = config.get(constants.EMBEDDING, {}).get(constants.REMOTE_URL)
+    batch_size = config.get(constants.EMBEDDING, {}).get(constants.BATCH_SIZE)
 
+    use_openai = provider == constants.PROVIDER_OPENAI or (provider == constants.PROVIDER_AUTO and model_name and model_name.startswith('text-embedding'))
+    model_name = model_name or ('text-embedding-3-small' if use_openai else 'all-MiniLM-L6-v2')
+    if remote_url:
+        embedder = RemoteEmbedder(remote_url, model_name)
+    elif provider == constants.PROVIDER_ONNX:
+        onnx_dir = config.get(constants.EMBEDDING, {}).get(constants.ONNX_PATH)
+        embedder = OnnxEmbedder(onnx_dir, batch_size or 64, config.get(constants.EMBEDDING, {}).get('threads'))
+    elif use_openai:
+        opts = {k: v for k, v in config.get(constants.EMBEDDING, {}).items() if k in OPENAI_OPTIONS and v}
+        embedder = OpenAIEmbedder(model_name, api_key, **opts)
+    else:
+        embedder = SentenceTransformerEmbedder(model_name, batch_size or 32)
+    return with_metric(embedder, config)
+
+class TokenCounter:
+    """Picklable token counter; the tokenizer is loaded lazily so each worker process loads its own."""
+    def __init__(self, kind, model_name):
+        self.kind = kind
+        self.model_name = model_name
+        self._encode = None
+
+    def __getstate__(self):
+        return {'kind': self.kind, 'model_name': self.model_name, '_encode': None}
+
+    def _load(self):
+        if self.kind == 'tiktoken':
+            import tiktoken
+            try:
+                enc = tiktoken.encoding_for_model(self.model_name)
+            except KeyError:
+                enc = tiktoken.get_encoding('cl100k_base')
+            return enc.encode
+        from transformers import AutoTokenizer
+        name = self.model_name if '/' in self.model_name else 'sentence-transformers/' + self.model_name
+        tok = AutoTokenizer.from_pretrained(name)
+        return lambda text: tok.encode(text, add_special_tokens=False)
+
+    def __call__(self, text):
+        if self._encode is None:
+            self._encode = self._load()
+        return len(self._encode(text))
+
+_COUNTERS = {}
+
+def token_counter(config):
+    """TokenCounter for the configured embedding model, or None if its tokenizer library is missing."""
+    provider = config.get(constants.EMBEDDING, {}).get(constants.PROVIDER, constants.PROVIDER_AUTO)
+    model_name = config.get(constants.EMBEDDING, {}).get(constants.MODEL)
     if provider == constants.PROVIDER_OPENAI or (provider == constants.PROVIDER_AUTO and model_name and model_name.startswith('text-embedding')):
-        return OpenAIEmbedder(model_name or 'text-embedding-3-small', api_key)
+        kind, model_name = 'tiktoken', model_name or 'text-embedding-3-small'
     else:
-        return SentenceTransformerEmbedder(model_name or 'all-MiniLM-L6-v2')
+        kind, model_name = 'hf', model_name or 'all-MiniLM-L6-v2'
+    if (kind, model_name) not in _COUNTERS:
+        counter = TokenCounter(kind, model_name)
+        try:
+            counter('probe')
+        except Exception as e:
+            print('tokenizer unavailable:', e)
+            counter = None
+        _COUNTERS[kind, model_name] = counter
+    return _COUNTERS[kind, model_name]
 
-def embed_chunks(chunks, config):
-    embedder = get_embedder(config)
+def embed_chunks(chunks, config, embedder=None, cache=None):
+    embedder = with_metric(embedder or get_embedder(config), config)
     texts = [c['text'] for c in chunks]
-    vecs = embedder.embed(texts)
+    if cache is not None:
+        vecs = cached_embed(embedder, texts, cache)
+    else:
+        cache = get_embed_cache(config)
+        if cache is None:
+            vecs = embedder.embed(texts)
+        else:
+            # opened here, so closed here
+            try:
+                vecs = cached_embed(embedder, texts, cache)
+                print('embedding cache:', cache.stats())
+            finally:
+                cache.close()
     for c, v in zip(chunks, vecs):
         c['embedding'] = v
     return chunks
@@ -0,0 +1,343 @@
+"""Metadata filter index (the `.filters` index sidecar) and FAISS ID selectors.
+
+Every chunk contributes (field, value) keys: `source`, `title`, `doc` (the
+document id: file path, s3://bucket/key, URL or Notion page id) and each
+scalar (or list-of-scalars) key of its document meta. Keys are stored sorted
+as `field\\0value` in a utf-8 blob with an offset table, each with a sorted
+run of FAISS ids. An equality is then one binary search, and a prefix is one
+contiguous key range. Same section layout as the metastore
+(see core.metastore.write_sections).
+
+A filter is a dict, AND-ed across fields:
+
+    {"source": "notion"}                      equality
+    {"source": ["notion", "s3"]}              any of
+    {"doc": {"prefix": "s3://bucket/docs/"}}  prefix (also {"in": [...]}, {"eq": ...})
+
+`FilterIndex.select` turns a filter into a `Selection`. Its bitmap
+IDSelector restricts FAISS search to the matching ids, so the engine never
+scores the rest and no over-fetching is needed.
+"""
+
+import json, math, os, threading
+from array import array
+import numpy as np
+from core.metastore import read_sections, section_array, write_sections
+
+MAGIC = b'RAGFILT1'
+COLUMNS = ('source', 'title')
+MAX_VALUE_CHARS = 512
+_CACHE_SIZE = 64
+
+
+def filters_path(index_path):
+    return index_path + '.filters'
+
+
+def _value(v):
+    if isinstance(v, str):
+        return v if len(v) <= MAX_VALUE_CHARS else None
+    if isinstance(v, (bool, int, float)):
+        return json.dumps(v)
+    return None
+
+
+def chunk_fields(chunk):
+    """(field, value) pairs indexed for one chunk (or metastore row)."""
+    out = [(f, chunk.get(f)) for f in COLUMNS]
+    if chunk.get('id'):
+        out.append(('doc', str(chunk['id']).rsplit('#chunk-', 1)[0]))
+    for k, v in (chunk.get('meta') or {}).items():
+        if k in COLUMNS or k == 'doc':
+            continue
+        for item in (v if isinstance(v, list) else [v]):
+            out.append((k, item))
+    return [(f, s) for f, s in ((f, _value(v)) for f, v in out) if s is not None]
+
+
+class FilterWriter:
+    """Add chunks with their FAISS ids; `close()` writes the sidecar atomically."""
+
+    def __init__(self, path):
+        self.path = path
+        self._key_ids = {}
+        self._keys = array('I')
+        self._ids = array('q')
+
+    def add(self, chunk, faiss_id):
+        keys = self._key_ids
+        pairs = set(chunk_fields(chunk))
+        self._keys.extend([keys.setdefault('%s\0%s' % p, len(keys)) for p in pairs])
+        self._ids.extend([int(faiss_id)] * len(pairs))
+
+    def close(self):
+        keys = sorted(self._key_ids)
+        rank = np.empty(len(keys), dtype=np.uint32)
+        rank[[self._key_ids[k] for k in keys]] = np.arange(len(keys), dtype=np.uint32)
+        kcol = rank[np.frombuffer(self._keys, dtype=np.uint32)]
+        ids = np.frombuffer(self._ids, dtype=np.int64)
+        order = np.lexsort((ids, kcol))
+        post_off = np.zeros(len(keys) + 1, dtype=np.uint64)
+        np.cumsum(np.bincount(kcol, minlength=len(keys)), out=post_off[1:])
+        blob = bytearray()
+        key_off = array('Q', [0])
+        for k in keys:
+            blob += k.encode('utf-8')
+            key_off.append(len(blob))
+        write_sections(self.path, MAGIC, [
+            ('keys.off', key_off.tobytes()), ('keys.blob', bytes(blob)),
+            ('post.off', post_off.tobytes()), ('ids', ids[order].tobytes()),
+        ])
+        self._key_ids, self._keys, self._ids = {}, array('I'), array('q')
+        return self.path
+
+
+def write_filters(path, chunks, ids=None):
+    w = FilterWriter(path)
+    for i, c in enumerate(chunks):
+        w.add(c, i if ids is None else ids[i])
+    return w.close()
+
+
+def write_filters_for_index(index_path, chunks, ids=None, enabled=True):
+    """Write `<index>.filters`, or remove a stale one when filtering is disabled."""
+    path = filters_path(index_path)
+    if enabled:
+        return write_filters(path, chunks, ids)
+    if os.path.exists(path):
+        os.remove(path)
+    return None
+
+
+class Selection:
+    """The FAISS ids matching one filter, with a bitmap ID selector over them.
+
+    Selections are cached and shared by concurrent searches, so the derived
+    structures are built once, under a lock.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.count = len(ids)
+        self._lock = threading.Lock()
+        self._selector = None
+        self._rows = None
+        self._subset = None
+        self._ranges = {}
+
+    @property
+    def selector(self):
+        with self._lock:
+            if self._selector is None:
+                import faiss
+                bits = np.zeros(int(self.ids[-1]) + 1 if self.count else 1, dtype=bool)
+                bits[self.ids] = True
+                bitmap = np.packbits(bits, bitorder='little')
+                selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+                # the selector points into the bitmap: keep it alive as long as the selector
+                selector.referenced_objects = [bitmap]
+                self._selector = selector
+            return self._selector
+
+    def subset(self, start, stop):
+        """The ids in [start, stop) shifted to start at 0: this selection within one index shard."""
+        with self._lock:
+            sel = self._ranges.get(start)
+            if sel is None:
+                lo, hi = np.searchsorted(self.ids, [start, stop])
+                sel = self._ranges[start] = Selection(self.ids[lo:hi] - start)
+            return sel
+
+    def flat_subset(self, storage):
+        """An exact IndexFlat over just the selected vectors of `storage` (see filtered_search)."""
+        with self._lock:
+            if self._subset is None:
+                import faiss
+                xb = faiss.rev_swig_ptr(storage.get_xb(), storage.ntotal * storage.d).reshape(storage.ntotal,
+                                                                                              storage.d)
+                sub = faiss.IndexFlat(storage.d, storage.metric_type)
+                sub.add(np.ascontiguousarray(xb[self.ids]))
+                self._subset = sub
+            return self._subset
+
+    def row_mask(self, meta):
+        """Boolean mask over metastore rows (BM25 addresses rows, not FAISS ids)."""
+        with self._lock:
+            if self._rows is None:
+                ids = getattr(meta, 'ids', None)
+                if ids is None:
+                    mask = np.zeros(len(meta), dtype=bool)
+                    mask[self.ids[self.ids < len(meta)]] = True
+                else:
+                    mask = np.isin(ids, self.ids)
+                self._rows = mask
+            return self._rows
+
+
+class FilterIndex:
+    """Read-only, mmap-backed filter sidecar; `select(filter)` returns a cached Selection."""
+
+    def __init__(self, path):
+        self.path = path
+        self._mm, sec = read_sections(path, MAGIC)
+        self._key_off = section_array(self._mm, sec, 'keys.off', np.uint64)
+        self._keys_base = sec['keys.blob'][0]
+        self._post_off = section_array(self._mm, sec, 'post.off', np.uint64)
+        self._ids = section_array(self._mm, sec, 'ids', np.int64)
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._key_off) - 1
+
+    def _key(self, i):
+        a, b = int(self._key_off[i]), int(self._key_off[i + 1])
+        return self._mm[self._keys_base + a:self._keys_base + b]
+
+    def _lower_bound(self, key):
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _postings(self, first, last):
+        return self._ids[int(self._post_off[first]):int(self._post_off[last])]
+
+    def _eq(self, field, value):
+        key = ('%s\0%s' % (field, value)).encode('utf-8')
+        i = self._lower_bound(key)
+        if i < len(self) and self._key(i) == key:
+            return self._postings(i, i + 1)
+        return self._ids[:0]
+
+    def _prefix(self, field, prefix):
+        key = ('%s\0%s' % (field, prefix)).encode('utf-8')
+        # 0xff never occurs in utf-8, so it bounds every key starting with `key`
+        first, last = self._lower_bound(key), self._lower_bound(key + b'\xff')
+        return np.unique(self._postings(first, last)) if last - first > 1 else self._postings(first, last)
+
+    def select(self, filter):
+        key = json.dumps(filter, sort_keys=True, ensure_ascii=False)
+        sel = self._cache.get(key)
+        if sel is None:
+            ids = None
+            for field, values, prefixes in filter_terms(filter):
+                part = _union([self._eq(field, _value(v)) for v in values] +
+                              [self._prefix(field, str(p)) for p in prefixes])
+                ids = part if ids is None else np.intersect1d(ids, part, assume_unique=True)
+            sel = Selection(np.ascontiguousarray(ids if ids is not None else self._ids[:0], dtype=np.int64))
+            with self._lock:
+                if len(self._cache) >= _CACHE_SIZE:
+                    self._cache.pop(next(iter(self._cache)))
+                self._cache[key] = sel
+        return sel
+
+    def close(self):
+        self._mm.close()
+
+
+def _terms(field, cond, values, prefixes):
+    if isinstance(cond, dict):
+        unknown = set(cond) - {'eq', 'in', 'prefix'}
+        if unknown:
+            raise ValueError('unknown filter operator(s) %s for %r' % (sorted(unknown), field))
+        if 'eq' in cond:
+            _terms(field, cond['eq'], values, prefixes)
+        if 'in' in cond:
+            _terms(field, list(cond['in']), values, prefixes)
+        if 'prefix' in cond:
+            prefixes.extend(cond['prefix'] if isinstance(cond['prefix'], list) else [cond['prefix']])
+    elif isinstance(cond, list):
+        for c in cond:
+            _terms(field, c, values, prefixes)
+    elif _value(cond) is None:
+        raise ValueError('unsupported filter value %r for %r' % (cond, field))
+    else:
+        values.append(cond)
+
+
+def filter_terms(filter):
+    """[(field, values, prefixes)] per filter field, validated (ValueError) but not yet resolved.
+
+    A chunk matches a field when it equals one of `values` or starts with one
+    of `prefixes`, and matches the filter when it matches every field. Stores
+    without a filter sidecar (Chroma, Milvus) translate these into their own
+    query language.
+    """
+    out = []
+    for field, cond in sorted(filter.items()):
+        values, prefixes = [], []
+        _terms(field, cond, values, prefixes)
+        out.append((field, values, prefixes))
+    return out
+
+
+def _union(parts):
+    if not parts:
+        return np.zeros(0, dtype=np.int64)
+    if len(parts) == 1:
+        return parts[0]
+    return np.unique(np.concatenate(parts))
+
+
+def load_filters(index_path):
+    try:
+        return FilterIndex(filters_path(index_path))
+    except FileNotFoundError:
+        return None
+
+
+def search_params(index, selection, top_k):
+    """FAISS SearchParameters restricting `index` to `selection`, keeping its nprobe / efSearch.
+
+    Selective filters leave few matches in the probed IVF lists or on the HNSW
+    beam, so nprobe / efSearch are widened until about 4 * top_k matches are
+    expected to be visited. Membership is a bitmap test, so the extra scanning
+    is cheap next to distance computations.
+    """
+    import faiss
+    base = index
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        base = faiss.downcast_index(index.index)
+    count = max(1, selection.count)
+    ivf = faiss.try_extract_index_ivf(base)
+    if ivf is not None:
+        # each probed list holds about count / nlist matches
+        nprobe = max(ivf.nprobe, math.ceil(4 * top_k * ivf.nlist / count))
+        return faiss.SearchParametersIVF(sel=selection.selector, nprobe=int(min(ivf.nlist, nprobe)))
+    if isinstance(base, faiss.IndexHNSW):
+        ef = max(base.hnsw.efSearch, math.ceil(top_k * index.ntotal / count))
+        return faiss.SearchParametersHNSW(sel=selection.selector, efSearch=int(min(index.ntotal, ef)))
+    return faiss.SearchParameters(sel=selection.selector)
+
+
+def _flat_storage(index, selection, top_k):
+    """The flat vector storage of an HNSW index when scanning `selection` exactly beats the widened beam."""
+    import faiss
+    if not isinstance(index, faiss.IndexHNSW):
+        return None
+    storage = faiss.downcast_index(index.storage)
+    if not isinstance(storage, faiss.IndexFlat):
+        return None
+    # the beam computes about efSearch * M distances; the scan, one per match
+    ef = max(index.hnsw.efSearch, math.ceil(top_k * index.ntotal / max(1, selection.count)))
+    return storage if selection.count <= ef * index.hnsw.nb_neighbors(0) // 2 else None
+
+
+def filtered_search(index, selection, x, top_k):
+    """`index.search` restricted to `selection`; returns (D, I) like FAISS.
+
+    A highly selective filter on an HNSW index would need a beam wide enough to
+    walk most of the graph, so its few matches are scanned exactly instead,
+    straight from the flat storage (also when it is mmap-ed).
+    """
+    k = min(top_k, selection.count)
+    storage = _flat_storage(index, selection, k)
+    if storage is None:
+        return index.search(x, k, params=search_params(index, selection, k))
+    D, I = selection.flat_subset(storage).search(x, k)
+    return D, np.where(I >= 0, selection.ids[np.maximum(I, 0)], -1)
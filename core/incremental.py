@@ -0,0 +1,155 @@
+"""Incremental index updates driven by per-document content hashes.
+
+A manifest next to the index (`<index>.docs.json` for FAISS) records, for every
+document id, the hash of its content and the ids of the chunks it produced. An
+update hashes the incoming documents, diffs them against the manifest and only
+chunks/embeds added or changed documents; chunks of changed or removed
+documents are deleted. FAISS indexes are kept in an `IndexIDMap2` over a flat
+index so chunk ids stay stable across updates (whatever `faiss-*` type is
+configured; approximate structures are only built by full rebuilds).
+
+Only chunking and embedding scale with the diff. Applying it to a FAISS index
+rewrites the index file and its metastore / BM25 / filter sidecars in full
+(see `FaissStore.update`), so an update still reads and writes O(corpus)
+bytes; Chroma and Milvus apply the diff in place.
+
+Loaders that can tell a document has not changed without fetching it (ETag,
+last_edited_time, ...) may yield `{'id': ..., 'unchanged': True}` stubs; those
+documents are kept as they are. So are documents whose fetch failed, which
+loaders report as `{'id': ..., 'error': ...}` stubs. A stub carries no content,
+so an update that has to start over (`needs_rebuild`) refuses stubs for
+documents it does not already hold; callers load such runs in full instead.
+"""
+
+import hashlib, json, os
+import numpy as np
+from core import constants
+from core.chunker import chunk_docs
+from core.embedder import embed_chunks
+from core.index_factory import is_faiss
+from core.vector_store import get_vector_store
+
+
+def doc_hash(doc):
+    h = hashlib.sha1()
+    h.update((doc.get('text') or '').encode('utf-8'))
+    h.update(json.dumps(doc.get('meta', {}), sort_keys=True, ensure_ascii=False, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+def manifest_path(config):
+    idx = config.get(constants.INDEX, {})
+    if idx.get('manifest'):
+        return idx['manifest']
+    if is_faiss(idx.get('type')):
+        return idx.get(constants.PATH, 'rag_index.faiss') + '.docs.json'
+    return (idx.get('collection_name') or 'rag_collection') + '.docs.json'
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(path + '.tmp', path)
+
+
+def diff_docs(docs, manifest, full=True):
+    """Split `docs` against `manifest` into (added, changed, removed ids, unchanged ids, failed ids).
+
+    With `full=True` the docs are a complete snapshot, so manifest entries that do
+    not appear are reported as removed; otherwise only upserts are computed.
+    Error stubs are failed fetches, never removals: their indexed chunks are kept.
+    """
+    known = manifest['docs'] if manifest else {}
+    added, changed, unchanged, failed, seen = [], [], [], [], set()
+    for doc in docs:
+        did = doc['id']
+        seen.add(did)
+        if doc.get('error'):
+            failed.append(did)
+            continue
+        if doc.get('unchanged'):
+            unchanged.append(did)
+            continue
+        h = doc_hash(doc)
+        entry = known.get(did)
+        if entry is None:
+            added.append((doc, h))
+        elif entry['hash'] != h:
+            changed.append((doc, h))
+        else:
+            unchanged.append(did)
+    removed = [did for did in known if did not in seen] if full else []
+    return added, changed, removed, unchanged, failed
+
+
+def _chunk_and_embed(docs, config, embedder=None):
+    chunks = chunk_docs(docs, config)
+    if chunks:
+        embed_chunks(chunks, config, embedder=embedder)
+    return chunks
+
+
+def needs_rebuild(config):
+    """True when the next update cannot patch the index, so every document must be loaded in full.
+
+    That is the case without a manifest, or for a FAISS index that `build` or a
+    streaming run wrote (only an IndexIDMap2 from `update` has stable ids to patch).
+    """
+    return not get_vector_store(config).patchable or load_manifest(manifest_path(config)) is None
+
+
+def update_index(docs, config, embedder=None, full=True):
+    """Apply the diff between `docs` and the stored manifest to the configured store.
+
+    Raises ValueError, before anything is written, when unchanged / error stubs
+    name documents the index would not keep (see `needs_rebuild`).
+    """
+    store = get_vector_store(config)
+    mpath = manifest_path(config)
+    manifest = load_manifest(mpath)
+    replace = not store.patchable
+    if replace:
+        manifest = None  # rebuild from scratch
+    added, changed, removed, unchanged, failed = diff_docs(docs, manifest, full=full)
+    known = manifest['docs'] if manifest else {}
+    missing = [did for did in unchanged + failed if did not in known]
+    if missing:
+        raise ValueError('%d documents arrived without content (unchanged or failed stubs) but are not in the '
+                         'index, e.g. %r; load them in full (ignore the loader sync state) and update again'
+                         % (len(missing), missing[0]))
+    stats = {'added': len(added), 'changed': len(changed), 'removed': len(removed), 'unchanged': len(unchanged),
+             'failed': len(failed)}
+    if not (added or changed or removed) and manifest is not None:
+        stats['chunks_added'] = stats['chunks_removed'] = 0
+        return stats
+
+    manifest = manifest or {'docs': {}, 'next_id': 0}
+    stale = list(removed) + [d['id'] for d, _ in changed]
+    stale_chunk_ids = [cid for did in stale for cid in manifest['docs'][did]['chunks']]
+    stale_ids = [i for did in stale for i in manifest['docs'][did]['ids']]
+    fresh_docs = [d for d, _ in added + changed]
+    chunks = _chunk_and_embed(fresh_docs, config, embedder)
+
+    ids = np.arange(manifest['next_id'], manifest['next_id'] + len(chunks), dtype='int64')
+    manifest['next_id'] += len(chunks)
+    for did in stale:
+        del manifest['docs'][did]
+    by_doc = {}
+    for c, i in zip(chunks, ids):
+        by_doc.setdefault(c['id'].rsplit('#chunk-', 1)[0], []).append((c['id'], int(i)))
+    for doc, h in added + changed:
+        rows = by_doc.get(doc['id'], [])
+        manifest['docs'][doc['id']] = {'hash': h, 'chunks': [r[0] for r in rows], 'ids': [r[1] for r in rows]}
+
+    store.update(chunks, stale_chunk_ids, ids=ids, replace=replace)
+    save_manifest(mpath, manifest)
+    stats['chunks_added'] = len(chunks)
+    stats['chunks_removed'] = len(stale_ids)
+    return stats
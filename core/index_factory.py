@@ -0,0 +1,236 @@
+"""FAISS index selection, training and query-time tuning.
+
+`index.type` picks the structure: `faiss` (auto), `faiss-flat`, `faiss-ivf`,
+`faiss-ivfpq` or `faiss-hnsw`. Auto keeps small corpora on an exact flat index.
+It switches to IVF-PQ when the flat vectors would not fit `index.memory_mb`,
+to HNSW when `index.target_recall` is very high, and to IVF-Flat otherwise.
+IVF sizes (nlist, PQ m/nbits) are derived from the vector count, so training
+always has enough points per centroid. `index.metric` (l2 / ip / cosine)
+selects L2 or inner-product variants of every structure.
+
+After a build, `tune` raises nprobe / efSearch until recall@k against exact
+search on queries sampled from the corpus reaches the target. The chosen values are written
+to `<index>.params.json` and applied by `core.retriever` when it loads the
+index.
+"""
+
+import json, math, os
+from contextlib import contextmanager
+import numpy as np
+
+FAISS_TYPES = ('faiss', 'faiss-flat', 'faiss-ivf', 'faiss-ivfpq', 'faiss-hnsw')
+METRICS = ('l2', 'ip', 'cosine')  # cosine = inner product over vectors normalized at embed time
+FLAT_MAX = 50000  # below this, exact search is fast enough and needs no training
+MIN_POINTS_PER_CENTROID = 39
+MAX_POINTS_PER_CENTROID = 256
+
+
+def is_faiss(index_type):
+    return (index_type or 'faiss').startswith('faiss')
+
+
+def faiss_metric(metric):
+    import faiss
+    if metric not in METRICS:
+        raise ValueError('unknown metric %r' % metric)
+    return faiss.METRIC_L2 if metric == 'l2' else faiss.METRIC_INNER_PRODUCT
+
+
+def params_path(index_path):
+    return index_path + '.params.json'
+
+
+def commit_path(index_path):
+    return index_path + '.commit'
+
+
+def read_commit(index_path):
+    """The commit marker of the file set, `{'generation': n, 'complete': bool}`, or None if it has none."""
+    try:
+        with open(commit_path(index_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _write_commit(index_path, marker):
+    with open(commit_path(index_path) + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(marker, f)
+    os.replace(commit_path(index_path) + '.tmp', commit_path(index_path))
+
+
+@contextmanager
+def installing(index_path):
+    """Mark the index file set incomplete while the block replaces its files, complete once it is done.
+
+    The index, metastore, BM25, filter and params files are replaced one by one;
+    serving processes (core.retriever.IndexHandle) only reload a complete set.
+    A block that raises leaves the set marked incomplete until the next install.
+    """
+    generation = (read_commit(index_path) or {}).get('generation', 0) + 1
+    _write_commit(index_path, {'generation': generation, 'complete': False})
+    yield
+    _write_commit(index_path, {'generation': generation, 'complete': True})
+
+
+def choose_index_type(n, dim, memory_mb=None, target_recall=0.95):
+    if memory_mb and n * dim * 4 > memory_mb * 1024 * 1024:
+        return 'faiss-ivfpq'
+    if n < FLAT_MAX:
+        return 'faiss-flat'
+    if target_recall >= 0.98:
+        return 'faiss-hnsw'
+    return 'faiss-ivf'
+
+
+def choose_nlist(n):
+    nlist = int(4 * math.sqrt(n))
+    return max(1, min(nlist, n // MIN_POINTS_PER_CENTROID))
+
+
+def choose_pq(n, dim, m=None):
+    """PQ sub-quantizer count (dividing `dim`, ~4 dims each) and bits, capped by the training size."""
+    if not m:
+        m = next(c for c in range(max(1, min(64, dim // 4)), 0, -1) if dim % c == 0)
+    nbits = int(max(1, min(8, math.floor(math.log2(max(2, n // MIN_POINTS_PER_CENTROID))))))
+    return m, nbits
+
+
+def make_index(index_type, n, dim, opts=None):
+    """Returns (untrained index, build params) for `index_type` ('faiss' = auto)."""
+    import faiss
+    opts = opts or {}
+    if index_type in (None, 'faiss'):
+        index_type = choose_index_type(n, dim, opts.get('memory_mb'), opts.get('target_recall', 0.95))
+    if index_type not in FAISS_TYPES:
+        raise ValueError('unknown faiss index type %r' % index_type)
+    metric = opts.get('metric') or 'l2'
+    mt = faiss_metric(metric)
+    params = {'type': index_type, 'metric': metric}
+    if index_type == 'faiss-flat':
+        return faiss.IndexFlat(dim, mt), params
+    if index_type == 'faiss-hnsw':
+        params['M'] = int(opts.get('hnsw_m', 32))
+        index = faiss.IndexHNSWFlat(dim, params['M'], mt)
+        if opts.get('ef_construction'):
+            index.hnsw.efConstruction = int(opts['ef_construction'])
+        return index, params
+    nlist = int(opts.get('nlist') or choose_nlist(n))
+    nlist = max(1, min(nlist, n))
+    params['nlist'] = nlist
+    quantizer = faiss.IndexFlat(dim, mt)
+    if index_type == 'faiss-ivf':
+        return faiss.IndexIVFFlat(quantizer, dim, nlist, mt), params
+    m, nbits = choose_pq(n, dim, opts.get('m'))
+    nbits = int(opts.get('nbits') or nbits)
+    params.update(m=m, nbits=nbits)
+    return faiss.IndexIVFPQ(quantizer, dim, nlist, m, nbits, mt), params
+
+
+def train_sample(vectors, params, seed=1234):
+    """Random rows for training: enough for every centroid (and PQ codebook), at most 256 per centroid."""
+    n = len(vectors)
+    need = MIN_POINTS_PER_CENTROID * max(params.get('nlist', 1), 2 ** params.get('nbits', 0))
+    size = min(n, max(need, MAX_POINTS_PER_CENTROID * params.get('nlist', 1)))
+    rows = np.sort(np.random.default_rng(seed).choice(n, size=size, replace=False))
+    return np.ascontiguousarray(vectors[rows], dtype='float32')
+
+
+def build_faiss(vectors, index_type='faiss', opts=None, add_batch=65536):
+    """Build and fill an index from an (n, dim) array or memmap; returns (index, params)."""
+    n, dim = vectors.shape
+    index, params = make_index(index_type, n, dim, opts)
+    if not index.is_trained:
+        index.train(train_sample(vectors, params))
+    for i in range(0, n, add_batch):
+        index.add(np.ascontiguousarray(vectors[i:i + add_batch], dtype='float32'))
+    params.update(tune(index, vectors, params, (opts or {}).get('target_recall', 0.95)))
+    return index, params
+
+
+def _knob(params):
+    if params['type'] == 'faiss-hnsw':
+        return 'efSearch', [16, 32, 64, 128, 256, 512]
+    if 'nlist' in params:
+        steps, v = [], 1
+        while v < params['nlist']:
+            steps.append(v)
+            v *= 2
+        return 'nprobe', steps + [params['nlist']]
+    return None, []
+
+
+def tune(index, vectors, params, target_recall=0.95, k=10, nq=200, seed=4321):
+    """Smallest nprobe / efSearch whose recall@k on `nq` synthetic queries reaches `target_recall`."""
+    import faiss
+    name, steps = _knob(params)
+    if name is None:
+        return {}
+    n = len(vectors)
+    k = min(k, n)
+    # midpoints of random pairs: held-in vectors would find themselves and overstate recall
+    rng = np.random.default_rng(seed)
+    a, b = rng.choice(n, size=(2, min(nq, n)))
+    queries = np.ascontiguousarray((vectors[np.sort(a)] + vectors[np.sort(b)]) / 2, dtype='float32')
+    truth = _exact_knn(queries, vectors, k, params.get('metric', 'l2'))
+    ps = faiss.ParameterSpace()
+    recall = 0.0
+    for value in steps:
+        ps.set_index_parameter(index, name, value)
+        _, I = index.search(queries, k)
+        recall = float(np.mean([len(set(a) & set(b)) / k for a, b in zip(I, truth)]))
+        if recall >= target_recall:
+            break
+    return {name: value, 'recall_at_%d' % k: round(recall, 4)}
+
+
+def _exact_knn(queries, vectors, k, metric='l2', batch=65536):
+    import faiss
+    flat = faiss.IndexFlat(queries.shape[1], faiss_metric(metric))
+    # rank by L2 distance, or by negated similarity for inner-product metrics
+    sign = 1.0 if metric == 'l2' else -1.0
+    best_d = np.full((len(queries), k), np.inf, dtype='float32')
+    best_i = np.full((len(queries), k), -1, dtype='int64')
+    for start in range(0, len(vectors), batch):
+        flat.reset()
+        flat.add(np.ascontiguousarray(vectors[start:start + batch], dtype='float32'))
+        D, I = flat.search(queries, min(k, flat.ntotal))
+        D = np.concatenate([best_d, sign * D], axis=1)
+        I = np.concatenate([best_i, I + start], axis=1)
+        order = np.argsort(D, axis=1)[:, :k]
+        best_d = np.take_along_axis(D, order, axis=1)
+        best_i = np.take_along_axis(I, order, axis=1)
+    return best_i
+
+
+def save_params(index_path, params):
+    with open(params_path(index_path) + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(params, f)
+    os.replace(params_path(index_path) + '.tmp', params_path(index_path))
+
+
+def load_params(index_path):
+    try:
+        with open(params_path(index_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def apply_params(index, params):
+    """Set the persisted query-time knobs (nprobe / efSearch) on a loaded index."""
+    import faiss
+    ps = faiss.ParameterSpace()
+    for name in ('nprobe', 'efSearch'):
+        if params.get(name):
+            try:
+                ps.set_index_parameter(index, name, int(params[name]))
+            except RuntimeError:
+                print('index has no %s parameter, ignoring it' % name)
+    return index
+
+
+def index_options(config):
+    idx = config.get('index', {})
+    keys = ('metric', 'bm25', 'filters', 'shards', 'memory_mb', 'target_recall', 'nlist', 'm', 'nbits', 'hnsw_m', 'ef_construction')
+    return {k: idx[k] for k in keys if idx.get(k) is not None}
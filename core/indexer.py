@@ -1,24 +1,46 @@
-import os, json
+import os
 from core.utils import load_config
+from core.metastore import write_metastore, metastore_path
+from core.index_factory import build_faiss, installing, is_faiss, save_params
+from core.bm25 import write_for_index
+from core.filters import write_filters_for_index
+from core.shards import build_shards, remove_stale_shards, write_manifest
 CONF = load_config()
 
 def build_index(chunks, backend='faiss', index_path=None, **kwargs):
-    if backend == 'faiss':
+    """`backend` is an index.type: faiss (auto) / faiss-flat / faiss-ivf / faiss-ivfpq / faiss-hnsw, chroma, milvus.
+
+    FAISS options (metric, memory_mb, target_recall, nlist, m, hnsw_m, ...) are passed as kwargs;
+    chroma and milvus take their `index` config keys (see core.vector_store). FAISS indexes get a BM25 keyword index (`<index>.bm25`)
+    unless `bm25=False`, and a metadata filter index (`<index>.filters`) unless `filters=False`.
+    With `shards=N` (N > 1) the vectors are split over N FAISS indexes built in parallel and
+    `index_path` holds their manifest (see core.shards).
+    """
+    if is_faiss(backend):
         import faiss, numpy as np
         index_path = index_path or CONF.get('FAISS_INDEX_PATH','rag_index.faiss')
-        vectors = np.array([c['embedding'] for c in chunks]).astype('float32')
-        dim = vectors.shape[1]
-        index = faiss.IndexFlatL2(dim)
-        index.add(vectors)
-        faiss.write_index(index, index_path)
-        with open(index_path + '.meta.json', 'w', encoding='utf-8') as f:
-            json.dump(chunks, f, ensure_ascii=False)
+        vectors = np.asarray([c['embedding'] for c in chunks], dtype='float32')
+        shards = int(kwargs.get('shards') or 1)
+        if shards > 1:
+            manifest = build_shards(vectors, index_path, backend, kwargs, shards)
+            params = {'type': backend, 'metric': manifest['metric'], 'shards': len(manifest['shards'])}
+        else:
+            index, params = build_faiss(vectors, backend, opts=kwargs)
+        # every file is written to a temp file and renamed; serving processes reload once the set is committed
+        with installing(index_path):
+            save_params(index_path, params)
+            write_metastore(metastore_path(index_path), chunks)
+            write_for_index(index_path, (c['text'] for c in chunks), kwargs.get('bm25', True) is not False)
+            write_filters_for_index(index_path, chunks, enabled=kwargs.get('filters', True) is not False)
+            if shards > 1:
+                write_manifest(index_path, manifest)
+            else:
+                faiss.write_index(index, index_path + '.tmp')
+                os.replace(index_path + '.tmp', index_path)
+                remove_stale_shards(index_path)
         return index_path
-    elif backend == 'chroma':
-        from core.indexer_chroma import build_chroma_index
-        return build_chroma_index(chunks, persist_directory=kwargs.get('persist_directory'))
-    elif backend == 'milvus':
-        from core.indexer_milvus import build_milvus_index
-        return build_milvus_index(chunks, collection_name=kwargs.get('collection_name'))
+    elif backend in ('chroma', 'milvus'):
+        from core.vector_store import get_vector_store
+        return get_vector_store({'index': dict(kwargs, type=backend)}).build(chunks)
     else:
         raise NotImplementedError('Unknown backend')
@@ -1,15 +1,144 @@
 import chromadb
-from chromadb.config import Settings
-import os, json
-
-def build_chroma_index(chunks, persist_directory=None, collection_name='rag_collection'):
-    persist_directory = persist_directory or os.getenv('CHROMA_DIR','./chroma_db')
-    client = chromadb.Client(Settings(chroma_db_impl='duckdb+parquet', persist_directory=persist_directory))
-    coll = client.get_or_create_collection(collection_name)
-    ids = [c['id'] for c in chunks]
-    metadatas = [{'source': c.get('source'), 'title': c.get('title'), 'meta': c.get('meta',{})} for c in chunks]
-    documents = [c['text'] for c in chunks]
-    embeddings = [c['embedding'] for c in chunks]
-    coll.add(documents=documents, metadatas=metadatas, ids=ids, embeddings=embeddings)
-    client.persist()
-    return {'backend':'chroma','persist_directory':persist_directory,'collection':collection_name}
+import os, json, threading
+import numpy as np
+from core import constants
+from core.filters import filter_terms
+from core.vector_store import VectorStore, doc_id, passes
+
+SPACES = {'l2':'l2','ip':'ip','cosine':'cosine'}
+# metadata keys written for every chunk; document meta keys with these names are only kept in `meta`
+_COLUMNS = ('doc', 'source', 'title', 'meta')
+
+# chroma keeps one system per persist directory, so stores on the same path share its client
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _client(persist_directory):
+    with _clients_lock:
+        if persist_directory not in _clients:
+            _clients[persist_directory] = chromadb.PersistentClient(path=persist_directory)
+        return _clients[persist_directory]
+
+def _max_batch_size(client):
+    # the largest add / upsert the backing store accepts (get_max_batch_size() from chroma 0.5)
+    get = getattr(client, 'get_max_batch_size', None)
+    return get() if get else getattr(client, 'max_batch_size', 5461)
+
+_SCALARS = (str, bool, int, float)
+
+def _member_key(field, value):
+    # chroma metadata values are scalars, so a list field stores one flag per member
+    return '%s[]%s' % (field, json.dumps(value, ensure_ascii=False))
+
+def _metadata(chunk):
+    """Flat chroma metadata: columns, scalar meta fields (filterable) and the full meta as JSON.
+
+    A list of scalars is stored as one `True` flag per member (see `_member_key`),
+    so filters on it match like they do on the FAISS sidecar.
+    """
+    meta = chunk.get('meta') or {}
+    md = {}
+    for k, v in meta.items():
+        if k in _COLUMNS:
+            continue
+        if isinstance(v, _SCALARS):
+            md[k] = v
+        elif isinstance(v, (list, tuple)):
+            md.update((_member_key(k, x), True) for x in v if isinstance(x, _SCALARS))
+    md.update(doc=doc_id(chunk['id']), source=chunk.get('source'), title=chunk.get('title'),
+              meta=json.dumps(meta, ensure_ascii=False, default=str))
+    # chroma rejects None values
+    return {k: v for k, v in md.items() if v is not None}
+
+def where(filter):
+    """A core.filters filter as a chroma `where` clause (chroma has no prefix match on metadata)."""
+    clauses = []
+    for field, values, prefixes in filter_terms(filter):
+        if prefixes:
+            raise ValueError('prefix filters are not supported by the chroma backend (%r)' % field)
+        clause = {field: {'$in': values}} if len(values) != 1 else {field: {'$eq': values[0]}}
+        if field not in _COLUMNS:
+            # the field may hold a scalar or a list of scalars
+            clause = {'$or': [clause] + [{_member_key(field, v): {'$eq': True}} for v in values]}
+        clauses.append(clause)
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+class ChromaStore(VectorStore):
+    """A persistent chroma collection; chroma maintains its HNSW index as rows are added."""
+
+    cacheable = False  # ingest runs write to the persist directory from their own process
+
+    def __init__(self, persist_directory=None, collection_name='rag_collection', metric='l2', batch_size=1000):
+        super().__init__()
+        self.persist_directory = persist_directory or os.getenv('CHROMA_DIR','./chroma_db')
+        self.collection_name = collection_name
+        self.metric = metric
+        self.similarity = metric != 'l2'
+        self.batch_size = batch_size
+        self._coll = None
+
+    @classmethod
+    def from_config(cls, config):
+        idx = config.get(constants.INDEX, {})
+        return cls(idx.get('persist_directory'), idx.get('collection_name') or 'rag_collection',
+                   idx.get(constants.METRIC) or 'l2', idx.get(constants.BATCH_SIZE) or 1000)
+
+    @property
+    def collection(self):
+        if self._coll is None:
+            # the distance space is fixed when the collection is created
+            self._coll = _client(self.persist_directory).get_or_create_collection(
+                self.collection_name, metadata={'hnsw:space': SPACES[self.metric]})
+        return self._coll
+
+    def open(self):
+        self.collection
+        return self
+
+    def _info(self):
+        return {'backend':'chroma','persist_directory':self.persist_directory,'collection':self.collection_name}
+
+    def build(self, chunks):
+        return self.update(chunks, replace=True)
+
+    def update(self, chunks, delete_ids=(), ids=None, replace=False):
+        client = _client(self.persist_directory)
+        if replace:
+            try:
+                client.delete_collection(self.collection_name)
+            except Exception:
+                pass  # nothing to replace yet
+            self._coll = None
+        coll = self.collection
+        batch = min(self.batch_size, _max_batch_size(client))
+        delete_ids = list(delete_ids)
+        for i in range(0, len(delete_ids), batch):
+            coll.delete(ids=delete_ids[i:i + batch])
+        for i in range(0, len(chunks), batch):
+            part = chunks[i:i + batch]
+            # upsert keeps re-runs idempotent instead of duplicating chunks
+            coll.upsert(ids=[c['id'] for c in part], documents=[c['text'] for c in part],
+                        metadatas=[_metadata(c) for c in part],
+                        # chroma 0.4 validates plain lists of floats, not ndarray rows
+                        embeddings=np.asarray([c['embedding'] for c in part], dtype='float32').tolist())
+        self._generation += 1
+        return self._info()
+
+    def search_many(self, query_embs, top_k=5, min_score=None, queries=None, filter=None):
+        x = np.asarray(query_embs, dtype='float32').tolist()
+        res = self.collection.query(query_embeddings=x, n_results=top_k, where=where(filter) if filter else None,
+                                    include=['metadatas', 'documents', 'distances'])
+        out = []
+        for ids, docs, metas, dists in zip(res['ids'], res['documents'], res['metadatas'], res['distances']):
+            hits = []
+            for cid, text, md, d in zip(ids, docs, metas, dists):
+                # chroma reports 1 - similarity for ip / cosine spaces
+                score = 1.0 - d if self.similarity else d
+                if not passes(score, min_score, self.similarity):
+                    break
+                hits.append({'score': float(score), 'meta': {'id': cid, 'source': md.get('source'),
+                             'title': md.get('title'), 'text': text, 'meta': json.loads(md.get('meta') or '{}')}})
+            out.append(hits)
+        return out
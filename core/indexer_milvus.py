@@ -1,25 +1,163 @@
-from pymilvus import connections, FieldSchema, CollectionSchema, DataType, Collection, utility
-import os, numpy as np, json
-
-def build_milvus_index(chunks, collection_name='rag_collection', host=None, port=None):
-    host = host or os.getenv('MILVUS_HOST','127.0.0.1')
-    port = port or os.getenv('MILVUS_PORT','19530')
-    connections.connect(host=host, port=str(port))
-    dim = len(chunks[0]['embedding'])
-    fields = [
-        FieldSchema(name='pk', dtype=DataType.INT64, is_primary=True, auto_id=True),
-        FieldSchema(name='emb', dtype=DataType.FLOAT_VECTOR, dim=dim),
-        FieldSchema(name='text', dtype=DataType.VARCHAR, max_length=65535)
-    ]
-    schema = CollectionSchema(fields, description='RAG collection')
-    if utility.has_collection(collection_name):
-        coll = Collection(collection_name)
-    else:
-        coll = Collection(name=collection_name, schema=schema)
-    texts = [c['text'] for c in chunks]
-    embs = [list(map(float, c['embedding'])) for c in chunks]
-    coll.insert([embs, texts])
-    index_params = {'metric_type':'L2','index_type':'IVF_FLAT','params':{'nlist':128}}
-    coll.create_index('emb', index_params)
-    coll.load()
-    return {'backend':'milvus','collection':collection_name}
+from pymilvus import DataType, MilvusClient
+import os, json, threading
+import numpy as np
+from core import constants
+from core.filters import filter_terms
+from core.vector_store import VectorStore, doc_id, passes
+
+# cosine vectors are normalized at embed time, so inner product ranks them the same
+METRIC_TYPES = {'l2':'L2','ip':'IP','cosine':'IP'}
+# scalar columns next to the vector; other meta fields are filtered inside the `meta` JSON column
+_COLUMNS = ('source', 'title', 'doc')
+# the largest VARCHAR Milvus allows, in UTF-8 bytes; ids, sources and titles can be long URLs / S3 keys
+MAX_VARCHAR = 65535
+
+# each MilvusClient opens a gRPC channel; collections on one server reuse it
+_clients = {}
+_clients_lock = threading.Lock()
+
+def _client(uri, token=None):
+    with _clients_lock:
+        if (uri, token) not in _clients:
+            _clients[uri, token] = MilvusClient(uri=uri, token=token or '')
+        return _clients[uri, token]
+
+def default_uri():
+    """MILVUS_URI (a server URL, or a local file for Milvus Lite), else MILVUS_HOST / MILVUS_PORT."""
+    return os.getenv('MILVUS_URI') or 'http://%s:%s' % (os.getenv('MILVUS_HOST','127.0.0.1'),
+                                                          os.getenv('MILVUS_PORT','19530'))
+
+def _schema(dim):
+    schema = MilvusClient.create_schema(auto_id=False, enable_dynamic_field=False, description='RAG collection')
+    schema.add_field('pk', DataType.VARCHAR, is_primary=True, max_length=MAX_VARCHAR)
+    schema.add_field('emb', DataType.FLOAT_VECTOR, dim=dim)
+    schema.add_field('text', DataType.VARCHAR, max_length=MAX_VARCHAR)
+    for name in _COLUMNS:
+        schema.add_field(name, DataType.VARCHAR, max_length=MAX_VARCHAR)
+    schema.add_field('meta', DataType.JSON)
+    return schema
+
+def _row(chunk):
+    row = {'pk': chunk['id'], 'emb': np.asarray(chunk['embedding'], dtype='float32').tolist(), 'text': chunk['text'],
+           'source': chunk.get('source') or '', 'title': chunk.get('title') or '', 'doc': doc_id(chunk['id']),
+           'meta': chunk.get('meta') or {}}
+    for name in ('pk', 'text') + _COLUMNS:
+        if len(row[name].encode('utf-8')) > MAX_VARCHAR:
+            # fail with the chunk named rather than with a whole rejected batch
+            raise ValueError('%s of chunk %r is longer than %d bytes' % (name, chunk['id'][:200], MAX_VARCHAR))
+    return row
+
+def _literal(v):
+    return json.dumps(v, ensure_ascii=False)
+
+def expression(filter):
+    """A core.filters filter as a Milvus boolean expression."""
+    clauses = []
+    for field, values, prefixes in filter_terms(filter):
+        if field in _COLUMNS:
+            terms = ['%s in [%s]' % (field, ', '.join(_literal(str(v)) for v in values))] if values else []
+            col = field
+        else:
+            # a meta field holds a scalar or a list of scalars
+            col = 'meta[%s]' % _literal(field)
+            terms = ['%s == %s or json_contains(%s, %s)' % (col, _literal(v), col, _literal(v)) for v in values]
+        for p in prefixes:
+            escaped = str(p).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            terms.append('%s like %s' % (col, _literal(escaped + '%')))
+        clauses.append('(%s)' % ' or '.join(terms))
+    return ' and '.join(clauses)
+
+class MilvusStore(VectorStore):
+    """A Milvus collection. Rows go in `batch_size` at a time; on a fresh collection the vector
+    index is only created once the bulk load is in, so it is trained on the full data."""
+
+    cacheable = False  # a Milvus server is written to by every ingest process that connects to it
+
+    def __init__(self, collection_name='rag_collection', uri=None, token=None, metric='l2', batch_size=1000,
+                 index_type='IVF_FLAT', index_params=None, search_params=None):
+        super().__init__()
+        self.collection_name = collection_name
+        self.uri = uri or default_uri()
+        self.token = token
+        self.metric = metric
+        self.similarity = metric != 'l2'
+        self.batch_size = batch_size
+        self.index_type = index_type
+        self.index_params = {'nlist': 128} if index_params is None else index_params
+        self.search_params = {'nprobe': 16} if search_params is None else search_params
+
+    @classmethod
+    def from_config(cls, config):
+        idx = config.get(constants.INDEX, {})
+        uri = idx.get('uri') or (idx.get('host') and 'http://%s:%s' % (idx['host'], idx.get('port', 19530)))
+        return cls(idx.get('collection_name') or 'rag_collection', uri, idx.get('token') or os.getenv('MILVUS_TOKEN'),
+                   idx.get(constants.METRIC) or 'l2', idx.get(constants.BATCH_SIZE) or 1000,
+                   idx.get('milvus_index_type', 'IVF_FLAT'), idx.get('milvus_index_params'),
+                   {'nprobe': idx['nprobe']} if idx.get('nprobe') else None)
+
+    @property
+    def client(self):
+        return _client(self.uri, self.token)
+
+    def open(self):
+        self.client.load_collection(self.collection_name)
+        return self
+
+    def _info(self):
+        return {'backend':'milvus','collection':self.collection_name}
+
+    def _insert(self, chunks):
+        for i in range(0, len(chunks), self.batch_size):
+            self.client.insert(self.collection_name, [_row(c) for c in chunks[i:i + self.batch_size]])
+
+    def _delete(self, ids):
+        for i in range(0, len(ids), self.batch_size):
+            self.client.delete(self.collection_name, ids=ids[i:i + self.batch_size])
+
+    def _bulk_load(self, chunks):
+        """Create the collection, insert everything, then build the index and load it for search."""
+        client = self.client
+        client.create_collection(self.collection_name, schema=_schema(len(chunks[0]['embedding'])))
+        self._insert(chunks)
+        client.flush(self.collection_name)
+        params = client.prepare_index_params()
+        params.add_index('emb', index_type=self.index_type, metric_type=METRIC_TYPES[self.metric],
+                         params=self.index_params)
+        client.create_index(self.collection_name, params)
+        client.load_collection(self.collection_name)
+
+    def build(self, chunks):
+        return self.update(chunks, replace=True)
+
+    def update(self, chunks, delete_ids=(), ids=None, replace=False):
+        client = self.client
+        exists = client.has_collection(self.collection_name)
+        if exists and replace:
+            client.drop_collection(self.collection_name)
+            exists = False
+        if not exists:
+            if chunks:
+                self._bulk_load(chunks)
+        else:
+            # chunk ids are the primary key, so re-inserting a chunk first drops its old row
+            self._delete(list(delete_ids) + [c['id'] for c in chunks])
+            self._insert(chunks)
+        self._generation += 1
+        return self._info()
+
+    def search_many(self, query_embs, top_k=5, min_score=None, queries=None, filter=None):
+        res = self.client.search(self.collection_name, np.asarray(query_embs, dtype='float32').tolist(), limit=top_k,
+                                 filter=expression(filter) if filter else '',
+                                 output_fields=['pk', 'text', 'meta'] + list(_COLUMNS),
+                                 search_params={'metric_type': METRIC_TYPES[self.metric], 'params': self.search_params})
+        out = []
+        for found in res:
+            hits = []
+            for h in found:
+                if not passes(h['distance'], min_score, self.similarity):
+                    break
+                e = h['entity']
+                hits.append({'score': float(h['distance']), 'meta': {'id': e.get('pk'), 'source': e.get('source') or None,
+                             'title': e.get('title') or None, 'text': e.get('text'), 'meta': e.get('meta') or {}}})
+            out.append(hits)
+        return out
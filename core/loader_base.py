@@ -1,6 +1,62 @@
+import json, os, threading
 from abc import ABC, abstractmethod
 
+STATE_DIR = os.getenv('LOADER_STATE_DIR', '.cache/loader_state')
+
 class LoaderBase(ABC):
     @abstractmethod
     def load(self):
         pass
+
+    def iter_load(self):
+        """Yield documents one at a time; loaders that can stream should override this."""
+        yield from self.load()
+
+    def commit(self):
+        """Persist sync state (ETags, timestamps, ...) once the yielded documents are indexed."""
+        pass
+
+
+class LoaderState:
+    """Per-loader sync state used to skip unchanged items on the next run.
+
+    `get` reads what the last committed run saw; `mark` records what this run saw.
+    Only `commit()` writes it back, so a run that fails before indexing does not
+    cause items to be skipped later. Loaders record a version only for items that
+    produced a document: a recorded version turns into an `unchanged` stub on the
+    next run, and a stub is only valid for a document that is in the index.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.previous = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self.previous = json.load(f)
+        self.current = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_source(cls, name):
+        safe = ''.join(ch if ch.isalnum() or ch in '-_.' else '_' for ch in name)
+        return cls(os.path.join(STATE_DIR, safe + '.json'))
+
+    def get(self, key):
+        return self.previous.get(key)
+
+    def forget(self):
+        """Ignore what the last run saw, so every item is fetched again (and recorded anew)."""
+        self.previous = {}
+
+    def mark(self, key, value):
+        with self._lock:
+            self.current[key] = value
+
+    def commit(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._lock:
+            snapshot = dict(self.current)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(self.path + '.tmp', self.path)
+        self.previous = snapshot
@@ -1,8 +1,11 @@
 """NotionLoader (enhanced): download attachments, extract text from known types and merge into page text."""
 
-import os, time, re, requests
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from core.loader_base import LoaderBase
+import os, re, requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from core.loader_base import LoaderBase, LoaderState
+from core.procpool import process_pool
+from core.ratelimit import get_limiter, retry_call
 try:
     from notion_client import Client
 except Exception:
@@ -50,39 +53,53 @@ def _safe_filename(url):
 
 
 class NotionLoader(LoaderBase):
-    def __init__(self, token=None, database_id=None, page_id=None, max_pages=1000, max_workers=6, max_retries=5):
+    """Loads a Notion database (or a single page) with up to `max_workers` pages in flight.
+
+    Every API call goes through one token bucket shared by all Notion loaders in
+    the process. Nested blocks are flattened into the page text, and child pages
+    are loaded as documents of their own (`include_children`). With
+    `skip_unchanged`, pages whose `last_edited_time` matches the last committed
+    run are yielded as `{'id', 'unchanged': True}` stubs without fetching their
+    blocks. Attachment text is extracted on a process pool of `extract_workers`.
+    """
+    def __init__(self, token=None, database_id=None, page_id=None, max_pages=1000, max_workers=6, max_retries=5,
+                 limiter=None, include_children=True, extract_workers=None, skip_unchanged=False, state_path=None):
         self.token = token or os.getenv('NOTION_TOKEN')
         self.database_id = database_id or os.getenv('NOTION_DATABASE_ID')
         self.page_id = page_id
         self.max_pages = max_pages
         self.max_workers = max_workers
         self.max_retries = max_retries
+        self.include_children = include_children
+        self.extract_workers = (os.cpu_count() or 2) if extract_workers is None else extract_workers
+        # Notion allows ~3 requests/s per integration; share one budget across all loaders
+        self.limiter = limiter or get_limiter('notion', 3)
+        self.state = None
+        if skip_unchanged or state_path:
+            root = self.database_id or self.page_id or ''
+            self.state = LoaderState(state_path) if state_path else LoaderState.for_source('notion-' + root)
         if Client is None:
             raise RuntimeError('notion-client required')
         self.client = Client(auth=self.token)
+        self._downloads = None
+        self._procs = None
 
-    def _backoff(self, attempt):
-        base = 0.5
-        sleep = base * (2 ** attempt) + (0.1 * (attempt % 3))
-        return min(sleep, 30)
+    def _call(self, fn, **kwargs):
+        return retry_call(fn, retries=self.max_retries, limiter=self.limiter, **kwargs)
 
     def _fetch_blocks_page(self, page_id, start_cursor=None):
-        attempt = 0
-        while attempt < self.max_retries:
-            try:
-                resp = self.client.blocks.children.list(block_id=page_id, start_cursor=start_cursor)
-                return resp
-            except Exception as e:
-                time.sleep(self._backoff(attempt))
-                attempt += 1
-        raise RuntimeError('failed fetch blocks')
+        return self._call(self.client.blocks.children.list, block_id=page_id, start_cursor=start_cursor)
 
     def _get_all_blocks(self, page_id):
+        """All blocks of a page in document order, with nested blocks (toggles, lists, columns) inlined."""
         results = []
         cursor = None
         while True:
             resp = self._fetch_blocks_page(page_id, cursor)
-            results.extend(resp.get('results', []))
+            for b in resp.get('results', []):
+                results.append(b)
+                if b.get('has_children') and b.get('type') not in ('child_page', 'child_database'):
+                    results.extend(self._get_all_blocks(b['id']))
             if not resp.get('has_more'):
                 break
             cursor = resp.get('next_cursor')
@@ -126,67 +143,117 @@ class NotionLoader(LoaderBase):
         except Exception:
             return None
 
+    def _extract_attachment(self, path):
+        if self._procs is not None:
+            return self._procs.submit(extract_text_from_file, path).result()
+        return extract_text_from_file(path)
+
     def _extract_page(self, page_id):
         blocks = self._get_all_blocks(page_id)
         text, attachments = self._blocks_to_text_and_attachments(blocks)
+        children = [(b['id'], b.get('child_page', {}).get('title')) for b in blocks if b.get('type') == 'child_page']
         downloaded = []
         if attachments:
-            with ThreadPoolExecutor(max_workers=min(len(attachments), self.max_workers)) as ex:
-                futures = {ex.submit(self._download_attachment, a): a for a in attachments}
-                for fut in as_completed(futures):
-                    res = fut.result()
-                    if res:
-                        downloaded.append(res)
+            if self._downloads is not None:
+                downloaded = [p for p in self._downloads.map(self._download_attachment, attachments) if p]
+            else:
+                downloaded = [p for p in map(self._download_attachment, attachments) if p]
         attach_texts = []
         for p in downloaded:
             try:
-                t = extract_text_from_file(p)
+                t = self._extract_attachment(p)
                 if t:
                     attach_texts.append('\n\n[attachment: %s]\n\n' % os.path.basename(p) + t)
             except Exception:
                 continue
         if attach_texts:
             text = text + "\n\n" + "\n\n".join(attach_texts)
-        return text, downloaded
+        return text, downloaded, children
 
-    def load(self):
-        docs = []
+    def _page_title(self, page):
+        for v in page.get('properties', {}).values():
+            if v.get('type') == 'title':
+                return ''.join([t.get('plain_text', '') for t in v.get('title', [])])
+        return None
+
+    def _iter_roots(self):
+        """Yields (page_id, title, last_edited_time) for the database rows, or the single root page."""
         if self.database_id:
             cursor = None
-            count = 0
             while True:
-                attempt = 0
-                while attempt < self.max_retries:
-                    try:
-                        res = self.client.databases.query(database_id=self.database_id, start_cursor=cursor)
-                        break
-                    except Exception:
-                        time.sleep(self._backoff(attempt))
-                        attempt += 1
-                else:
-                    raise RuntimeError('failed query')
+                res = self._call(self.client.databases.query, database_id=self.database_id, start_cursor=cursor)
                 for r in res.get('results', []):
-                    if count >= self.max_pages:
-                        break
-                    page_id = r.get('id')
-                    title = None
-                    props = r.get('properties', {})
-                    for v in props.values():
-                        if v.get('type') == 'title':
-                            title_list = v.get('title', [])
-                            title = ''.join([t.get('plain_text', '') for t in title_list])
-                            break
-                    text, attachments = self._extract_page(page_id)
-                    meta = {'source': 'notion', 'page_id': page_id, 'title': title, 'attachments': attachments}
-                    docs.append({'id': page_id, 'text': text, 'meta': meta})
-                    count += 1
-                if count >= self.max_pages:
-                    break
+                    yield r.get('id'), self._page_title(r), r.get('last_edited_time')
                 if not res.get('has_more'):
                     break
                 cursor = res.get('next_cursor')
-            return docs
-        if self.page_id:
-            text, attachments = self._extract_page(self.page_id)
-            docs.append({'id': self.page_id, 'text': text, 'meta': {'source': 'notion', 'page_id': self.page_id, 'attachments': attachments}})
-        return docs
+        elif self.page_id:
+            yield self.page_id, None, None
+
+    def _load_page(self, page_id, title=None, edited=None):
+        """Returns (doc or None, child pages as [(id, title)])."""
+        if self.state is not None and edited is None:
+            # child pages and the root page: one cheap call instead of walking every block
+            page = self._call(self.client.pages.retrieve, page_id=page_id)
+            edited = page.get('last_edited_time')
+            title = title or self._page_title(page)
+        prev = self.state.get(page_id) if self.state is not None else None
+        if prev and prev.get('edited') and prev['edited'] == edited:
+            self.state.mark(page_id, prev)
+            return {'id': page_id, 'unchanged': True}, prev.get('children', [])
+        text, attachments, children = self._extract_page(page_id)
+        if self.state is not None:
+            # an empty page records no edit time (see LoaderState)
+            self.state.mark(page_id, {'edited': edited if text else None, 'children': children})
+        if not text:
+            return None, children
+        meta = {'source': 'notion', 'page_id': page_id, 'title': title, 'attachments': attachments}
+        if edited:
+            meta['last_edited_time'] = edited
+        return {'id': page_id, 'text': text, 'meta': meta}, children
+
+    def load(self):
+        return list(self.iter_load())
+
+    def iter_load(self):
+        if self.extract_workers:
+            try:
+                self._procs = process_pool(self.extract_workers)
+            except Exception as e:
+                print('process pool unavailable, extracting inline', e)
+        roots = self._iter_roots()
+        children = deque()
+        seen = set()
+        inflight = set()
+        submitted = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='notion') as pool, \
+                    ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='notion-dl') as downloads:
+                self._downloads = downloads
+                while True:
+                    while len(inflight) < self.max_workers and submitted < self.max_pages:
+                        item = children.popleft() if children else next(roots, None)
+                        if item is None:
+                            break
+                        if item[0] in seen:
+                            continue
+                        seen.add(item[0])
+                        inflight.add(pool.submit(self._load_page, *item))
+                        submitted += 1
+                    if not inflight:
+                        break
+                    done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                    for fut in done:
+                        doc, found = fut.result()
+                        if self.include_children:
+                            children.extend((cid, ctitle, None) for cid, ctitle in found)
+                        if doc:
+                            yield doc
+        finally:
+            self._downloads = None
+            # the pool is shared with other sources and outlives this run
+            self._procs = None
+
+    def commit(self):
+        if self.state is not None:
+            self.state.commit()
@@ -1,5 +1,9 @@
-import boto3, io, os, time
-from core.loader_base import LoaderBase
+import boto3, io, os, tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from core.loader_base import LoaderBase, LoaderState
+from core.procpool import process_pool
+from core.ratelimit import retry_call
 try:
     import pdfplumber
 except Exception:
@@ -18,69 +22,160 @@ try:
 except Exception:
     pytesseract=None
 
+TEXT_EXT=('.txt','.md','.py','.json','.csv','.yaml','.yml','.html','.htm')
+IMAGE_EXT=('.png','.jpg','.jpeg','.tiff','.bmp')
+HEAVY_EXT=('.pdf','.docx','.pptx')+IMAGE_EXT
+
+# Extractors take either the object bytes or the path of a spooled temp file, and live
+# at module level so they can run in a process pool.
+def _src(data):
+    return data if isinstance(data,str) else io.BytesIO(data)
+def extract_pdf(data):
+    if pdfplumber is None: return ''
+    try:
+        with pdfplumber.open(_src(data)) as pdf:
+            pages=[p.extract_text() or '' for p in pdf.pages]
+        return '\n\n'.join(pages)
+    except Exception as e:
+        print('pdf extract error',e); return ''
+def extract_docx(data):
+    if docx is None: return ''
+    try:
+        doc=docx.Document(_src(data)); paras=[p.text for p in doc.paragraphs]; return '\n\n'.join(paras)
+    except Exception as e:
+        print('docx extract error',e); return ''
+def extract_pptx(data):
+    if pptx is None: return ''
+    try:
+        prs=pptx.Presentation(_src(data)); texts=[]
+        for slide in prs.slides:
+            for shape in slide.shapes:
+                if hasattr(shape,'text'): texts.append(shape.text)
+        return '\n\n'.join(texts)
+    except Exception as e:
+        print('pptx extract error',e); return ''
+def ocr_image(data):
+    if pytesseract is None: return ''
+    try:
+        img=Image.open(_src(data)); return pytesseract.image_to_string(img)
+    except Exception as e:
+        print('ocr error',e); return ''
+def decode_text(data):
+    if isinstance(data,str):
+        with open(data,'rb') as f: data=f.read()
+    try: return data.decode('utf-8')
+    except Exception:
+        try: return data.decode('latin-1')
+        except Exception: return ''
+def extract_object(key,data):
+    lower=key.lower()
+    if lower.endswith(TEXT_EXT): return decode_text(data)
+    if lower.endswith('.pdf'): return extract_pdf(data)
+    if lower.endswith('.docx'): return extract_docx(data)
+    if lower.endswith('.pptx'): return extract_pptx(data)
+    if lower.endswith(IMAGE_EXT): return ocr_image(data)
+    return ''
+
 class S3Loader(LoaderBase):
-    def __init__(self,bucket,prefix='',aws_region=None,max_objects=None,sleep_on_rate=1.0,max_workers=4):
+    """Lists a bucket prefix and fetches objects on `max_workers` threads.
+
+    PDF/Office/OCR extraction runs on a process pool of `extract_workers`.
+    Objects larger than `spool_bytes` are streamed to a temp file instead of
+    being held in memory. With `skip_unchanged`, objects whose ETag and
+    LastModified match the last committed run are yielded as
+    `{'id', 'unchanged': True}` stubs without being downloaded, and objects
+    that fail to download as `{'id', 'error'}` stubs.
+    """
+    def __init__(self,bucket,prefix='',aws_region=None,max_objects=None,sleep_on_rate=1.0,max_workers=4,limiter=None,max_retries=3,
+                 extract_workers=None,spool_bytes=16*1024*1024,skip_unchanged=False,state_path=None):
         self.bucket=bucket; self.prefix=prefix; self.max_objects=max_objects; self.sleep_on_rate=sleep_on_rate; self.max_workers=max_workers
+        self.limiter=limiter; self.max_retries=max_retries
+        self.extract_workers=(os.cpu_count() or 2) if extract_workers is None else extract_workers
+        self.spool_bytes=spool_bytes
+        self.state=None
+        if skip_unchanged or state_path:
+            self.state=LoaderState(state_path) if state_path else LoaderState.for_source('s3-%s-%s'%(bucket,prefix))
         self.s3=boto3.client('s3', region_name=aws_region) if aws_region else boto3.client('s3')
+        self._procs=None
     def _is_text(self,key):
-        text_ext=['.txt','.md','.py','.json','.csv','.yaml','.yml','.html','.htm']
-        _,ext=os.path.splitext(key.lower()); return ext in text_ext
-    def _extract_pdf(self,body_bytes):
-        if pdfplumber is None: return ''
-        try:
-            with pdfplumber.open(io.BytesIO(body_bytes)) as pdf:
-                pages=[p.extract_text() or '' for p in pdf.pages]
-            return '\n\n'.join(pages)
-        except Exception as e:
-            print('pdf extract error',e); return ''
-    def _extract_docx(self,body_bytes):
-        if docx is None: return ''
+        return key.lower().endswith(TEXT_EXT)
+    def _extract_pdf(self,body_bytes): return extract_pdf(body_bytes)
+    def _extract_docx(self,body_bytes): return extract_docx(body_bytes)
+    def _extract_pptx(self,body_bytes): return extract_pptx(body_bytes)
+    def _ocr_image(self,body_bytes): return ocr_image(body_bytes)
+    def _call(self,fn,**kwargs):
+        return retry_call(fn,retries=self.max_retries,limiter=self.limiter,base=self.sleep_on_rate,**kwargs)
+    def _iter_objects(self):
+        paginator=self.s3.get_paginator('list_objects_v2'); seen=0
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get('Contents',[]):
+                if not obj['Key'].lower().endswith(TEXT_EXT+HEAVY_EXT): continue
+                if self.max_objects and seen>=self.max_objects: return
+                seen+=1
+                yield obj
+    def _download(self,key,size):
+        if size<=self.spool_bytes:
+            return self._call(self.s3.get_object,Bucket=self.bucket,Key=key)['Body'].read()
+        fd,path=tempfile.mkstemp(prefix='s3-',suffix=os.path.splitext(key)[1])
+        os.close(fd)
+        def fetch():
+            with open(path,'wb') as f:
+                self.s3.download_fileobj(self.bucket,key,f)
         try:
-            doc=docx.Document(io.BytesIO(body_bytes)); paras=[p.text for p in doc.paragraphs]; return '\n\n'.join(paras)
-        except Exception as e:
-            print('docx extract error',e); return ''
-    def _extract_pptx(self,body_bytes):
-        if pptx is None: return ''
+            self._call(fetch)
+        except Exception:
+            os.remove(path); raise
+        return path
+    def _fetch(self,obj):
+        key=obj['Key']
         try:
-            prs=pptx.Presentation(io.BytesIO(body_bytes)); texts=[]
-            for slide in prs.slides:
-                for shape in slide.shapes:
-                    if hasattr(shape,'text'): texts.append(shape.text)
-            return '\n\n'.join(texts)
+            data=self._download(key,obj.get('Size',0))
         except Exception as e:
-            print('pptx extract error',e); return ''
-    def _ocr_image(self,body_bytes):
-        if pytesseract is None: return ''
+            print('s3 get error',key,e)
+            # incremental runs keep the object's indexed chunks instead of reading the failure as a deletion
+            return {'id':f's3://{self.bucket}/{key}','error':str(e) or type(e).__name__} if self.state is not None else None
         try:
-            img=Image.open(io.BytesIO(body_bytes)); return pytesseract.image_to_string(img)
-        except Exception as e:
-            print('ocr error',e); return ''
+            if key.lower().endswith(HEAVY_EXT) and self._procs is not None:
+                text=self._procs.submit(extract_object,key,data).result()
+            else:
+                text=extract_object(key,data)
+        finally:
+            if isinstance(data,str): os.remove(data)
+        if not text: return None
+        if self.state is not None: self.state.mark(key,self._version(obj))
+        meta={'source':'s3','key':key,'etag':obj.get('ETag'),'last_modified':str(obj.get('LastModified'))}
+        return {'id':f's3://{self.bucket}/{key}','text':text,'meta':meta}
+    def _version(self,obj):
+        return '%s|%s'%(obj.get('ETag'),obj.get('LastModified'))
     def load(self):
-        paginator=self.s3.get_paginator('list_objects_v2'); out=[]; seen=0
-        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
-            for obj in page.get('Contents',[]):
-                key=obj['Key']
-                if self.max_objects and seen>=self.max_objects: return out
-                try:
-                    resp=self.s3.get_object(Bucket=self.bucket, Key=key); body=resp['Body'].read()
-                except Exception as e:
-                    print('s3 get error',key,e); time.sleep(self.sleep_on_rate); continue
-                text=''; lower=key.lower()
-                if self._is_text(key):
-                    try: text=body.decode('utf-8')
-                    except Exception:
-                        try: text=body.decode('latin-1')
-                        except Exception: text=''
-                elif lower.endswith('.pdf'):
-                    text=self._extract_pdf(body)
-                elif lower.endswith('.docx'):
-                    text=self._extract_docx(body)
-                elif lower.endswith('.pptx'):
-                    text=self._extract_pptx(body)
-                elif lower.endswith(('.png','.jpg','.jpeg','.tiff','.bmp')):
-                    text=self._ocr_image(body)
-                else:
-                    continue
-                if not text: continue
-                out.append({'id':f's3://{self.bucket}/{key}','text':text,'meta':{'source':'s3','key':key}}); seen+=1
-        return out
+        return list(self.iter_load())
+    def iter_load(self):
+        if self.extract_workers:
+            try: self._procs=process_pool(self.extract_workers)
+            except Exception as e: print('process pool unavailable, extracting inline',e)
+        window=max(1,self.max_workers)*2; inflight=deque()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers,thread_name_prefix='s3-fetch') as pool:
+                for obj in self._iter_objects():
+                    key=obj['Key']
+                    if self.state is not None:
+                        version=self._version(obj)
+                        if self.state.get(key)==version:
+                            self.state.mark(key,version)
+                            yield {'id':f's3://{self.bucket}/{key}','unchanged':True}; continue
+                    inflight.append(pool.submit(self._fetch,obj))
+                    # bounded look-ahead keeps at most `window` bodies in memory
+                    while len(inflight)>=window:
+                        done,_=wait(inflight,return_when=FIRST_COMPLETED)
+                        for fut in done:
+                            inflight.remove(fut)
+                            doc=fut.result()
+                            if doc: yield doc
+                for fut in list(inflight):
+                    doc=fut.result()
+                    if doc: yield doc
+        finally:
+            # the pool is shared with other sources and outlives this run
+            self._procs=None
+    def commit(self):
+        if self.state is not None: self.state.commit()
@@ -1,23 +1,62 @@
+import re
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin
-import time
-from core.loader_base import LoaderBase
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urljoin, urldefrag, urlparse
+from core.loader_base import LoaderBase, LoaderState
+from core.ratelimit import get_limiter
 HEADERS = {"User-Agent":"rag-tool-bot/1.0"}
 
 class URLLoader(LoaderBase):
-    def __init__(self, start_url, max_pages=300, delay=0.2):
+    """Breadth-first crawler: each page is fetched once over a pooled session.
+
+    Up to `max_workers` fetches run concurrently, and each host is limited to
+    one request per `delay` seconds. By default the crawl stays on the start
+    URL's host. `allow_patterns` and `deny_patterns` (regexes) narrow it
+    further. With `skip_unchanged`, re-crawls send If-None-Match and
+    If-Modified-Since. A 304 yields an 'unchanged' stub and reuses the links
+    stored for that page; a failed fetch yields `{'id', 'error'}` instead.
+    """
+    def __init__(self, start_url, max_pages=300, delay=0.1, max_workers=8, same_domain=True, allow_patterns=None,
+                 deny_patterns=None, limiter=None, skip_unchanged=False, state_path=None, timeout=15):
         self.start_url = start_url
         self.max_pages = max_pages
         self.delay = delay
-    def extract_page(self, url):
-        try:
-            r = requests.get(url, headers=HEADERS, timeout=15)
-            r.raise_for_status()
-        except Exception as e:
-            print('fetch error', url, e)
-            return None
-        soup = BeautifulSoup(r.text, 'html.parser')
+        self.max_workers = max_workers
+        self.same_domain = same_domain
+        self.allow = [re.compile(p) for p in (allow_patterns or [])]
+        self.deny = [re.compile(p) for p in (deny_patterns or [])]
+        self.limiter = limiter
+        self.timeout = timeout
+        self.state = None
+        if skip_unchanged or state_path:
+            self.state = LoaderState(state_path) if state_path else LoaderState.for_source('url-' + start_url)
+        self.session = requests.Session()
+        self.session.headers.update(HEADERS)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._host = urlparse(start_url).netloc
+
+    def in_scope(self, url):
+        if not url.startswith(('http://', 'https://')):
+            return False
+        if self.same_domain and urlparse(url).netloc != self._host:
+            return False
+        if self.allow and not any(p.search(url) for p in self.allow):
+            return False
+        return not any(p.search(url) for p in self.deny)
+
+    def _limiter(self, url):
+        if self.limiter is not None:
+            return self.limiter
+        rate = 1.0 / self.delay if self.delay else 1000.0
+        return get_limiter('host:' + urlparse(url).netloc, rate, burst=self.max_workers)
+
+    def parse_page(self, url, html):
+        soup = BeautifulSoup(html, 'html.parser')
         title_tag = soup.find(['h1']) or soup.find('title')
         title = title_tag.get_text(strip=True) if title_tag else url
         content_parts = []
@@ -27,24 +66,81 @@ class URLLoader(LoaderBase):
             if text:
                 content_parts.append(text)
         text = "\n\n".join(content_parts)
-        return {'id':url,'text':text,'meta':{'source':url,'title':title}}
+        links = []
+        for a in soup.find_all('a', href=True):
+            links.append(urldefrag(urljoin(url, a['href']))[0])
+        return {'id':url,'text':text,'meta':{'source':url,'title':title}}, links
+
+    def extract_page(self, url):
+        try:
+            r = self.session.get(url, timeout=self.timeout)
+            r.raise_for_status()
+        except Exception as e:
+            print('fetch error', url, e)
+            return None
+        return self.parse_page(url, r.text)[0]
+
+    def _fetch(self, url):
+        """Returns (doc or None, links)."""
+        headers = {}
+        prev = self.state.get(url) if self.state is not None else None
+        if prev:
+            if prev.get('etag'):
+                headers['If-None-Match'] = prev['etag']
+            if prev.get('last_modified'):
+                headers['If-Modified-Since'] = prev['last_modified']
+        self._limiter(url).acquire()
+        try:
+            r = self.session.get(url, headers=headers, timeout=self.timeout)
+            if r.status_code == 304 and prev:
+                self.state.mark(url, prev)
+                return {'id': url, 'unchanged': True}, prev.get('links', [])
+            r.raise_for_status()
+        except Exception as e:
+            print('fetch error', url, e)
+            status = getattr(getattr(e, 'response', None), 'status_code', None)
+            if self.state is None or status in (404, 410):
+                return None, []
+            # an incremental run must not read a failed fetch (timeout, 5xx) as a deleted page: report
+            # it, and keep following the links it had last time so the pages below it are still visited
+            if prev:
+                self.state.mark(url, prev)
+            return {'id': url, 'error': str(e) or type(e).__name__}, (prev or {}).get('links', [])
+        if 'html' not in r.headers.get('Content-Type', 'text/html'):
+            return None, []
+        doc, links = self.parse_page(url, r.text)
+        if self.state is not None:
+            links = [l for l in links if self.in_scope(l)]
+            # empty pages get no validators (see LoaderState)
+            validators = {}
+            if doc['text']:
+                validators = {'etag': r.headers.get('ETag'), 'last_modified': r.headers.get('Last-Modified')}
+            self.state.mark(url, dict(validators, links=links))
+        return doc, links
+
     def load(self):
-        seen=set(); to_visit=[self.start_url]; docs=[]
-        while to_visit and len(seen)<self.max_pages:
-            url=to_visit.pop(0)
-            if url in seen: continue
-            page=self.extract_page(url)
-            seen.add(url)
-            if page and page.get('text'): docs.append(page)
-            try:
-                r = requests.get(url, headers=HEADERS, timeout=10)
-                r.raise_for_status()
-                soup=BeautifulSoup(r.text,'html.parser')
-                for a in soup.find_all('a', href=True):
-                    href=urljoin(url,a['href'])
-                    if href.startswith('http') and href not in seen and href not in to_visit:
-                        to_visit.append(href)
-            except Exception:
-                pass
-            time.sleep(self.delay)
-        return docs
+        return list(self.iter_load())
+
+    def iter_load(self):
+        start = urldefrag(self.start_url)[0]
+        frontier = deque([start]); seen = {start}; inflight = set(); fetched = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='crawl') as pool:
+            while frontier or inflight:
+                while frontier and len(inflight) < self.max_workers and fetched < self.max_pages:
+                    inflight.add(pool.submit(self._fetch, frontier.popleft()))
+                    fetched += 1
+                if not inflight:
+                    break
+                done, inflight = wait(inflight, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    doc, links = fut.result()
+                    for href in links:
+                        if href not in seen and self.in_scope(href):
+                            seen.add(href)
+                            frontier.append(href)
+                    if doc and (doc.get('unchanged') or doc.get('error') or doc.get('text')):
+                        yield doc
+
+    def commit(self):
+        if self.state is not None:
+            self.state.commit()
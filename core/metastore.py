@@ -0,0 +1,256 @@
+"""Compact, memory-mapped chunk metadata store (the `.meta.bin` index sidecar).
+
+Layout: an 8-byte magic, a section count and a directory of (name, offset, size)
+entries, followed by 8-byte aligned sections. String columns are stored as a
+uint64 offset table plus one utf-8 blob, so row i of a column is
+blob[off[i]:off[i+1]] and reading a hit never touches the other rows. Document
+meta dicts repeat across every chunk of a document, so they are stored once and
+referenced per row through a uint32 index. Embeddings are not stored; they live
+in the FAISS index.
+"""
+
+import json, mmap, os, struct, tempfile, shutil
+from array import array
+import numpy as np
+
+MAGIC = b'RAGMETA1'
+_DIR_ENTRY = struct.Struct('<16sQQ')
+STRING_COLUMNS = ('id', 'source', 'title', 'text')
+_RESERVED = set(STRING_COLUMNS) | {'meta', 'embedding'}
+
+
+def metastore_path(index_path):
+    return index_path + '.meta.bin'
+
+
+class _Column:
+    """Streams one string column to a temp file while keeping only its offsets in memory."""
+
+    def __init__(self, tmpdir, name):
+        self.f = open(os.path.join(tmpdir, name), 'w+b')
+        self.offsets = array('Q', [0])
+        self.nulls = bytearray()
+
+    def add(self, value):
+        if value is None:
+            self.nulls.append(1)
+        else:
+            self.nulls.append(0)
+            self.f.write(value.encode('utf-8'))
+        self.offsets.append(self.f.tell())
+
+
+class MetaStoreWriter:
+    """Append chunk rows one at a time; `close()` assembles and atomically installs the file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._tmpdir = tempfile.mkdtemp(prefix='.metastore-', dir=os.path.dirname(os.path.abspath(path)))
+        self._cols = {name: _Column(self._tmpdir, name) for name in STRING_COLUMNS + ('extra',)}
+        self._meta = _Column(self._tmpdir, 'meta')
+        self._meta_ids = {}
+        self._meta_idx = array('I')
+        self._ids = array('q')
+        self.count = 0
+
+    def add(self, chunk, faiss_id=None):
+        for name in STRING_COLUMNS:
+            v = chunk.get(name)
+            self._cols[name].add(v if v is None or isinstance(v, str) else str(v))
+        extra = {k: v for k, v in chunk.items() if k not in _RESERVED}
+        self._cols['extra'].add(json.dumps(extra, ensure_ascii=False) if extra else None)
+        m = json.dumps(chunk.get('meta'), ensure_ascii=False, sort_keys=True)
+        idx = self._meta_ids.get(m)
+        if idx is None:
+            idx = self._meta_ids[m] = len(self._meta_ids)
+            self._meta.add(m)
+        self._meta_idx.append(idx)
+        self._ids.append(self.count if faiss_id is None else int(faiss_id))
+        self.count += 1
+
+    def add_many(self, chunks):
+        for c in chunks:
+            self.add(c)
+
+    def _sections(self):
+        out = []
+        for name, col in self._cols.items():
+            out.append((name + '.off', col.offsets.tobytes()))
+            out.append((name + '.null', bytes(col.nulls)))
+            out.append((name + '.blob', col.f))
+        out.append(('meta.off', self._meta.offsets.tobytes()))
+        out.append(('meta.blob', self._meta.f))
+        out.append(('meta.idx', self._meta_idx.tobytes()))
+        out.append(('ids', self._ids.tobytes()))
+        return out
+
+    def close(self):
+        try:
+            write_sections(self.path, MAGIC, self._sections())
+        finally:
+            for col in list(self._cols.values()) + [self._meta]:
+                col.f.close()
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+        return self.path
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def write_sections(path, magic, sections):
+    """Atomically write `magic`, a section directory and 8-byte aligned sections (bytes or open files)."""
+    sizes = []
+    for _, data in sections:
+        if isinstance(data, bytes):
+            sizes.append(len(data))
+        else:
+            data.flush()
+            sizes.append(data.tell())
+    pos = _align(len(magic) + 8 + _DIR_ENTRY.size * len(sections))
+    directory = []
+    for (name, _), size in zip(sections, sizes):
+        directory.append(_DIR_ENTRY.pack(name.encode('ascii'), pos, size))
+        pos = _align(pos + size)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(magic)
+        f.write(struct.pack('<Q', len(sections)))
+        f.write(b''.join(directory))
+        for (_, data), size in zip(sections, sizes):
+            f.write(b'\0' * (_align(f.tell()) - f.tell()))
+            if isinstance(data, bytes):
+                f.write(data)
+            else:
+                data.seek(0)
+                shutil.copyfileobj(data, f, 1 << 20)
+    os.replace(tmp, path)
+
+
+def read_sections(path, magic):
+    """mmap a file written by `write_sections`; returns (mmap, {name: (offset, size)})."""
+    with open(path, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mm[:len(magic)] != magic:
+        raise ValueError('not a %s file: %s' % (magic.decode('ascii', 'replace'), path))
+    (nsec,) = struct.unpack_from('<Q', mm, len(magic))
+    sections = {}
+    for i in range(nsec):
+        name, off, size = _DIR_ENTRY.unpack_from(mm, len(magic) + 8 + i * _DIR_ENTRY.size)
+        sections[name.rstrip(b'\0').decode('ascii')] = (off, size)
+    return mm, sections
+
+
+def section_array(mm, sections, name, dtype):
+    off, size = sections[name]
+    return np.frombuffer(mm, dtype=dtype, count=size // np.dtype(dtype).itemsize, offset=off)
+
+
+def write_metastore(path, chunks):
+    w = MetaStoreWriter(path)
+    w.add_many(chunks)
+    return w.close()
+
+
+class MetaStore:
+    """Read-only, mmap-backed view of a `.meta.bin` file. Supports len(), store[i] and iteration."""
+
+    def __init__(self, path):
+        self.path = path
+        self._mm, self._sec = read_sections(path, MAGIC)
+        self._off = {name: self._array(name + '.off', np.uint64) for name in STRING_COLUMNS + ('extra', 'meta')}
+        self._null = {name: self._array(name + '.null', np.uint8) for name in STRING_COLUMNS + ('extra',)}
+        self._meta_idx = self._array('meta.idx', np.uint32)
+        self.ids = self._array('ids', np.int64)
+        self._meta_cache = {}
+        self._id_order = None
+
+    def _array(self, name, dtype):
+        return section_array(self._mm, self._sec, name, dtype)
+
+    def __len__(self):
+        return len(self._meta_idx)
+
+    def _string(self, col, i):
+        if col in self._null and self._null[col][i]:
+            return None
+        base = self._sec[col + '.blob'][0]
+        offs = self._off[col]
+        return self._mm[base + int(offs[i]):base + int(offs[i + 1])].decode('utf-8')
+
+    def text(self, i):
+        return self._string('text', i)
+
+    def chunk_id(self, i):
+        return self._string('id', i)
+
+    def meta(self, i):
+        m = int(self._meta_idx[i])
+        if m not in self._meta_cache:
+            self._meta_cache[m] = json.loads(self._string('meta', m))
+        return self._meta_cache[m]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        row = {name: self._string(name, i) for name in STRING_COLUMNS}
+        row['meta'] = self.meta(i)
+        extra = self._string('extra', i)
+        if extra:
+            row.update(json.loads(extra))
+        return row
+
+    def row_of(self, faiss_id):
+        """Row position holding `faiss_id` (rows are written in id order unless the index was patched)."""
+        if self._id_order is None:
+            n = len(self.ids)
+            if n == 0 or (self.ids[0] == 0 and self.ids[-1] == n - 1 and np.all(np.diff(self.ids) == 1)):
+                self._id_order = False
+            else:
+                order = np.argsort(self.ids, kind='stable')
+                self._id_order = (order, self.ids[order])
+        if self._id_order is False:
+            return int(faiss_id)
+        order, sorted_ids = self._id_order
+        pos = int(np.searchsorted(sorted_ids, faiss_id))
+        if pos >= len(sorted_ids) or sorted_ids[pos] != faiss_id:
+            raise KeyError(faiss_id)
+        return int(order[pos])
+
+    def get_by_id(self, faiss_id):
+        return self[self.row_of(faiss_id)]
+
+    def get_many(self, rows):
+        return [self[int(i)] for i in rows]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def close(self):
+        self._off = self._null = self._meta_idx = self.ids = None
+        try:
+            self._mm.close()
+        except BufferError:
+            pass  # rows still referenced elsewhere; the map is released when they are
+
+
+def migrate_json(index_path):
+    """Convert a legacy `.meta.json` sidecar (with embeddings) into `.meta.bin`."""
+    with open(index_path + '.meta.json', 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+    return write_metastore(metastore_path(index_path), chunks)
+
+
+if __name__ == '__main__':
+    import sys
+    for p in sys.argv[1:]:
+        print('wrote', migrate_json(p))
@@ -0,0 +1,228 @@
+"""Timing, counts and memory for ingest runs and the search service.
+
+`Histogram` buckets latencies (in seconds) the way Prometheus does, and
+`render` writes metric families in the Prometheus text format, so the API can
+serve `/metrics` without a client library. Within one thread, `begin` /
+`span` / `collect` split a request into stages (`core.retriever` marks
+metadata fetches as `fetch`). Outside a `begin`, `span` records nothing.
+`RunReport` accumulates per-stage wall time, items and bytes for an ingest run
+and writes them, with peak RSS, as JSON. `profiled` runs a block under cProfile
+(or pyinstrument).
+"""
+
+import bisect, json, math, os, sys, threading, time
+from contextlib import contextmanager
+
+# 0.5 ms .. 10 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self.counts = [0] * (len(self.buckets) + 1)  # the last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-quantile (the max for the +Inf bucket)."""
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank, seen = q * self.count, 0
+            for i, c in enumerate(self.counts):
+                seen += c
+                if seen >= rank and c:
+                    return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+            return self.max
+
+    def snapshot(self):
+        """count / avg / max / p50 / p95 / p99 in milliseconds."""
+        with self._lock:
+            count, total, peak = self.count, self.sum, self.max
+        out = {'count': count, 'avg_ms': round(total / count * 1000, 3) if count else 0.0,
+               'max_ms': round(peak * 1000, 3)}
+        for q in (50, 95, 99):
+            out['p%d_ms' % q] = round(self.quantile(q / 100.0) * 1000, 3)
+        return out
+
+    def samples(self, name, labels):
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        out, seen = [], 0
+        for bound, c in zip(self.buckets + (math.inf,), counts):
+            seen += c
+            out.append((name + '_bucket', dict(labels, le='+Inf' if bound == math.inf else repr(bound)), seen))
+        out.append((name + '_sum', labels, total))
+        out.append((name + '_count', labels, count))
+        return out
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for k, v in labels.items())
+
+
+def _value(v):
+    if v is None:
+        return 'NaN'
+    return repr(float(v)) if isinstance(v, float) else str(int(v))
+
+
+def render(families):
+    """Prometheus text format for `[(name, kind, help, [(labels, value)])]`.
+
+    `kind` is counter, gauge or histogram; histogram values are `Histogram`s.
+    """
+    lines = []
+    for name, kind, help, values in families:
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, v in values:
+            samples = v.samples(name, labels) if kind == 'histogram' else [(name, labels, v)]
+            for sample, lbl, x in samples:
+                lines.append('%s%s %s' % (sample, _labels(lbl), _value(x)))
+    return '\n'.join(lines) + '\n'
+
+
+_local = threading.local()
+
+
+def begin():
+    """Start collecting `span` times in the calling thread."""
+    _local.spans = {}
+
+
+def collect():
+    """Seconds per span name since `begin`; stops collecting."""
+    spans = getattr(_local, 'spans', None) or {}
+    _local.spans = None
+    return spans
+
+
+@contextmanager
+def span(name):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans = getattr(_local, 'spans', None)
+        if spans is not None:
+            spans[name] = spans.get(name, 0.0) + time.perf_counter() - t0
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None where `resource` is unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+class _Stage:
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+        self.items = 0
+        self.bytes = 0
+
+    def add(self, items=0, bytes=0):
+        self.items += items
+        self.bytes += bytes
+
+    def as_dict(self):
+        return {'seconds': round(self.seconds, 3), 'calls': self.calls, 'items': self.items, 'bytes': self.bytes,
+                'items_per_sec': round(self.items / self.seconds, 2) if self.seconds > 0 else 0.0}
+
+
+class RunReport:
+    """Per-stage wall time, items and bytes of one ingest run."""
+
+    def __init__(self):
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self.stages = {}
+
+    def get(self, name):
+        if name not in self.stages:
+            self.stages[name] = _Stage()
+        return self.stages[name]
+
+    @contextmanager
+    def stage(self, name):
+        """Time a block as (one call of) stage `name`; the block can `add` items / bytes to it."""
+        st = self.get(name)
+        t0 = time.perf_counter()
+        try:
+            yield st
+        finally:
+            st.seconds += time.perf_counter() - t0
+            st.calls += 1
+
+    def timed(self, name, iterable):
+        """Yield from `iterable`, counting the time spent waiting for each item as stage `name`."""
+        st = self.get(name)
+        it = iter(iterable)
+        while True:
+            t0 = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                st.seconds += time.perf_counter() - t0
+                return
+            st.seconds += time.perf_counter() - t0
+            st.calls += 1
+            st.items += 1
+            yield item
+
+    def as_dict(self, **extra):
+        out = {'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+               'seconds': round(time.perf_counter() - self._t0, 3), 'peak_rss_bytes': peak_rss(),
+               'stages': {name: st.as_dict() for name, st in self.stages.items()}}
+        out.update(extra)
+        return out
+
+    def write(self, path, **extra):
+        tmp = path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.as_dict(**extra), f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp, path)
+
+
+@contextmanager
+def profiled(path, kind='cprofile'):
+    """Profile the block into `path`: a pstats file for cprofile, an HTML report for pyinstrument."""
+    if kind == 'pyinstrument':
+        from pyinstrument import Profiler
+        prof = Profiler()
+        prof.start()
+        try:
+            yield
+        finally:
+            prof.stop()
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(prof.output_html())
+        return
+    import cProfile
+    prof = cProfile.Profile()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        prof.dump_stats(path)
@@ -0,0 +1,383 @@
+"""Streaming ingestion: loaders -> chunker -> embedder -> FAISS index in fixed-size batches.
+
+Documents are pulled lazily from `LoaderBase.iter_load()`. Each batch is
+chunked and embedded, and its vectors and metadata rows are appended to a work
+directory next to the index (`<index>.work/`), so loading, chunking and
+embedding hold one batch at a time. The final build does grow with the corpus:
+besides the FAISS index itself, the metastore writer keeps its column offsets,
+the BM25 writer its postings and the filter writer its keys and ids in memory
+until they are written out. A checkpoint (`state.json`) records how much of
+those files is complete, so a crashed run resumes from the last checkpoint and
+skips documents it already ingested. Once the loaders are exhausted, the index
+and metastore are built from the work files in batches and installed
+atomically.
+"""
+
+import json, os, queue, shutil, threading, time
+import numpy as np
+from core import constants
+from core.bm25 import BM25Writer, bm25_path, write_for_index
+from core.chunker import chunk_docs
+from core.embedder import get_embedder, embed_chunks
+from core.embed_cache import get_embed_cache
+from core.filters import FilterWriter, filters_path, write_filters_for_index
+from core.index_factory import build_faiss, index_options, installing, save_params
+from core.metastore import MetaStoreWriter, metastore_path
+from core.metrics import RunReport
+from core.shards import build_shards, remove_stale_shards, write_manifest
+from core.ratelimit import get_limiter
+
+
+def make_loader(source, loaders=None, incremental=False, refetch=False):
+    """Instantiate the loader for one `sources:` entry of the config, or None if unsupported.
+
+    Optional per-source keys: `concurrency` (the loader's worker threads) and
+    `rate` (requests/s, shared by every loader reading the same source); URL
+    sources also take `allow` / `deny` regex lists to scope the crawl. With
+    `incremental`, loaders that can detect unchanged items skip them and yield
+    `unchanged` stubs instead (see core.incremental); `refetch` ignores their
+    previous sync state, for runs that rebuild the index.
+    """
+    loader = _new_loader(source, loaders or {}, incremental)
+    if refetch and getattr(loader, 'state', None) is not None:
+        loader.state.forget()
+    return loader
+
+
+def _new_loader(source, loaders, incremental):
+    t = source.get('type')
+    v = source.get('value')
+    opts = {}
+    if source.get('concurrency'):
+        opts['max_workers'] = int(source['concurrency'])
+    if source.get('rate'):
+        opts['limiter'] = get_limiter('%s:%s' % (t, v), float(source['rate']))
+    if t == 'file':
+        from core.loaders.file_loader import FileLoader
+        return loaders.get('FileLoader', FileLoader)(v)
+    if t == 'url':
+        from core.loaders.url_loader import URLLoader
+        return loaders.get('URLLoader', URLLoader)(v, allow_patterns=source.get('allow'), deny_patterns=source.get('deny'),
+                                                   skip_unchanged=incremental, **opts)
+    if t == 'notion':
+        from core.loaders.notion_loader import NotionLoader
+        return loaders.get('NotionLoader', NotionLoader)(token=os.getenv('NOTION_TOKEN'), database_id=v,
+                                                         skip_unchanged=incremental, **opts)
+    if t == 's3':
+        from core.loaders.s3_loader import S3Loader
+        bucket, prefix = v.split('|', 1) if '|' in v else (v, '')
+        return loaders.get('S3Loader', S3Loader)(bucket, prefix=prefix, skip_unchanged=incremental, **opts)
+    if t == 'pdf' and 'PDFLoader' in loaders:
+        return loaders['PDFLoader'](v)
+    return None
+
+
+def source_name(source):
+    return '%s:%s' % (source.get('type'), source.get('value'))
+
+
+def iter_source_docs(sources, loaders=None, report=None, incremental=False, refetch=False):
+    for s in sources:
+        st = _SourceStats()
+        if report is not None:
+            report[source_name(s)] = st
+        loader = st.loader = make_loader(s, loaders, incremental, refetch)
+        if loader is None:
+            print('Unknown source type', s.get('type'))
+            st.error = 'unsupported source type'
+            continue
+        for doc in loader.iter_load():
+            st.add(doc)
+            yield doc
+        st.finish()
+
+
+class _SourceStats:
+    def __init__(self):
+        self.docs = 0
+        self.bytes = 0
+        self.failed = 0  # items the loader could not fetch (error stubs)
+        self.error = None
+        self.loader = None
+        self.started = time.perf_counter()
+        self.seconds = None
+
+    def add(self, doc):
+        if doc.get('error'):
+            self.failed += 1
+            return
+        self.docs += 1
+        self.bytes += len((doc.get('text') or '').encode('utf-8'))
+
+    def finish(self, error=None):
+        self.seconds = time.perf_counter() - self.started
+        if error is not None:
+            self.error = repr(error)
+
+    def as_dict(self):
+        secs = self.seconds if self.seconds is not None else time.perf_counter() - self.started
+        return {'docs': self.docs, 'bytes': self.bytes, 'seconds': round(secs, 3),
+                'docs_per_sec': round(self.docs / secs, 2) if secs > 0 else 0.0, 'failed': self.failed,
+                'error': self.error}
+
+
+_DONE = object()
+
+
+def iter_source_docs_concurrent(sources, loaders=None, max_workers=4, queue_size=256, report=None, incremental=False,
+                                refetch=False):
+    """Run up to `max_workers` loaders at once and yield their documents as they arrive.
+
+    A bounded queue provides backpressure, so fast loaders wait for the chunk/embed
+    stages instead of buffering the corpus. A failing source is recorded in
+    `report` and does not stop the others.
+    """
+    report = {} if report is None else report
+    q = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    slots = threading.BoundedSemaphore(max_workers)
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def work(s, st):
+        with slots:
+            st.started = time.perf_counter()
+            try:
+                loader = st.loader = make_loader(s, loaders, incremental, refetch)
+                if loader is None:
+                    raise ValueError('unsupported source type %r' % s.get('type'))
+                for doc in loader.iter_load():
+                    st.add(doc)
+                    if not put(doc):
+                        break
+                st.finish()
+            except Exception as e:
+                print('source failed', source_name(s), e)
+                st.finish(e)
+            finally:
+                put(_DONE)
+
+    threads = []
+    for s in sources:
+        st = report[source_name(s)] = _SourceStats()
+        t = threading.Thread(target=work, args=(s, st), daemon=True, name='loader-' + str(s.get('type')))
+        t.start()
+        threads.append(t)
+    remaining = len(threads)
+    try:
+        while remaining:
+            item = q.get()
+            if item is _DONE:
+                remaining -= 1
+            else:
+                yield item
+    finally:
+        stop.set()
+
+
+def source_report(report):
+    return {name: st.as_dict() for name, st in report.items()}
+
+
+def commit_sources(report):
+    """Persist loader sync state after their documents have been indexed."""
+    for st in report.values():
+        if st.loader is not None and not st.error:
+            st.loader.commit()
+
+
+def batched(iterable, n):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= n:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class IngestWorkDir:
+    """Append-only vectors / rows / doc-id files plus a checkpoint of their committed sizes."""
+
+    def __init__(self, path, resume=True):
+        self.path = path
+        if not resume:
+            shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path, exist_ok=True)
+        self.state = {'dim': None, 'rows': 0, 'vec_bytes': 0, 'rows_bytes': 0, 'docs_bytes': 0}
+        state_path = os.path.join(path, 'state.json')
+        if os.path.exists(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        # drop anything written after the last checkpoint
+        self._vec = self._open('vectors.f32', self.state['vec_bytes'])
+        self._rows = self._open('rows.jsonl', self.state['rows_bytes'])
+        self._docs = self._open('docs.txt', self.state['docs_bytes'])
+        self._pending_rows = 0
+        self.done_docs = set()
+        if self.state['docs_bytes']:
+            self._docs.seek(0)
+            self.done_docs = set(self._docs.read().decode('utf-8').splitlines())
+            self._docs.seek(0, os.SEEK_END)
+
+    def _open(self, name, size):
+        p = os.path.join(self.path, name)
+        f = open(p, 'r+b' if os.path.exists(p) else 'w+b')
+        f.truncate(size)
+        f.seek(size)
+        return f
+
+    @property
+    def resumed_rows(self):
+        return self.state['rows']
+
+    def append(self, docs, chunks, vectors):
+        if len(chunks):
+            vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+            self.state['dim'] = self.state['dim'] or int(vectors.shape[1])
+            self._vec.write(vectors.tobytes())
+            for c in chunks:
+                row = {k: v for k, v in c.items() if k != 'embedding'}
+                self._rows.write(json.dumps(row, ensure_ascii=False).encode('utf-8') + b'\n')
+            self._pending_rows += len(chunks)
+        for d in docs:
+            self._docs.write(d['id'].replace('\n', ' ').encode('utf-8') + b'\n')
+            self.done_docs.add(d['id'])
+
+    def checkpoint(self):
+        for f in (self._vec, self._rows, self._docs):
+            f.flush()
+            os.fsync(f.fileno())
+        self.state['rows'] += self._pending_rows
+        self._pending_rows = 0
+        self.state['vec_bytes'] = self._vec.tell()
+        self.state['rows_bytes'] = self._rows.tell()
+        self.state['docs_bytes'] = self._docs.tell()
+        tmp = os.path.join(self.path, 'state.json.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp, os.path.join(self.path, 'state.json'))
+
+    def vectors(self):
+        n, dim = self.state['rows'], self.state['dim']
+        if not n:
+            return np.zeros((0, dim or 0), dtype=np.float32)
+        return np.memmap(os.path.join(self.path, 'vectors.f32'), dtype=np.float32, mode='r', shape=(n, dim))
+
+    def iter_rows(self):
+        with open(os.path.join(self.path, 'rows.jsonl'), 'r', encoding='utf-8') as f:
+            for _ in range(self.state['rows']):
+                yield json.loads(f.readline())
+
+    def close(self):
+        for f in (self._vec, self._rows, self._docs):
+            f.close()
+
+    def remove(self):
+        self.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def build_faiss_from_workdir(work, index_path, index_type='faiss', opts=None, add_batch=65536):
+    import faiss
+    shards = int((opts or {}).get('shards') or 1)
+    if shards > 1:
+        manifest = build_shards(work.vectors(), index_path, index_type, opts, shards, add_batch=add_batch)
+        params = {'type': index_type, 'metric': manifest['metric'], 'shards': len(manifest['shards'])}
+    else:
+        index, params = build_faiss(work.vectors(), index_type, opts, add_batch)
+    with installing(index_path):
+        save_params(index_path, params)
+        writer = MetaStoreWriter(metastore_path(index_path))
+        keywords = BM25Writer(bm25_path(index_path)) if (opts or {}).get('bm25', True) is not False else None
+        fields = FilterWriter(filters_path(index_path)) if (opts or {}).get('filters', True) is not False else None
+        for i, row in enumerate(work.iter_rows()):
+            writer.add(row)
+            if keywords is not None:
+                keywords.add(row.get('text'))
+            if fields is not None:
+                fields.add(row, i)
+        writer.close()
+        if keywords is not None:
+            keywords.close()
+        else:
+            write_for_index(index_path, (), False)
+        if fields is not None:
+            fields.close()
+        else:
+            write_filters_for_index(index_path, (), enabled=False)
+        if shards > 1:
+            write_manifest(index_path, manifest)
+        else:
+            faiss.write_index(index, index_path + '.tmp')
+            os.replace(index_path + '.tmp', index_path)
+            remove_stale_shards(index_path)
+    return index_path
+
+
+def run_streaming(docs, config, embedder=None, index_path=None, batch_docs=None, checkpoint_every=None,
+                  resume=True, report=None):
+    """Ingest an iterable of documents into the FAISS index at `index_path` with bounded memory.
+
+    Chunk / embed / write / build times, items and bytes go to `report` (a core.metrics.RunReport).
+    """
+    pipe = config.get('pipeline', {})
+    index_path = index_path or config.get(constants.INDEX, {}).get(constants.PATH, 'rag_index.faiss')
+    batch_docs = batch_docs or pipe.get('batch_docs', 64)
+    checkpoint_every = checkpoint_every or pipe.get('checkpoint_every', 10)
+    embedder = embedder or get_embedder(config)
+
+    report = report if report is not None else RunReport()
+    work = IngestWorkDir(index_path + '.work', resume=resume)
+    stats = {'docs': 0, 'docs_skipped': 0, 'chunks': 0, 'resumed_chunks': work.resumed_rows}
+    t0 = time.perf_counter()
+    cache = None
+    try:
+        cache = get_embed_cache(config)
+        for n, batch in enumerate(batched(docs, batch_docs), 1):
+            # error stubs only come from incremental loaders; they are not ingested
+            fresh = [d for d in batch if d['id'] not in work.done_docs and not d.get('error')]
+            stats['docs_skipped'] += len(batch) - len(fresh)
+            with report.stage('chunk') as st:
+                chunks = chunk_docs(fresh, config)
+                st.add(len(fresh), sum(len((d.get('text') or '').encode('utf-8')) for d in fresh))
+            vectors = []
+            if chunks:
+                with report.stage('embed') as st:
+                    embed_chunks(chunks, config, embedder=embedder, cache=cache)
+                    vectors = np.asarray([c['embedding'] for c in chunks], dtype=np.float32)
+                    st.add(len(chunks), sum(len(c['text'].encode('utf-8')) for c in chunks))
+            with report.stage('write') as st:
+                work.append(fresh, chunks, vectors)
+                if n % checkpoint_every == 0:
+                    work.checkpoint()
+                st.add(len(chunks), vectors.nbytes if len(chunks) else 0)
+            stats['docs'] += len(fresh)
+            stats['chunks'] += len(chunks)
+        work.checkpoint()
+        if not work.state['rows']:
+            work.remove()
+            raise ValueError('no chunks to index')
+        idx = config.get(constants.INDEX, {})
+        with report.stage('build') as st:
+            build_faiss_from_workdir(work, index_path, idx.get('type', 'faiss'), index_options(config))
+            st.add(work.state['rows'])
+        if cache is not None:
+            stats['embed_cache'] = cache.stats()
+    except BaseException:
+        work.close()
+        raise
+    finally:
+        if cache is not None:
+            cache.close()
+    work.remove()
+    stats['seconds'] = round(time.perf_counter() - t0, 3)
+    return stats
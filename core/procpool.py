@@ -0,0 +1,29 @@
+"""Process pools for CPU-bound ingest work (document extraction, chunking).
+
+One pool per worker count is shared by every loader and the chunker, so
+concurrent sources do not each start their own set of processes. Workers are
+started with forkserver (spawn where it is unavailable), never fork: ingest
+runs loaders on threads that hold locks (rate limiters, caches, queues), and a
+forked child inherits those locks still held by threads that do not exist in
+it. Functions sent to a pool must therefore be importable by module path.
+"""
+
+import multiprocessing, threading
+from concurrent.futures import ProcessPoolExecutor
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def process_pool(workers):
+    """The shared pool with `workers` processes, started on first use."""
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = _pools[workers] = ProcessPoolExecutor(max_workers=workers, mp_context=_context())
+        return pool
@@ -0,0 +1,159 @@
+"""Two-level query cache for the search service.
+
+Level 1 maps normalized query text to its embedding, so agent retries and
+repeated questions skip the embedding model. Level 2 maps (embedding hash,
+filter, top_k, min_score, index generation) to the formatted hits. The generation
+changes whenever the index handle swaps in a rebuilt index, so stale results
+can never be served. Both levels are LRU-bounded by entry count and bytes,
+with an optional TTL.
+
+With `shared_path`, level 1 is backed by an on-disk EmbeddingCache. Worker
+processes on one host then share query embeddings. Results stay per process,
+because the index generation is local to each process. For the same reason
+results are not cached at all for Chroma and Milvus (`VectorStore.cacheable`):
+their collections change under other processes' writes without this process
+seeing a new generation.
+"""
+
+import hashlib, json, threading, time
+from collections import OrderedDict
+import numpy as np
+from core import constants
+from core.embed_cache import EmbeddingCache, cached_embed, normalize_text
+
+
+class LRUCache:
+    """Thread-safe LRU map bounded by entries and bytes, with optional TTL (seconds)."""
+
+    def __init__(self, max_entries=10000, max_bytes=None, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.ttl and item[2] < time.monotonic():
+                self._drop(key)
+                self.expired += 1
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, size, time.monotonic() + self.ttl if self.ttl else None)
+            self.bytes += size
+            while self._data and (len(self._data) > self.max_entries or
+                                  (self.max_bytes and self.bytes > self.max_bytes)):
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'entries': len(self._data), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0, 'evictions': self.evictions,
+                'expired': self.expired}
+
+
+def _hits_size(hits):
+    return 64 + sum(96 + len(h.get('text') or '') + len(h.get('source') or '') for h in hits)
+
+
+class QueryCache:
+    def __init__(self, embeddings=10000, results=10000, ttl=300, max_mb=256, shared_path=None, shared_max_mb=None):
+        max_bytes = int(max_mb * 1024 * 1024) if max_mb else None
+        # the byte budget is split evenly between the two levels
+        self.embeddings = LRUCache(embeddings, max_bytes // 2 if max_bytes else None, ttl)
+        self.results = LRUCache(results, max_bytes // 2 if max_bytes else None, ttl)
+        self.shared = None
+        if shared_path:
+            self.shared = EmbeddingCache(shared_path, int(shared_max_mb * 1024 * 1024) if shared_max_mb else None)
+        self._generation = None
+
+    @classmethod
+    def from_config(cls, config):
+        """QueryCache from the `query_cache` config block, or None when it is absent or disabled."""
+        cfg = config.get(constants.QUERY_CACHE)
+        if not cfg or cfg.get('enabled') is False:
+            return None
+        keys = ('embeddings', 'results', 'ttl', 'max_mb', 'shared_path', 'shared_max_mb')
+        return cls(**{k: cfg[k] for k in keys if k in cfg})
+
+    def embed(self, embedder, queries):
+        """Embeddings for `queries` (float32 matrix); only unseen normalized texts reach the embedder."""
+        model = embedder.cache_key
+        norm = [normalize_text(q) for q in queries]
+        vecs = [self.embeddings.get((model, t)) for t in norm]
+        todo = list(dict.fromkeys(t for t, v in zip(norm, vecs) if v is None))
+        if todo:
+            if self.shared is not None:
+                fresh = cached_embed(embedder, todo, self.shared)
+            else:
+                fresh = np.asarray(embedder.embed(todo), dtype=np.float32)
+            by_text = {}
+            for t, v in zip(todo, fresh):
+                v = np.array(v, dtype=np.float32)
+                v.flags.writeable = False
+                by_text[t] = v
+                self.embeddings.put((model, t), v, v.nbytes + len(t) + 64)
+            vecs = [by_text[t] if v is None else v for t, v in zip(norm, vecs)]
+        return np.vstack(vecs) if vecs else np.zeros((0, 0), dtype=np.float32)
+
+    def result_key(self, emb, query, top_k, min_score, generation, hybrid=False, filter=None):
+        h = hashlib.sha1(np.ascontiguousarray(emb, dtype=np.float32).tobytes())
+        if hybrid:
+            # keyword hits depend on the text, not just the embedding
+            h.update(normalize_text(query).encode('utf-8'))
+        if filter:
+            h.update(b'\0' + json.dumps(filter, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        return h.digest(), top_k, min_score, generation
+
+    def get_results(self, key):
+        self._check_generation(key[3])
+        return self.results.get(key)
+
+    def put_results(self, key, hits):
+        self.results.put(key, hits, _hits_size(hits))
+
+    def _check_generation(self, generation):
+        if self._generation is None or generation > self._generation:
+            # a new index generation: every cached result belongs to the old index
+            if self._generation is not None:
+                self.results.clear()
+            self._generation = generation
+
+    def stats(self):
+        out = {'embeddings': self.embeddings.stats(), 'results': self.results.stats(), 'generation': self._generation}
+        if self.shared is not None:
+            out['shared'] = self.shared.stats()
+        return out
+
+    def close(self):
+        if self.shared is not None:
+            self.shared.close()
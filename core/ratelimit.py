@@ -0,0 +1,161 @@
+"""Shared, rate-limit-aware scheduling for loaders and API clients.
+
+`TokenBucket` paces requests against one upstream (a host, the Notion API, an S3
+bucket) across every thread that uses it. When a call is throttled, `retry_call`
+backs off, and it also pauses the shared bucket for the server-provided
+Retry-After. Concurrent workers then slow down together instead of each
+discovering the limit on its own.
+"""
+
+import random, re, sys, threading, time
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, n):
+        """Take `n` tokens (possibly going negative); return how long the caller must wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            return max(wait, self._paused_until - now)
+
+    def acquire(self, n=1):
+        wait = self._reserve(n)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        """Hold every user of this bucket for `seconds` (e.g. after a 429 with Retry-After)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+
+def get_limiter(name, rate, burst=None):
+    """Process-wide limiter registry so every loader hitting `name` shares one budget."""
+    with _LIMITERS_LOCK:
+        lim = _LIMITERS.get(name)
+        if lim is None:
+            lim = _LIMITERS[name] = TokenBucket(rate, burst)
+        return lim
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_UNITS = {'ms': 0.001, 's': 1.0, 'm': 60.0, 'h': 3600.0}
+
+
+def parse_duration(value):
+    """Seconds from '1.5', '20ms', '6m0s' style values (OpenAI x-ratelimit-reset-*), or None."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    parts = _DURATION.findall(str(value))
+    return sum(float(n) * _UNITS[u] for n, u in parts) if parts else None
+
+
+def retry_after(exc):
+    """Best-effort Retry-After (seconds) from requests/httpx/botocore/SDK exceptions.
+
+    Falls back to `retry-after-ms` and the x-ratelimit-reset-* headers sent by OpenAI-style APIs.
+    """
+    headers = getattr(exc, 'headers', None)
+    resp = getattr(exc, 'response', None)
+    if headers is None and resp is not None:
+        headers = getattr(resp, 'headers', None)
+        if headers is None and isinstance(resp, dict):
+            headers = resp.get('ResponseMetadata', {}).get('HTTPHeaders')
+    if not headers:
+        return None
+    value = headers.get('retry-after') or headers.get('Retry-After')
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    if headers.get('retry-after-ms'):
+        return parse_duration(headers['retry-after-ms'] + 'ms')
+    if status_code(exc) != 429:
+        return None
+    # throttled without Retry-After: wait for the exhausted budget (requests or tokens) to reset
+    resets = {k: parse_duration(headers.get('x-ratelimit-reset-' + k)) for k in ('requests', 'tokens')}
+    resets = {k: v for k, v in resets.items() if v is not None}
+    spent = [v for k, v in resets.items() if str(headers.get('x-ratelimit-remaining-' + k)) == '0']
+    if spent or resets:
+        return max(spent) if spent else min(resets.values())
+    return None
+
+
+def status_code(exc):
+    for obj in (exc, getattr(exc, 'response', None)):
+        code = getattr(obj, 'status_code', None) or getattr(obj, 'status', None)
+        if isinstance(code, int):
+            return code
+    resp = getattr(exc, 'response', None)
+    if isinstance(resp, dict):
+        return resp.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return None
+
+
+# transport failures worth retrying, by client library; a module is only consulted once it is imported
+_TRANSIENT = (
+    ('requests.exceptions', ('ConnectionError', 'Timeout', 'ChunkedEncodingError')),
+    ('httpx', ('TimeoutException', 'NetworkError', 'RemoteProtocolError')),
+    ('openai', ('APIConnectionError',)),  # includes APITimeoutError
+    ('botocore.exceptions', ('ConnectionError', 'HTTPClientError')),
+    ('notion_client.errors', ('RequestTimeoutError',)),
+)
+
+
+def _transient_types():
+    types = [ConnectionError, TimeoutError]
+    for module, names in _TRANSIENT:
+        mod = sys.modules.get(module)
+        if mod is not None:
+            types += [getattr(mod, n) for n in names if isinstance(getattr(mod, n, None), type)]
+    return tuple(types)
+
+
+def is_retryable(exc):
+    """429 / 5xx responses and connection or timeout errors; anything else (bugs, 4xx, bad data) is raised at once."""
+    code = status_code(exc)
+    if code is not None:
+        return code == 429 or code >= 500
+    return isinstance(exc, _transient_types())
+
+
+def retry_call(fn, *args, retries=5, limiter=None, base=0.5, cap=30.0, retryable=is_retryable, **kwargs):
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            attempt += 1
+            if attempt >= retries or not retryable(e):
+                raise
+            delay = retry_after(e)
+            if delay is not None and limiter is not None:
+                limiter.pause(delay)
+            time.sleep(delay if delay is not None else backoff_delay(attempt, base, cap))
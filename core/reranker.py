@@ -0,0 +1,99 @@
+"""Second-stage re-ranking of retrieved chunks with a local cross-encoder.
+
+The index returns N candidates per query; the cross-encoder scores every
+(query, chunk text) pair in batches and only the best `top_k` are returned.
+N is `candidates`, capped by `budget_ms`: the reranker keeps a moving average
+of the cost of one pair, so when pairs get slower (CPU contention) or a search
+call carries more queries (micro-batches grow under load), fewer candidates
+are fetched. N never drops below `top_k`.
+"""
+
+import threading, time
+import numpy as np
+from core import constants
+
+
+class CrossEncoderScorer:
+    """sentence-transformers CrossEncoder, loaded on first use."""
+
+    def __init__(self, model_name, batch_size=32, max_length=512):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self._model = None
+        self._load_lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length)
+        return self._model
+
+    def score(self, pairs):
+        """Relevance of each (query, text) pair, higher is better."""
+        scores = self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False,
+                                    convert_to_numpy=True)
+        return np.asarray(scores, dtype='float32').reshape(len(pairs))
+
+
+class Reranker:
+    def __init__(self, scorer, candidates=50, budget_ms=None, smoothing=0.2):
+        self.scorer = scorer
+        self.candidates = candidates
+        self.budget_ms = budget_ms
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self.pair_ms = None  # moving average of the scoring cost of one pair
+        self.calls = 0
+        self.pairs = 0
+        self.capped = 0  # calls whose candidate count the budget lowered
+
+    @classmethod
+    def from_config(cls, config):
+        """Reranker from the `rerank` config block, or None when it is absent or disabled."""
+        cfg = config.get(constants.RERANK)
+        if not cfg or cfg.get('enabled') is False:
+            return None
+        scorer = CrossEncoderScorer(cfg.get(constants.MODEL) or 'cross-encoder/ms-marco-MiniLM-L-6-v2',
+                                    cfg.get(constants.BATCH_SIZE) or 32, cfg.get('max_length') or 512)
+        return cls(scorer, cfg.get('candidates') or 50, cfg.get('budget_ms'))
+
+    def candidates_for(self, top_k, n_queries=1):
+        """Candidates to fetch per query for one search call over `n_queries` queries."""
+        n = self.candidates
+        with self._lock:
+            if self.budget_ms and self.pair_ms:
+                n = min(n, int(self.budget_ms / (self.pair_ms * n_queries)))
+                if n < self.candidates:
+                    self.capped += 1
+        return max(n, top_k)
+
+    def rerank(self, queries, hits_lists, top_k):
+        """The best `top_k` of each query's hits by cross-encoder score (kept as `rerank_score`)."""
+        pairs = [(q, h['meta'].get('text') or '') for q, hits in zip(queries, hits_lists) for h in hits]
+        if not pairs:
+            return [[] for _ in hits_lists]
+        t0 = time.perf_counter()
+        scores = self.scorer.score(pairs)
+        ms = (time.perf_counter() - t0) * 1000 / len(pairs)
+        with self._lock:
+            self.pair_ms = ms if self.pair_ms is None else self.pair_ms + self.smoothing * (ms - self.pair_ms)
+            self.calls += 1
+            self.pairs += len(pairs)
+        out, pos = [], 0
+        for hits in hits_lists:
+            s = scores[pos:pos + len(hits)]
+            pos += len(hits)
+            # stable, so ties keep the retrieval order
+            order = np.argsort(-s, kind='stable')[:top_k]
+            out.append([dict(hits[i], rerank_score=float(s[i])) for i in order])
+        return out
+
+    def stats(self):
+        with self._lock:
+            return {'calls': self.calls, 'pairs': self.pairs, 'capped': self.capped,
+                    'pair_ms': round(self.pair_ms, 4) if self.pair_ms is not None else None,
+                    'candidates': self.candidates, 'budget_ms': self.budget_ms}
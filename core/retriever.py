@@ -1,21 +1,260 @@
-import faiss, numpy as np, json
-from core import constants
+import faiss, numpy as np, json, os, threading, time
+from core.metastore import MetaStore, metastore_path
+from core.index_factory import apply_params, load_params, read_commit
+from core.bm25 import load_bm25
+from core.filters import filtered_search, load_filters
+from core.metrics import span
+from core.shards import ShardedIndex, is_sharded
 
-def load_index(index_path=None):
+def meta_path(index_path):
+    """The metadata sidecar in use: the binary store, or a legacy `.meta.json`."""
+    p = metastore_path(index_path)
+    if os.path.exists(p) or not os.path.exists(index_path + '.meta.json'):
+        return p
+    return index_path + '.meta.json'
+
+def load_meta(index_path):
+    p = meta_path(index_path)
+    if p.endswith('.meta.bin'):
+        return MetaStore(p)
+    with open(p, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+# zero-copy mmap of the vector codes where this faiss build supports it
+MMAP_FLAGS = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+def load_index(index_path=None, search_params=None, mmap=False):
+    """Index + metadata, with the tuned nprobe/efSearch from `<index>.params.json` (or `search_params`) applied.
+
+    With `mmap`, the index is mapped read-only instead of copied into the heap, so
+    every process serving the same file shares one copy through the page cache.
+    A shard manifest (see core.shards) loads as a `ShardedIndex`.
+    """
     if not index_path:
         raise ValueError("index_path must be provided")
-    
-    index = faiss.read_index(index_path)
-    with open(index_path + '.meta.json', 'r', encoding='utf-8') as f:
-        meta = json.load(f)
+
+    if is_sharded(index_path):
+        index = ShardedIndex(index_path, search_params, mmap)
+    else:
+        index = faiss.read_index(index_path, MMAP_FLAGS if mmap else 0)
+        apply_params(index, dict(load_params(index_path), **(search_params or {})))
+    meta = load_meta(index_path)
     return index, meta
 
-def retrieve_top_k(query_emb, top_k=5, index_path=None):
+def index_signature(index_path):
+    """Identity of the on-disk index: changes whenever either file is rewritten or replaced.
+
+    The last element is the commit marker (see core.index_factory.installing),
+    `(generation, complete)`, or `()` for an index written without one.
+    """
+    sig = []
+    for p in (index_path, meta_path(index_path)):
+        try:
+            st = os.stat(p)
+            sig.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            sig.append(None)
+    commit = read_commit(index_path)
+    sig.append((commit['generation'], commit['complete']) if commit else ())
+    return tuple(sig)
+
+def is_complete(signature):
+    """False while a writer is replacing the file set, or after one died doing so."""
+    return None not in signature and (not signature[-1] or signature[-1][1])
+
+def is_similarity(index):
+    """True when scores are similarities (higher is better), False for L2 distances."""
+    return index.metric_type == faiss.METRIC_INNER_PRODUCT
+
+def search_index_many(index, meta, query_embs, top_k=5, min_score=None, selection=None):
+    """One `index.search` over the stacked query matrix; returns one hit list per query.
+
+    `score` is the cosine / inner-product similarity for inner-product indexes
+    and the squared L2 distance otherwise. A filter `selection`
+    (core.filters.Selection) restricts the search to its ids inside FAISS.
+    A `ShardedIndex` searches its shards concurrently and merges their hits.
+    """
+    x = np.asarray(query_embs, dtype='float32').reshape(-1, index.d)
+    if selection is not None and selection.count == 0:
+        return [[] for _ in range(len(x))]
+    if isinstance(index, ShardedIndex):
+        D, I = index.search(x, top_k, selection)
+    elif selection is None:
+        D, I = index.search(x, top_k)
+    else:
+        D, I = filtered_search(index, selection, x, top_k)
+    fetch = getattr(meta, 'get_by_id', meta.__getitem__)
+    similarity = is_similarity(index)
+    out = []
+    with span('fetch'):
+        for dists, idxs in zip(D, I):
+            hits = []
+            for dist, idx in zip(dists, idxs):
+                if idx < 0: continue
+                # results come back best first, so the first miss ends the list before any metadata is read
+                if min_score is not None and (dist < min_score if similarity else dist > min_score): break
+                item = fetch(int(idx))
+                hits.append({'score': float(dist), 'meta': item})
+            out.append(hits)
+    return out
+
+def fuse_rrf(dense, keyword, top_k, k=60, require_dense=False):
+    """Reciprocal rank fusion: each list contributes 1 / (k + rank) per chunk; best `top_k` by fused score.
+
+    Each fused hit keeps its `dense_score` (None for keyword-only hits); with
+    `require_dense`, keyword-only hits are dropped.
+    """
+    fused = {}
+    for hits, dense_leg in ((dense, True), (keyword, False)):
+        for rank, h in enumerate(hits):
+            key = h['meta'].get('id') or id(h['meta'])
+            entry = fused.get(key)
+            if entry is None:
+                entry = fused[key] = {'score': 0.0, 'dense_score': None, 'meta': h['meta']}
+            if dense_leg:
+                entry['dense_score'] = h['score']
+            entry['score'] += 1.0 / (k + rank + 1)
+    hits = [h for h in fused.values() if h['dense_score'] is not None] if require_dense else list(fused.values())
+    return sorted(hits, key=lambda h: -h['score'])[:top_k]
+
+def keyword_hits(bm25, meta, query, top_k, selection=None):
+    allow = selection.row_mask(meta) if selection is not None else None
+    rows, scores = bm25.search(query, top_k, allow)
+    with span('fetch'):
+        return [{'score': float(s), 'meta': meta[int(r)]} for r, s in zip(rows, scores)]
+
+def hybrid_search_many(index, meta, bm25, query_embs, queries, top_k=5, min_score=None, candidates=None, rrf_k=60,
+                       selection=None):
+    """Dense + BM25 candidates per query fused with RRF; `score` is the fused score.
+
+    `dense_score` is the hit's similarity / distance from the dense search. With
+    `min_score`, only hits whose dense score passes it are returned, as without
+    hybrid; a keyword match that is not among those dense candidates is dropped.
+    """
+    candidates = max(top_k, candidates or 4 * top_k)
+    dense = search_index_many(index, meta, query_embs, candidates, min_score, selection)
+    return [fuse_rrf(d, keyword_hits(bm25, meta, q, candidates, selection), top_k, rrf_k, min_score is not None)
+            for d, q in zip(dense, queries)]
+
+def search_index(index, meta, query_emb, top_k=5, min_score=None):
+    return search_index_many(index, meta, [query_emb], top_k, min_score)[0]
+
+def retrieve_top_k(query_emb, top_k=5, index_path=None, min_score=None):
     index, meta = load_index(index_path)
-    D, I = index.search(np.array([query_emb]).astype('float32'), top_k)
-    hits = []
-    for dist, idx in zip(D[0], I[0]):
-        if idx < 0: continue
-        item = meta[idx]
-        hits.append({'score': float(dist), 'meta': item})
-    return hits
+    return search_index(index, meta, query_emb, top_k, min_score)
+
+
+class _Snapshot:
+    __slots__ = ('index', 'meta', 'bm25', 'filters', 'signature', 'generation')
+
+    def __init__(self, index, meta, signature, generation, bm25=None, filters=None):
+        self.index = index
+        self.meta = meta
+        self.bm25 = bm25
+        self.filters = filters
+        self.signature = signature
+        self.generation = generation
+
+
+class IndexHandle:
+    """Resident index + chunk metadata, loaded once and shared by every search.
+
+    The files are re-checked at most every `check_interval` seconds. When they
+    change and the writer has committed the new set (core.index_factory.installing),
+    a background thread loads it and swaps it in with a single
+    reference assignment; searches already holding the old snapshot finish on it.
+    With `hybrid`, the BM25 sidecar is loaded too and searches that pass the
+    query text fuse keyword and dense results (see `hybrid_search_many`).
+    With `mmap`, the index is memory-mapped (see `load_index`); the metadata
+    and BM25 sidecars are always mapped.
+    """
+
+    def __init__(self, index_path, check_interval=1.0, search_params=None, hybrid=False, candidates=None, rrf_k=60,
+                 mmap=False):
+        if not index_path:
+            raise ValueError("index_path must be provided")
+        self.index_path = index_path
+        self.check_interval = check_interval
+        self.search_params = search_params
+        self.hybrid = hybrid
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.mmap = mmap
+        self._reload_lock = threading.Lock()
+        self._last_check = time.monotonic()
+        self._snapshot = None
+        self._load(index_signature(index_path))
+
+    @property
+    def generation(self):
+        return self._snapshot.generation
+
+    @property
+    def similarity(self):
+        return is_similarity(self._snapshot.index)
+
+    @property
+    def ntotal(self):
+        return self._snapshot.index.ntotal
+
+    def snapshot(self):
+        return self._snapshot
+
+    def _load(self, signature):
+        index, meta = load_index(self.index_path, self.search_params, self.mmap)
+        if index.ntotal != len(meta):
+            # caught the files mid-replace; keep serving the current snapshot
+            raise RuntimeError('index/meta size mismatch (%d vs %d)' % (index.ntotal, len(meta)))
+        bm25 = load_bm25(self.index_path) if self.hybrid else None
+        if bm25 is not None and len(bm25) != len(meta):
+            raise RuntimeError('bm25/meta size mismatch (%d vs %d)' % (len(bm25), len(meta)))
+        if self.hybrid and bm25 is None and self._snapshot is None:
+            print('no BM25 index next to', self.index_path, '- serving dense results only')
+        filters = load_filters(self.index_path)
+        if self._snapshot is not None and index_signature(self.index_path) != signature:
+            # a writer started replacing files while they were read; the next check retries
+            raise RuntimeError('index files changed while loading')
+        generation = self._snapshot.generation + 1 if self._snapshot else 1
+        self._snapshot = _Snapshot(index, meta, signature, generation, bm25, filters)
+
+    def _reload(self, signature):
+        try:
+            self._load(signature)
+        except Exception as e:
+            print('index reload failed', self.index_path, e)
+        finally:
+            self._last_check = time.monotonic()
+            self._reload_lock.release()
+
+    def maybe_reload(self, wait=False):
+        if not wait and time.monotonic() - self._last_check < self.check_interval:
+            return False
+        if not self._reload_lock.acquire(blocking=wait):
+            return False
+        signature = index_signature(self.index_path)
+        if signature == self._snapshot.signature or not is_complete(signature):
+            self._last_check = time.monotonic()
+            self._reload_lock.release()
+            return False
+        if wait:
+            self._reload(signature)
+        else:
+            threading.Thread(target=self._reload, args=(signature,), daemon=True).start()
+        return True
+
+    def search(self, query_emb, top_k=5, min_score=None, query=None, filter=None):
+        return self.search_many([query_emb], top_k, min_score, None if query is None else [query], filter)[0]
+
+    def search_many(self, query_embs, top_k=5, min_score=None, queries=None, filter=None):
+        """`filter` (see core.filters) restricts every query to matching chunks inside the index search."""
+        self.maybe_reload()
+        snap = self._snapshot
+        selection = None
+        if filter:
+            if snap.filters is None:
+                raise ValueError('no filter index next to %s; rebuild the index to enable filters' % self.index_path)
+            selection = snap.filters.select(filter)
+        if snap.bm25 is not None and queries is not None:
+            return hybrid_search_many(snap.index, snap.meta, snap.bm25, query_embs, queries, top_k, min_score,
+                                      self.candidates, self.rrf_k, selection)
+        return search_index_many(snap.index, snap.meta, query_embs, top_k, min_score, selection)
@@ -0,0 +1,204 @@
+"""Sharded FAISS indexes: N shard files behind a JSON manifest at the index path.
+
+`index.shards: N` splits the vectors into N contiguous row ranges and builds
+one FAISS index per range in parallel (each sized and tuned on its own by
+core.index_factory). The manifest written at `<index>` lists the shard files
+with their row offsets. The metadata, BM25 and filter sidecars stay single
+files over the global rows. Because the manifest is replaced last, serving
+processes pick up a rebuilt layout through the usual reload check.
+
+`ShardedIndex` searches every shard from a thread pool (FAISS releases the
+GIL) shared by every index in the process, so reloads never leak threads, and
+merges the per-shard top-k lists with a heap. `rebuild_shard`
+replaces one shard without touching the others. Shard files are versioned,
+so a rebuild never overwrites a file that another process has mapped.
+"""
+
+import glob, heapq, json, os, threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import numpy as np
+from core.index_factory import apply_params, build_faiss
+from core.filters import filtered_search
+
+FORMAT = 'faiss-shards'
+
+
+def is_sharded(index_path):
+    """True when `index_path` holds a shard manifest rather than a FAISS index."""
+    try:
+        with open(index_path, 'rb') as f:
+            return f.read(1) == b'{'
+    except FileNotFoundError:
+        return False
+
+
+def read_manifest(index_path):
+    with open(index_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT:
+        raise ValueError('%s is not a shard manifest' % index_path)
+    return manifest
+
+
+def shard_file(index_path, i, version):
+    return '%s.shard%03d-%d' % (index_path, i, version)
+
+
+def _shard_path(index_path, entry):
+    return os.path.join(os.path.dirname(index_path), entry['file'])
+
+
+def _current_version(index_path):
+    return read_manifest(index_path)['version'] if is_sharded(index_path) else 0
+
+
+def _write_shard(index, path):
+    import faiss
+    faiss.write_index(index, path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def _build_shard(vectors, index_type, opts, add_batch, path):
+    index, params = build_faiss(vectors, index_type, opts, add_batch)
+    _write_shard(index, path)
+    return params
+
+
+def build_shards(vectors, index_path, index_type='faiss', opts=None, shards=2, workers=None, add_batch=65536):
+    """Build one index per contiguous row range of `vectors`, in parallel; returns the manifest.
+
+    The shard files are written, but the manifest is not: `write_manifest`
+    installs it once the sidecars are in place.
+    """
+    n, dim = vectors.shape
+    shards = max(1, min(int(shards), n))
+    bounds = np.linspace(0, n, shards + 1).astype(int)
+    version = _current_version(index_path) + 1
+    paths = [shard_file(index_path, i, version) for i in range(shards)]
+    with ThreadPoolExecutor(workers or min(shards, os.cpu_count() or 1)) as pool:
+        params = list(pool.map(lambda i: _build_shard(vectors[bounds[i]:bounds[i + 1]], index_type, opts, add_batch,
+                                                      paths[i]), range(shards)))
+    return {'format': FORMAT, 'version': version, 'dim': int(dim), 'ntotal': int(n),
+            'metric': (opts or {}).get('metric') or 'l2',
+            'shards': [{'file': os.path.basename(p), 'offset': int(bounds[i]), 'ntotal': int(bounds[i + 1] - bounds[i]),
+                        'params': params[i]} for i, p in enumerate(paths)]}
+
+
+def write_manifest(index_path, manifest):
+    """Atomically install `manifest` at `index_path` and drop shard files it no longer lists."""
+    with open(index_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(index_path + '.tmp', index_path)
+    remove_stale_shards(index_path, manifest)
+
+
+def remove_stale_shards(index_path, manifest=None):
+    """Delete `<index>.shardNNN-V` files not listed in `manifest` (all of them without one)."""
+    keep = {e['file'] for e in (manifest or {}).get('shards', [])}
+    for p in glob.glob(glob.escape(index_path) + '.shard[0-9]*'):
+        if os.path.basename(p) not in keep and not p.endswith('.tmp'):
+            try:
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+
+def _reconstruct(index):
+    import faiss
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.make_direct_map()
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def rebuild_shard(index_path, shard, vectors=None, index_type=None, opts=None, add_batch=65536):
+    """Rebuild shard `shard` in place, e.g. with another `index_type` or retuned `opts`.
+
+    `vectors` are the shard's rows in order; by default they are reconstructed
+    from the current shard file (approximate for IVF-PQ shards). Row ids are
+    shared with the metadata sidecars, so the row count must not change.
+    """
+    import faiss
+    manifest = read_manifest(index_path)
+    if not 0 <= shard < len(manifest['shards']):
+        raise ValueError('shard %d out of range (%d shards)' % (shard, len(manifest['shards'])))
+    entry = manifest['shards'][shard]
+    if vectors is None:
+        vectors = _reconstruct(faiss.read_index(_shard_path(index_path, entry)))
+    if len(vectors) != entry['ntotal']:
+        raise ValueError('shard %d holds %d rows, got %d vectors' % (shard, entry['ntotal'], len(vectors)))
+    opts = dict(opts or {}, metric=manifest['metric'])
+    version = manifest['version'] + 1
+    path = shard_file(index_path, shard, version)
+    entry.update(file=os.path.basename(path),
+                 params=_build_shard(vectors, index_type or entry['params']['type'], opts, add_batch, path))
+    manifest['version'] = version
+    write_manifest(index_path, manifest)
+    return manifest
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _search_pool():
+    """The process-wide shard search pool, one thread per CPU; snapshots come and go, the pool stays."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(os.cpu_count() or 1, thread_name_prefix='rag-shard')
+        return _pool
+
+
+def merge_topk(D, I, k, similarity):
+    """Merge per-shard (D, I) result lists, each best first, into the global top `k` per query."""
+    nq = len(D[0])
+    out_d = np.full((nq, k), -np.inf if similarity else np.inf, dtype='float32')
+    out_i = np.full((nq, k), -1, dtype='int64')
+    key = (lambda h: -h[0]) if similarity else (lambda h: h[0])
+    for q in range(nq):
+        runs = [[(d, i) for d, i in zip(ds[q], is_[q]) if i >= 0] for ds, is_ in zip(D, I)]
+        for j, (d, i) in enumerate(islice(heapq.merge(*runs, key=key), k)):
+            out_d[q, j], out_i[q, j] = d, i
+    return out_d, out_i
+
+
+class ShardedIndex:
+    """The shards of one manifest searched as one index: `search` returns global (D, I) like FAISS."""
+
+    def __init__(self, index_path, search_params=None, mmap=False):
+        import faiss
+        from core.retriever import MMAP_FLAGS
+        manifest = read_manifest(index_path)
+        self.version = manifest['version']
+        self.d = manifest['dim']
+        self.offsets = [e['offset'] for e in manifest['shards']]
+        self.shards = []
+        for e in manifest['shards']:
+            index = faiss.read_index(_shard_path(index_path, e), MMAP_FLAGS if mmap else 0)
+            apply_params(index, dict(e.get('params') or {}, **(search_params or {})))
+            self.shards.append(index)
+        self.ntotal = sum(s.ntotal for s in self.shards)
+        self.metric_type = self.shards[0].metric_type
+
+    def _search_shard(self, i, x, k, selection):
+        index, offset = self.shards[i], self.offsets[i]
+        if selection is None:
+            D, I = index.search(x, min(k, index.ntotal))
+        else:
+            sub = selection.subset(offset, offset + index.ntotal)
+            if not sub.count:
+                return None
+            D, I = filtered_search(index, sub, x, k)
+        return D, np.where(I >= 0, I + offset, -1)
+
+    def search(self, x, k, selection=None):
+        """Scatter the query batch to every shard, gather and heap-merge the top `k`."""
+        results = [r for r in _search_pool().map(lambda i: self._search_shard(i, x, k, selection), range(len(self.shards)))
+                   if r is not None]
+        if not results:
+            return np.full((len(x), k), np.nan, dtype='float32'), np.full((len(x), k), -1, dtype='int64')
+        import faiss
+        return merge_topk([r[0] for r in results], [r[1] for r in results], k,
+                          self.metric_type == faiss.METRIC_INNER_PRODUCT)
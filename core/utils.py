@@ -1,4 +1,4 @@
-import os, json, importlib.util, glob, yaml
+import os, sys, json, importlib.util, glob, yaml
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -29,11 +29,15 @@ def discover_loaders(paths=('core/loaders','plugins')):
     for base in paths:
         pattern = os.path.join(base, '*.py')
         for p in glob.glob(pattern):
-            name = os.path.splitext(os.path.basename(p))[0]
-            spec = importlib.util.spec_from_file_location(name, p)
+            # registered under its dotted path, so process pool workers can import what the loader sends them
+            name = os.path.splitext(os.path.normpath(p))[0].replace(os.sep, '.')
             try:
-                mod = importlib.util.module_from_spec(spec)
-                spec.loader.exec_module(mod)
+                mod = sys.modules.get(name)
+                if mod is None:
+                    spec = importlib.util.spec_from_file_location(name, p)
+                    mod = importlib.util.module_from_spec(spec)
+                    sys.modules[name] = mod
+                    spec.loader.exec_module(mod)
                 for attr in dir(mod):
                     obj = getattr(mod, attr)
                     try:
@@ -43,5 +47,6 @@ def discover_loaders(paths=('core/loaders','plugins')):
                     except Exception:
                         continue
             except Exception as e:
+                sys.modules.pop(name, None)
                 print('failed to import', p, e)
     return loaders
@@ -0,0 +1,232 @@
+"""One interface over the index backends: FAISS (index files), Chroma and Milvus.
+
+`get_vector_store(config)` picks the store from `index.type`. Every store can
+`build` from chunks, apply incremental `update`s (with `upsert` / `delete`
+shorthands) keyed by chunk id, and `search_many` with query embeddings. Hits
+are `{'score', 'meta'}`, best first. `meta` is the chunk row (id, source,
+title, text, meta), and `score` follows the FAISS convention: a similarity
+for ip / cosine, a squared L2 distance for l2. Chroma and Milvus live in
+core.indexer_chroma / core.indexer_milvus, so their clients are only
+imported when configured.
+"""
+
+import os
+import numpy as np
+from core import constants
+from core.bm25 import write_for_index
+from core.filters import write_filters_for_index
+from core.index_factory import index_options, installing, is_faiss, make_index, save_params
+from core.metastore import MetaStore, MetaStoreWriter, metastore_path
+from core.shards import remove_stale_shards
+
+IDMAP2_FOURCC = b'IxM2'  # leading bytes of a serialized faiss.IndexIDMap2
+
+
+def doc_id(chunk_id):
+    return str(chunk_id).rsplit('#chunk-', 1)[0]
+
+
+def passes(score, min_score, similarity):
+    return min_score is None or (score >= min_score if similarity else score <= min_score)
+
+
+class VectorStore:
+    """Base class: build / update / search one collection of chunks."""
+
+    similarity = False  # scores are similarities (higher is better) rather than distances
+    patchable = True  # `update` can patch what is stored; False means it must start over
+    # Search results may be cached per `generation`. That needs every change to the contents to bump it,
+    # which only holds when this process is the one that writes them; stores that other processes write
+    # to set this to False.
+    cacheable = True
+
+    def __init__(self):
+        self._generation = 1
+
+    def open(self):
+        """Connect / load for serving; raises when there is nothing to serve."""
+        return self
+
+    def build(self, chunks):
+        raise NotImplementedError
+
+    def update(self, chunks, delete_ids=(), ids=None, replace=False):
+        """Delete the chunks with ids `delete_ids`, then insert `chunks` (replacing rows with the same id)."""
+        raise NotImplementedError
+
+    def upsert(self, chunks):
+        return self.update(chunks)
+
+    def delete(self, chunk_ids):
+        return self.update([], chunk_ids)
+
+    def search_many(self, query_embs, top_k=5, min_score=None, queries=None, filter=None):
+        raise NotImplementedError
+
+    def search(self, query_emb, top_k=5, min_score=None, query=None, filter=None):
+        return self.search_many([query_emb], top_k, min_score, None if query is None else [query], filter)[0]
+
+    def maybe_reload(self, wait=False):
+        return False
+
+    @property
+    def generation(self):
+        """Bumped whenever the searchable contents change (as far as this process can see)."""
+        return self._generation
+
+    def cache_scope(self):
+        """(generation, hybrid) of the contents the next search runs on, for result cache keys."""
+        return self.generation, False
+
+    def close(self):
+        pass
+
+
+class FaissStore(VectorStore):
+    """FAISS index files served through core.retriever.IndexHandle (hot reload, mmap, hybrid, filters)."""
+
+    def __init__(self, index_path, index_type='faiss', options=None, search_params=None, hybrid=False,
+                 candidates=None, rrf_k=60, check_interval=1.0, mmap=False):
+        super().__init__()
+        self.index_path = index_path
+        self.index_type = index_type
+        self.options = options or {}
+        self.metric = self.options.get('metric') or 'l2'
+        self._handle_args = dict(check_interval=check_interval, search_params=search_params, hybrid=hybrid,
+                                 candidates=candidates, rrf_k=rrf_k, mmap=mmap)
+        self._handle = None
+
+    @classmethod
+    def from_config(cls, config):
+        idx = config.get(constants.INDEX, {})
+        # index.nprobe / index.ef_search override the values tuned at build time
+        overrides = {'nprobe': idx.get('nprobe'), 'efSearch': idx.get('ef_search')}
+        return cls(idx.get(constants.PATH, 'rag_index.faiss'), idx.get('type', 'faiss'), index_options(config),
+                   search_params={k: v for k, v in overrides.items() if v}, hybrid=bool(idx.get(constants.HYBRID)),
+                   candidates=idx.get('hybrid_candidates'), rrf_k=idx.get('rrf_k', 60),
+                   check_interval=idx.get(constants.RELOAD_INTERVAL, 1.0), mmap=bool(idx.get(constants.MMAP)))
+
+    @property
+    def handle(self):
+        if self._handle is None:
+            from core.retriever import IndexHandle
+            self._handle = IndexHandle(self.index_path, **self._handle_args)
+        return self._handle
+
+    def open(self):
+        self.handle
+        return self
+
+    def build(self, chunks):
+        from core.indexer import build_index
+        return build_index(chunks, backend=self.index_type, index_path=self.index_path, **self.options)
+
+    @property
+    def patchable(self):
+        """True for an `IndexIDMap2` index written by `update`; `build` output addresses rows by position."""
+        if not os.path.exists(metastore_path(self.index_path)):
+            return False
+        try:
+            with open(self.index_path, 'rb') as f:
+                return f.read(4) == IDMAP2_FOURCC
+        except FileNotFoundError:
+            return False
+
+    def update(self, chunks, delete_ids=(), ids=None, replace=False):
+        """Patch an `IndexIDMap2` over a flat index, so chunk ids keep their FAISS ids across updates.
+
+        `ids` are the FAISS ids for `chunks` (by default, numbered after the
+        largest stored id). `replace=True` starts from an empty index, which is
+        the only way to update an index from `build`. Returns the ids used.
+
+        Only embedding is proportional to the diff. The index file is read and
+        rewritten whole, and so are the metastore, BM25 and filter sidecars, which
+        have no append or tombstone support: an update costs O(corpus) I/O and a
+        Python pass over every stored row.
+
+        Vectors to remove are taken from the index's own id map, so vectors left
+        behind by an interrupted update are dropped too. The new file set is
+        installed under one commit marker (see core.index_factory.installing).
+        """
+        import faiss
+        mpath = metastore_path(self.index_path)
+        index = old = None
+        if not replace and os.path.exists(self.index_path):
+            if not self.patchable:
+                raise ValueError('%s addresses rows by position; rebuild it or update with replace=True'
+                                 % self.index_path)
+            index, old = faiss.read_index(self.index_path), MetaStore(mpath)
+        if ids is None:
+            start = int(old.ids.max()) + 1 if old is not None and len(old) else 0
+            ids = np.arange(start, start + len(chunks), dtype='int64')
+        ids = np.asarray(ids, dtype='int64')
+        if index is None:
+            if not chunks:
+                return ids
+            flat, _ = make_index('faiss-flat', len(chunks), len(chunks[0]['embedding']), {'metric': self.metric})
+            index = faiss.IndexIDMap2(flat)
+        keep = []
+        if old is not None:
+            stored = faiss.vector_to_array(index.id_map)
+            missing = np.setdiff1d(old.ids, stored)
+            if len(missing):
+                raise ValueError('%s: %d metadata rows have no vector (e.g. id %d); rebuild the index'
+                                 % (self.index_path, len(missing), missing[0]))
+            drop = set(delete_ids) | {c['id'] for c in chunks}
+            keep = [i for i in range(len(old)) if old.chunk_id(i) not in drop]
+            stale = np.setdiff1d(stored, old.ids[keep])
+            if len(stale):
+                index.remove_ids(stale)
+        if chunks:
+            index.add_with_ids(np.asarray([c['embedding'] for c in chunks], dtype='float32'), ids)
+
+        with installing(self.index_path):
+            writer = MetaStoreWriter(mpath)
+            for row in keep:
+                writer.add(old[row], faiss_id=old.ids[row])
+            for c, i in zip(chunks, ids):
+                writer.add(c, faiss_id=i)
+            writer.close()
+            # BM25 rows follow metastore rows, so the keyword index is rebuilt from the new store
+            new = MetaStore(mpath)
+            write_for_index(self.index_path, (new.text(i) for i in range(len(new))),
+                            self.options.get('bm25', True) is not False)
+            write_filters_for_index(self.index_path, (new[i] for i in range(len(new))), new.ids,
+                                    self.options.get('filters', True) is not False)
+            save_params(self.index_path, {'type': 'faiss-flat', 'metric': self.metric})
+            faiss.write_index(index, self.index_path + '.tmp')
+            os.replace(self.index_path + '.tmp', self.index_path)
+            remove_stale_shards(self.index_path)
+        return ids
+
+    def search_many(self, query_embs, top_k=5, min_score=None, queries=None, filter=None):
+        return self.handle.search_many(query_embs, top_k, min_score, queries, filter)
+
+    def maybe_reload(self, wait=False):
+        return self.handle.maybe_reload(wait)
+
+    @property
+    def generation(self):
+        return self.handle.generation
+
+    @property
+    def similarity(self):
+        return self.handle.similarity
+
+    def cache_scope(self):
+        snap = self.handle.snapshot()
+        return snap.generation, snap.bm25 is not None
+
+
+def get_vector_store(config):
+    """The store for `index.type`: faiss / faiss-*, chroma or milvus."""
+    backend = config.get(constants.INDEX, {}).get('type', 'faiss')
+    if is_faiss(backend):
+        return FaissStore.from_config(config)
+    if backend == 'chroma':
+        from core.indexer_chroma import ChromaStore
+        return ChromaStore.from_config(config)
+    if backend == 'milvus':
+        from core.indexer_milvus import MilvusStore
+        return MilvusStore.from_config(config)
+    raise NotImplementedError('Unknown backend')
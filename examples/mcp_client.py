@@ -8,6 +8,13 @@ def query(q, top_k=5):
     resp.raise_for_status()
     return resp.json()
 
+def query_batch(queries, top_k=5):
+    headers={'x-api-key':API_KEY}
+    url = API_URL.rsplit('/', 1)[0] + '/search_batch'
+    resp = httpx.post(url, json={'queries':list(queries), 'top_k':top_k}, headers=headers, timeout=30)
+    resp.raise_for_status()
+    return resp.json()
+
 if __name__=='__main__':
     import sys
     q=' '.join(sys.argv[1:]) or 'What is backtrader?'
@@ -1,13 +1,48 @@
-from fastapi import FastAPI, Depends, HTTPException, Header
-from pydantic import BaseModel
+from fastapi import FastAPI, Depends, HTTPException, Header, Request, Response
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
 from mcp.rag_service import RagMCPService
+from mcp.batcher import MicroBatcher, Overloaded
 from core.utils import load_config
-import os
+from core import constants, metrics
+import asyncio, contextlib, os, threading, time
 
 app = FastAPI(title='RAG MCP API')
 
 config = load_config('configs/test_config.yaml')
-svc = RagMCPService(config)
+
+service_cfg = dict(config.get(constants.SERVICE) or {})
+use_batcher = service_cfg.pop(constants.MODE, constants.MODE_SYNC) == constants.MODE_ASYNC
+# with service.profile_dir set, search requests sending `x-profile: 1` are profiled into that directory
+profile_dir = service_cfg.pop(constants.PROFILE_DIR, None)
+profiler = service_cfg.pop(constants.PROFILER, 'cprofile')
+
+# the service (index + embedder) is built on first use, not at import, so the
+# uvicorn master process and idle workers never load the model or the index
+_svc = None
+_batcher = None
+_svc_lock = threading.Lock()
+
+def get_service():
+    global _svc, _batcher
+    if _svc is None:
+        with _svc_lock:
+            if _svc is None:
+                svc = RagMCPService(config)
+                _batcher = MicroBatcher(svc, **service_cfg) if use_batcher else None
+                _svc = svc
+    return _svc
+
+def get_batcher():
+    get_service()
+    return _batcher
+
+async def get_batcher_async():
+    """get_batcher for async routes: the first call loads the model and index on a worker thread, not the event loop."""
+    if _svc is None:
+        await asyncio.get_running_loop().run_in_executor(None, get_service)
+    return _batcher
 
 MCP_API_KEY = os.getenv('MCP_API_KEY')
 
@@ -19,12 +54,117 @@ def check_api_key(x_api_key: str = Header(None)):
 class SearchReq(BaseModel):
     query: str
     top_k: int = 5
+    # minimum similarity (cosine/ip indexes) or maximum L2 distance; worse hits are not returned.
+    # With hybrid search it applies to each hit's `dense_score`, while `score` is the fused rank score
+    min_score: Optional[float] = None
+    # metadata filter applied inside the index search, e.g. {"source": "notion"} or
+    # {"doc": {"prefix": "s3://bucket/docs/"}}; see core/filters.py
+    filter: Optional[Dict[str, Any]] = None
+
+# request latency per endpoint; other paths share one label so scans cannot grow the series
+_http_paths = ('/mcp/search', '/mcp/search_batch', '/mcp/stats', '/metrics', '/health')
+_http_seconds = {p: metrics.Histogram() for p in _http_paths + ('other',)}
+
+@app.middleware('http')
+async def record_latency(request: Request, call_next):
+    t0 = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        path = request.url.path
+        _http_seconds[path if path in _http_seconds else 'other'].observe(time.perf_counter() - t0)
+
+def wants_profile(x_profile):
+    return bool(profile_dir and x_profile)
+
+def profiled(x_profile, response, name):
+    """Profile the request (cProfile, or pyinstrument with service.profiler) when it asks for it."""
+    if not wants_profile(x_profile):
+        return contextlib.nullcontext()
+    os.makedirs(profile_dir, exist_ok=True)
+    path = os.path.join(profile_dir, '%s-%d.%s' % (name, time.time_ns(), 'html' if profiler == 'pyinstrument' else 'prof'))
+    response.headers['X-Profile'] = path
+    return metrics.profiled(path, profiler)
+
+def profiled_search(req, response, x_profile):
+    with profiled(x_profile, response, 'search'):
+        return get_service().search(req.query, top_k=req.top_k, min_score=req.min_score, filter=req.filter)
+
+def search(req: SearchReq, response: Response, x_profile: str = Header(None)):
+    try:
+        res = profiled_search(req, response, x_profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {'results': res}
+
+async def search_async(req: SearchReq, response: Response, x_profile: str = Header(None)):
+    try:
+        if wants_profile(x_profile):
+            # a profiler only sees its own thread, so a profiled request skips the micro-batcher:
+            # its embed and search run together on one worker thread
+            res = await asyncio.get_running_loop().run_in_executor(None, profiled_search, req, response, x_profile)
+        else:
+            batcher = await get_batcher_async()
+            res = await batcher.search(req.query, top_k=req.top_k, min_score=req.min_score, filter=req.filter)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={'Retry-After': '1'})
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail='search timed out', headers={'Retry-After': '1'})
+    return {'results': res}
+
+app.add_api_route('/mcp/search', search_async if use_batcher else search, methods=['POST'],
+                  dependencies=[Depends(check_api_key)])
+
+class SearchBatchReq(BaseModel):
+    queries: List[str] = Field(..., max_length=256)
+    top_k: int = 5
+    min_score: Optional[float] = None
+    filter: Optional[Dict[str, Any]] = None
 
-@app.post('/mcp/search', dependencies=[Depends(check_api_key)])
-def search(req: SearchReq):
-    res = svc.search(req.query, top_k=req.top_k)
+@app.post('/mcp/search_batch', dependencies=[Depends(check_api_key)])
+def search_batch(req: SearchBatchReq, response: Response, x_profile: str = Header(None)):
+    try:
+        with profiled(x_profile, response, 'search_batch'):
+            res = get_service().search_many(req.queries, top_k=req.top_k, min_score=req.min_score,
+                                            filter=req.filter)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {'results': res}
 
+@app.get('/mcp/stats', dependencies=[Depends(check_api_key)])
+def stats():
+    svc, batcher = get_service(), get_batcher()
+    return {'mode': constants.MODE_ASYNC if batcher else constants.MODE_SYNC,
+            'index_generation': svc.index.generation,
+            'query_cache': svc.cache_stats(),
+            'stages': svc.stage_stats(),
+            'rerank': svc.rerank_stats(),
+            'batcher': batcher.stats() if batcher else None}
+
+@app.get('/metrics', response_class=PlainTextResponse, dependencies=[Depends(check_api_key)])
+def prometheus_metrics():
+    # does not build the service: a worker that has not served a search yet only reports HTTP latency
+    fams = [('rag_http_request_seconds', 'histogram', 'HTTP request latency by path',
+             [({'path': p}, h) for p, h in _http_seconds.items()]),
+            ('rag_process_peak_rss_bytes', 'gauge', 'Peak resident set size of this worker', [({}, metrics.peak_rss())])]
+    if _svc is not None:
+        fams += _svc.metric_families()
+    if _batcher is not None:
+        st = _batcher.stats()
+        fams += [('rag_batcher_stage_seconds', 'histogram', 'Async search time per stage (queue wait, batch embed / '
+                  'search, request total)', [({'stage': name}, h) for name, h in _batcher.stages.items()]),
+                 ('rag_batcher_inflight', 'gauge', 'Async searches in flight', [({}, st['inflight'])]),
+                 ('rag_batcher_rejected_total', 'counter', 'Async searches rejected with 429', [({}, st['rejected'])]),
+                 ('rag_batcher_batches_total', 'counter', 'Micro-batches run', [({}, st['batches'])])]
+    return PlainTextResponse(metrics.render(fams), media_type='text/plain; version=0.0.4')
+
+@app.on_event('shutdown')
+def shutdown():
+    if _batcher:
+        _batcher.shutdown()
+
 @app.get('/health')
 def health():
     return {'status': 'ok'}
@@ -0,0 +1,129 @@
+"""Async micro-batching front end for RagMCPService.
+
+Concurrent requests arriving within `window_ms` of each other are coalesced into
+one embed call and one index search. Embedding and search run on their own
+bounded thread pools, so one batch can be searched while the next is encoded.
+Admission is bounded by `max_queue`; beyond that callers get `Overloaded`
+instead of waiting.
+"""
+
+import asyncio, json, time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from core.metrics import Histogram
+
+
+class Overloaded(Exception):
+    pass
+
+
+class MicroBatcher:
+    STAGES = ('queue', 'embed', 'search', 'total')
+
+    def __init__(self, svc, window_ms=5, max_batch=64, max_queue=256, embed_workers=1, search_workers=2,
+                 request_timeout_ms=None):
+        self.svc = svc
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.timeout = request_timeout_ms / 1000.0 if request_timeout_ms else None
+        self.embed_pool = ThreadPoolExecutor(max_workers=embed_workers, thread_name_prefix='rag-embed')
+        self.search_pool = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix='rag-search')
+        self._pending = []
+        self._timer = None
+        # the event loop only keeps weak references to tasks; these are held until they finish
+        self._tasks = set()
+        self.inflight = 0
+        self.rejected = 0
+        self.stages = {s: Histogram() for s in self.STAGES}
+        self.batches = 0
+        self.batched_requests = 0
+
+    async def search(self, query, top_k=5, min_score=None, filter=None):
+        if self.inflight >= self.max_queue:
+            self.rejected += 1
+            raise Overloaded('search queue full (%d requests in flight)' % self.inflight)
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((query, top_k, min_score, filter, fut, time.perf_counter()))
+        self.inflight += 1
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        try:
+            if self.timeout:
+                return await asyncio.wait_for(fut, self.timeout)
+            return await fut
+        finally:
+            self.inflight -= 1
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        for *_, enq in batch:
+            self.stages['queue'].observe(t0 - enq)
+        self.batches += 1
+        self.batched_requests += len(batch)
+        try:
+            embs = await loop.run_in_executor(self.embed_pool, self.svc.embed_queries, [b[0] for b in batch])
+            t1 = time.perf_counter()
+            results = await loop.run_in_executor(self.search_pool, self._search, embs, batch)
+            t2 = time.perf_counter()
+        except Exception as e:
+            for *_, fut, _ in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self.stages['embed'].observe(t1 - t0)
+        self.stages['search'].observe(t2 - t1)
+        for (*_, fut, enq), hits in zip(batch, results):
+            self.stages['total'].observe(t2 - enq)
+            if fut.done():
+                continue
+            if isinstance(hits, Exception):
+                fut.set_exception(hits)
+            else:
+                fut.set_result(hits)
+
+    def _search(self, embs, batch):
+        """One search per distinct (top_k, min_score, filter) in the batch (normally just one)."""
+        embs = np.asarray(embs, dtype='float32')
+        groups = {}
+        for i, b in enumerate(batch):
+            key = (b[1], b[2], json.dumps(b[3], sort_keys=True) if b[3] else None)
+            groups.setdefault(key, []).append(i)
+        results = [None] * len(batch)
+        for (top_k, min_score, _), rows in groups.items():
+            filter = batch[rows[0]][3]
+            try:
+                hits = self.svc.search_embedded(embs[rows], [batch[i][0] for i in rows], top_k, min_score, filter)
+            except ValueError as e:
+                # a bad filter fails only the requests that sent it
+                hits = [e] * len(rows)
+            for i, h in zip(rows, hits):
+                results[i] = h
+        return results
+
+    def stats(self):
+        return {
+            'inflight': self.inflight,
+            'rejected': self.rejected,
+            'batches': self.batches,
+            'avg_batch_size': round(self.batched_requests / self.batches, 2) if self.batches else 0.0,
+            'stages': {name: s.snapshot() for name, s in self.stages.items()},
+        }
+
+    def shutdown(self):
+        self.embed_pool.shutdown(wait=False)
+        self.search_pool.shutdown(wait=False)
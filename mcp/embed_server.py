@@ -0,0 +1,40 @@
+"""Shared embedding worker: one model per host for every API worker process.
+
+    uvicorn mcp.embed_server:app --port 8100 --workers 1
+
+API workers then set `embedding.remote_url: http://127.0.0.1:8100` and embed
+through core.embedder.RemoteEmbedder instead of loading their own model.
+Vectors travel as raw float32 (see pack_vectors); the metric wrapper is
+applied on the client side, so this process always returns the model's own
+vectors.
+"""
+
+import threading
+from fastapi import FastAPI
+from pydantic import BaseModel, Field
+from typing import List
+from core.embedder import get_embedder, pack_vectors
+from core.utils import load_config
+from core import constants
+
+app = FastAPI(title='RAG embedding server')
+
+config = load_config('configs/test_config.yaml')
+# this process is the model host: drop remote_url and the index metric
+embedding_cfg = {k: v for k, v in (config.get(constants.EMBEDDING) or {}).items() if k != constants.REMOTE_URL}
+embedder = get_embedder({constants.EMBEDDING: embedding_cfg})
+# the model is loaded on the first request; requests take turns on it
+_lock = threading.Lock()
+
+class EmbedReq(BaseModel):
+    texts: List[str] = Field(..., max_length=4096)
+
+@app.post('/embed')
+def embed(req: EmbedReq):
+    with _lock:
+        vecs = embedder.embed(req.texts)
+    return {'model': embedder.cache_key, 'embeddings': pack_vectors(vecs)}
+
+@app.get('/health')
+def health():
+    return {'status': 'ok', 'model': embedder.cache_key}
@@ -1,22 +1,139 @@
-from core.utils import load_config
-from core.retriever import retrieve_top_k
-from core.embedder import get_embedder
-from core import constants
+import time
+from core.vector_store import get_vector_store
+from core.embedder import get_embedder, with_metric
+from core.query_cache import QueryCache
+from core.reranker import Reranker
+from core import constants, metrics
 
 class RagMCPService:
-    def __init__(self, config):
+    # metadata `fetch` is reported apart from the index `search` that precedes it
+    STAGES = ('embed', 'search', 'fetch', 'rerank')
+
+    def __init__(self, config, embedder=None):
         self.config = config
-        self.embedder = get_embedder(config)
-        self.index_path = config.get(constants.INDEX, {}).get(constants.PATH, 'rag_index.faiss')
+        self.embedder = with_metric(embedder or get_embedder(config), config)
+        index_cfg = config.get(constants.INDEX, {})
+        self.index_path = index_cfg.get(constants.PATH, 'rag_index.faiss')
+        # the store for index.type (see core.vector_store), opened once and shared by all request
+        # handlers; FAISS indexes hot-reload when their files change
+        self.index = get_vector_store(config).open()
+        # query_cache: query text -> embedding and (embedding, top_k, index generation) -> hits
+        self.cache = QueryCache.from_config(config)
+        # rerank: fetch more candidates and keep the top_k a cross-encoder scores best
+        self.reranker = Reranker.from_config(config)
+        self.stages = {s: metrics.Histogram() for s in self.STAGES}
 
-    def search(self, query, top_k=5):
-        q_emb = self.embedder.embed_query(query)
-        hits = retrieve_top_k(q_emb, top_k=top_k, index_path=self.index_path)
-        return [
-            {
+    @staticmethod
+    def _format_hits(hits):
+        out = []
+        for h in hits:
+            hit = {
                 'score': h['score'],
                 'source': h['meta'].get('source'),
                 'text': h['meta'].get('text')[:1000],
             }
-            for h in hits
-        ]
+            if 'dense_score' in h:
+                hit['dense_score'] = h['dense_score']
+            if 'rerank_score' in h:
+                hit['rerank_score'] = h['rerank_score']
+            out.append(hit)
+        return out
+
+    def embed_queries(self, queries):
+        t0 = time.perf_counter()
+        if self.cache is None:
+            embs = self.embedder.embed(list(queries))
+        else:
+            embs = self.cache.embed(self.embedder, queries)
+        self.stages['embed'].observe(time.perf_counter() - t0)
+        return embs
+
+    def _search_index(self, q_embs, queries, top_k, min_score, filter):
+        """Index search plus the optional rerank stage; formatted hits per query."""
+        k = self.reranker.candidates_for(top_k, len(queries)) if self.reranker is not None else top_k
+        metrics.begin()
+        t0 = time.perf_counter()
+        try:
+            hits = self.index.search_many(q_embs, k, min_score, queries, filter)
+        finally:
+            spans = metrics.collect()
+        t1 = time.perf_counter()
+        fetch = spans.get('fetch')
+        self.stages['search'].observe(t1 - t0 - (fetch or 0.0))
+        if fetch is not None:
+            self.stages['fetch'].observe(fetch)
+        if self.reranker is not None:
+            # scored on the full chunk text, before _format_hits truncates it
+            hits = self.reranker.rerank(queries, hits, top_k)
+            self.stages['rerank'].observe(time.perf_counter() - t1)
+        return [self._format_hits(h) for h in hits]
+
+    def search_embedded(self, q_embs, queries, top_k=5, min_score=None, filter=None):
+        """Formatted hits for already-embedded queries, served from the result cache when possible.
+
+        `filter` restricts hits to matching chunks (see core.filters); it raises ValueError
+        when the filter is malformed or the index has no filter sidecar.
+        """
+        if self.cache is None or not self.index.cacheable:
+            return self._search_index(q_embs, queries, top_k, min_score, filter)
+        # reload first, so a rebuilt index bumps the generation before the cache is consulted
+        self.index.maybe_reload()
+        generation, hybrid = self.index.cache_scope()
+        # keyword and cross-encoder scores depend on the query text, not just its embedding
+        hybrid = hybrid or self.reranker is not None
+        keys = [self.cache.result_key(e, q, top_k, min_score, generation, hybrid, filter)
+                for e, q in zip(q_embs, queries)]
+        results = [self.cache.get_results(k) for k in keys]
+        todo = [i for i, r in enumerate(results) if r is None]
+        if todo:
+            hits = self._search_index([q_embs[i] for i in todo], [queries[i] for i in todo], top_k, min_score, filter)
+            for i, h in zip(todo, hits):
+                results[i] = h
+                self.cache.put_results(keys[i], h)
+        return results
+
+    def search(self, query, top_k=5, min_score=None, filter=None):
+        if self.cache is not None:
+            return self.search_many([query], top_k, min_score, filter)[0]
+        t0 = time.perf_counter()
+        q_emb = self.embedder.embed_query(query)
+        self.stages['embed'].observe(time.perf_counter() - t0)
+        return self._search_index([q_emb], [query], top_k, min_score, filter)[0]
+
+    def search_many(self, queries, top_k=5, min_score=None, filter=None):
+        """Embed all queries in one call and run a single index search over them."""
+        if not queries:
+            return []
+        queries = list(queries)
+        return self.search_embedded(self.embed_queries(queries), queries, top_k, min_score, filter)
+
+    def cache_stats(self):
+        return self.cache.stats() if self.cache is not None else None
+
+    def stage_stats(self):
+        """Per-stage latency of this service (embed, index search, metadata fetch, rerank), in milliseconds."""
+        return {name: s.snapshot() for name, s in self.stages.items()}
+
+    def rerank_stats(self):
+        return self.reranker.stats() if self.reranker is not None else None
+
+    def metric_families(self):
+        """Stage latencies, cache hit rates and rerank counters for core.metrics.render."""
+        fams = [('rag_request_stage_seconds', 'histogram', 'Search time per stage and call',
+                 [({'stage': name}, h) for name, h in self.stages.items()]),
+                ('rag_index_generation', 'gauge', 'Generation of the index being served', [({}, self.index.generation)])]
+        if self.cache is not None:
+            levels = [(level, st) for level, st in self.cache.stats().items() if isinstance(st, dict)]
+            fams += [('rag_query_cache_%s' % key, kind, help, [({'level': level}, st[field]) for level, st in levels])
+                     for key, kind, help, field in (('hits_total', 'counter', 'Query cache hits', 'hits'),
+                                                    ('misses_total', 'counter', 'Query cache misses', 'misses'),
+                                                    ('hit_ratio', 'gauge', 'Query cache hit rate', 'hit_rate'),
+                                                    ('bytes', 'gauge', 'Query cache size', 'bytes'))]
+        if self.reranker is not None:
+            st = self.reranker.stats()
+            fams += [('rag_rerank_pairs_total', 'counter', 'Query / chunk pairs scored by the reranker', [({}, st['pairs'])]),
+                     ('rag_rerank_capped_total', 'counter', 'Searches whose candidates the rerank budget lowered',
+                      [({}, st['capped'])]),
+                     ('rag_rerank_pair_seconds', 'gauge', 'Moving average scoring time of one pair',
+                      [({}, st['pair_ms'] / 1000 if st['pair_ms'] is not None else None)])]
+        return fams
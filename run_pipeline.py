@@ -2,72 +2,131 @@
 """
 数据管道脚本 - 创建测试索引文件
 """
+import argparse
+import contextlib
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from core.utils import discover_loaders, load_config, save_json
-from core.chunker import docs_to_chunks
-from core.embedder import embed_chunks
-from core.indexer import build_index
+from core.utils import discover_loaders, load_config
+from core.incremental import needs_rebuild, update_index
+from core.index_factory import index_options, is_faiss
+from core.pipeline import iter_source_docs_concurrent, run_streaming, source_report, commit_sources
+from core.metrics import RunReport, profiled
 
-def main():
-    print("启动数据管道...")
-    
-    # 加载测试配置
-    cfg = load_config('configs/test_config.yaml')
-    print("配置加载成功")
-    
-    # 发现加载器
-    loads = discover_loaders()
-    print('发现的加载器:', list(loads.keys()))
-    
-    # 加载文档
-    sources = cfg.get('sources', [])
-    docs = []
-    
-    for s in sources:
-        t = s.get('type')
-        v = s.get('value')
-        
-        if t == 'file':
-            Loader = loads.get('FileLoader')
-            if Loader is None:
-                from core.loaders.file_loader import FileLoader as Loader
-            loader = Loader(v)
-            docs.extend(loader.load())
-            print(f'从文件加载文档: {v}')
-        else:
-            print(f'跳过不支持的源类型: {t}')
-    
-    print(f'加载了 {len(docs)} 个文档')
-    
-    if len(docs) == 0:
+def with_fallback(docs):
+    """没有加载到任何文档时, 生成一个测试文档以便创建索引"""
+    empty = True
+    for d in docs:
+        empty = False
+        yield d
+    if empty:
         print("警告: 没有加载到任何文档，将创建空索引")
-        # 创建一个简单的测试文档
-        test_doc = {
+        yield {
+            'id': 'test',
             'text': '这是一个测试文档，用于创建索引。',
             'meta': {'source': 'test', 'type': 'test'}
         }
-        docs = [test_doc]
-    
-    # 分块
-    chunk_max_chars = cfg.get('pipeline', {}).get('chunk_max_chars', 2000)
-    chunk_overlap = cfg.get('pipeline', {}).get('chunk_overlap', 200)
-    chunks = docs_to_chunks(docs, max_chars=chunk_max_chars, overlap=chunk_overlap)
-    
-    print(f'创建了 {len(chunks)} 个块')
-    
-    # 嵌入
-    enriched = embed_chunks(chunks, cfg)
-    
-    # 构建索引
+
+def run(cfg, args, report):
+    if args.rebuild_shard is not None:
+        from core.shards import rebuild_shard
+        idx_cfg = cfg.get('index', {})
+        with report.stage('rebuild_shard'):
+            manifest = rebuild_shard(idx_cfg.get('path', 'rag_index.faiss'), args.rebuild_shard,
+                                     index_type=idx_cfg.get('type'), opts=index_options(cfg))
+        print(f'分片 {args.rebuild_shard} 已重建:', manifest['shards'][args.rebuild_shard])
+        return {}
+
+    # 发现加载器
+    loads = discover_loaders()
+    print('发现的加载器:', list(loads.keys()))
+
+    # 所有数据源并发加载, 文档一到达就进入分块/嵌入阶段
+    sources = {}
+    workers = cfg.get('pipeline', {}).get('loader_workers', 4)
+    incremental = bool(cfg.get('pipeline', {}).get('incremental')) and not args.fresh
+    # 索引无法增量修补 (例如 --fresh 之后) 时会整体重建, 加载器不能再依据同步状态跳过未变化的文档
+    refetch = incremental and needs_rebuild(cfg)
+    if refetch:
+        print('索引需要重建: 忽略加载器的同步状态, 重新获取全部内容')
+    docs = iter_source_docs_concurrent(cfg.get('sources', []), loads, max_workers=workers, report=sources,
+                                       incremental=incremental, refetch=refetch)
+    if not incremental:
+        # 增量模式下不能注入测试文档: 它会被写进真实索引, 并且其余文档都会被当作已删除
+        docs = with_fallback(docs)
+    # load 阶段的耗时是等待下一个文档的时间
+    docs = report.timed('load', docs)
+
+    # 增量模式: 只处理新增/修改的文档, 并删除已移除文档的块
+    if incremental:
+        docs = list(docs)
+        # 某个数据源失败时不能把它的文档当作已删除
+        failed = [name for name, st in sources.items() if st.error]
+        if not docs:
+            print('警告: 没有加载到任何文档, 本次不删除索引中的文档')
+        with report.stage('update') as st:
+            stats = update_index(docs, cfg, full=bool(docs) and not failed)
+            st.add(len(docs))
+        # 索引更新成功后才保存加载器的同步状态 (ETag 等), 下次运行据此跳过未变化的对象
+        commit_sources(sources)
+        print('数据源统计:', source_report(sources))
+        print('增量更新完成:', stats)
+        return sources
+
     idx_cfg = cfg.get('index', {})
-    idx_backend = idx_cfg.get('type', 'faiss')
-    idx_path = build_index(enriched, backend=idx_backend, index_path=idx_cfg.get('path'))
-    
-    print(f'索引已写入: {idx_path}')
+    if not is_faiss(idx_cfg.get('type')):
+        # chroma / milvus 仍然一次性写入
+        from core.chunker import chunk_docs
+        from core.embedder import embed_chunks
+        from core.indexer import build_index
+        docs = list(docs)
+        with report.stage('chunk') as st:
+            chunks = chunk_docs(docs, cfg)
+            st.add(len(docs))
+        with report.stage('embed') as st:
+            embed_chunks(chunks, cfg)
+            st.add(len(chunks))
+        with report.stage('build') as st:
+            idx_path = build_index(chunks, backend=idx_cfg['type'], **idx_cfg)
+            st.add(len(chunks))
+        print(f'索引已写入: {idx_path}')
+        return sources
+
+    # 流式处理: 分批 分块/嵌入/写入, 内存占用与语料大小无关, 中断后可从检查点继续
+    stats = run_streaming(docs, cfg, index_path=idx_cfg.get('path'), resume=not args.fresh, report=report)
+    print('数据源统计:', source_report(sources))
+    print(f'处理了 {stats["docs"]} 个文档, 创建了 {stats["chunks"]} 个块 (从检查点恢复 {stats["resumed_chunks"]} 个块)')
+    print(f'索引已写入: {idx_cfg.get("path")}')
+    return sources
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default='configs/test_config.yaml')
+    parser.add_argument('--fresh', action='store_true', help='忽略上次中断留下的检查点, 从头开始')
+    parser.add_argument('--rebuild-shard', type=int, metavar='N', help='只按当前配置重建分片索引的第 N 个分片')
+    parser.add_argument('--report', metavar='PATH', help='把各阶段耗时、吞吐量和峰值内存写入 JSON 报告')
+    parser.add_argument('--profile', metavar='PATH', help='用 cProfile 分析整个运行, 结果写入 PATH (pstats 格式)')
+    args = parser.parse_args(argv)
+
+    print("启动数据管道...")
+
+    cfg = load_config(args.config)
+    print("配置加载成功")
+
+    report = RunReport()
+    with profiled(args.profile) if args.profile else contextlib.nullcontext():
+        sources = run(cfg, args, report)
+    if 'load' in report.stages:
+        report.stages['load'].bytes = sum(st.bytes for st in sources.values())
+    summary = report.as_dict(sources=source_report(sources))
+    print('阶段统计:', {name: (st['seconds'], st['items_per_sec']) for name, st in summary['stages'].items()},
+          '峰值内存:', summary['peak_rss_bytes'])
+    path = args.report or cfg.get('pipeline', {}).get('report')
+    if path:
+        report.write(path, sources=source_report(sources))
+        print(f'运行报告已写入: {path}')
     print("数据管道完成!")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
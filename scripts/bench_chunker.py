@@ -0,0 +1,118 @@
+"""Benchmark core.chunker against the previous list-append + overlap-pass chunker.
+
+    python scripts/bench_chunker.py --docs 2000 --doc-chars 20000 --workers 4
+
+Prints a JSON report: throughput (MB/s, chunks/s) per mode and chunk-size stats.
+The legacy implementation is kept here verbatim for comparison.
+"""
+
+import argparse, json, os, random, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from core.chunker import docs_to_chunks, split_into_sentences
+
+
+def legacy_chunk_text(text, max_chars=2000, overlap=200):
+    sentences = split_into_sentences(text)
+    chunks = []
+    cur = []
+    cur_len = 0
+    for s in sentences:
+        if cur_len + len(s) + 1 <= max_chars:
+            cur.append(s)
+            cur_len += len(s) + 1
+        else:
+            if cur:
+                chunks.append(' '.join(cur))
+            if len(s) > max_chars:
+                start = 0
+                while start < len(s):
+                    chunks.append(s[start:start+max_chars])
+                    start += max_chars - overlap
+                cur = []
+                cur_len = 0
+            else:
+                cur = [s]
+                cur_len = len(s) + 1
+    if cur:
+        chunks.append(' '.join(cur))
+    if overlap and len(chunks) > 1:
+        out = []
+        for i, c in enumerate(chunks):
+            if i == 0:
+                out.append(c)
+            else:
+                prev = out[-1]
+                tail = prev[-overlap:] if len(prev) > overlap else prev
+                out.append(tail + '\n' + c)
+        return out
+    return chunks
+
+
+def legacy_docs_to_chunks(docs, max_chars=2000, overlap=200):
+    out = []
+    for doc in docs:
+        for i, c in enumerate(legacy_chunk_text(doc['text'], max_chars, overlap)):
+            out.append({'id': f"{doc['id']}#chunk-{i}", 'source': doc['id'], 'title': None, 'text': c,
+                        'meta': doc.get('meta', {})})
+    return out
+
+
+WORDS = ('index vector query latency shard token model batch cache score recall embed chunk '
+         'document retrieval pipeline throughput memory').split()
+
+
+def synthetic_docs(n, doc_chars, seed=0):
+    rnd = random.Random(seed)
+    docs = []
+    for i in range(n):
+        parts, size = [], 0
+        while size < doc_chars:
+            s = ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(4, 30))).capitalize() + rnd.choice('.!?')
+            parts.append(s)
+            size += len(s) + 1
+        docs.append({'id': 'doc-%d' % i, 'text': ' '.join(parts), 'meta': {'source': 'bench'}})
+    return docs
+
+
+def run(name, fn, docs, total_bytes, repeat):
+    best, chunks = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        chunks = fn(docs)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    sizes = sorted(len(c['text']) for c in chunks)
+    return name, {'seconds': round(best, 4), 'mb_per_sec': round(total_bytes / best / 1e6, 2),
+                  'chunks': len(chunks), 'chunks_per_sec': round(len(chunks) / best, 1),
+                  'max_chunk_chars': sizes[-1] if sizes else 0,
+                  'mean_chunk_chars': round(sum(sizes) / len(sizes), 1) if sizes else 0}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--docs', type=int, default=500)
+    ap.add_argument('--doc-chars', type=int, default=20000)
+    ap.add_argument('--max-chars', type=int, default=2000)
+    ap.add_argument('--overlap', type=int, default=200)
+    ap.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    ap.add_argument('--repeat', type=int, default=3)
+    args = ap.parse_args()
+
+    docs = synthetic_docs(args.docs, args.doc_chars)
+    total = sum(len(d['text'].encode('utf-8')) for d in docs)
+    mc, ov = args.max_chars, args.overlap
+    modes = [
+        ('legacy', lambda d: legacy_docs_to_chunks(d, mc, ov)),
+        ('offsets', lambda d: docs_to_chunks(d, mc, ov)),
+        ('offsets_tokens', lambda d: docs_to_chunks(d, max_tokens=mc // 5, overlap=ov // 5,
+                                                    count_tokens=lambda s: len(s.split()))),
+    ]
+    if args.workers > 1:
+        modes.append(('offsets_pool_%d' % args.workers, lambda d: docs_to_chunks(d, mc, ov, workers=args.workers)))
+    report = {'docs': len(docs), 'bytes': total, 'max_chars': mc, 'overlap': ov}
+    report.update(run(name, fn, docs, total, args.repeat) for name, fn in modes)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
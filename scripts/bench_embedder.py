@@ -0,0 +1,77 @@
+"""Throughput and accuracy of the local embedder backends.
+
+    python scripts/export_onnx.py --out models/minilm-onnx
+    python scripts/export_onnx.py --out models/minilm-int8 --int8
+    python scripts/bench_embedder.py --onnx models/minilm-onnx,models/minilm-int8 --texts 2000
+
+The reference is SentenceTransformerEmbedder in fp32 PyTorch. For each
+backend the report has texts/s (best of --repeat) and the cosine between its
+vectors and the reference (mean / min). It also has recall@k of its
+nearest-neighbour lists against the reference lists over the same corpus, the
+accuracy that matters for retrieval. `st_lists` times the previous
+list-returning path (encode -> tolist) for comparison.
+"""
+
+import argparse, json, os, platform, sys, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+from core.chunker import chunk_docs
+from core.embedder import OnnxEmbedder, SentenceTransformerEmbedder, normalize
+from scripts.bench_retrieval import synthetic_docs
+
+
+def throughput(fn, texts, repeat):
+    fn(texts[:32])  # warm up: model load, allocator, thread pools
+    best, out = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn(texts)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return np.asarray(out, dtype='float32'), {'seconds': round(best, 4), 'texts_per_sec': round(len(texts) / best, 1)}
+
+
+def accuracy(vecs, ref, k):
+    a, b = normalize(vecs), normalize(ref)
+    cos = (a * b).sum(axis=1)
+    k = min(k, len(a) - 1)
+    # neighbours of every text among the others, by cosine
+    top_a = np.argsort(-(a @ a.T), axis=1)[:, 1:k + 1]
+    top_b = np.argsort(-(b @ b.T), axis=1)[:, 1:k + 1]
+    recall = np.mean([len(set(x) & set(y)) / k for x, y in zip(top_a, top_b)])
+    return {'cosine_mean': round(float(cos.mean()), 6), 'cosine_min': round(float(cos.min()), 6),
+            'recall_at_%d' % k: round(float(recall), 4)}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--model', default='all-MiniLM-L6-v2')
+    ap.add_argument('--onnx', default='', help='comma-separated export_onnx.py output directories')
+    ap.add_argument('--texts', type=int, default=1000)
+    ap.add_argument('--batch-size', type=int, default=64)
+    ap.add_argument('--threads', type=int, default=None)
+    ap.add_argument('--repeat', type=int, default=3)
+    ap.add_argument('--k', type=int, default=10)
+    args = ap.parse_args()
+
+    chunks = chunk_docs(synthetic_docs(max(10, args.texts // 4), 300), {'pipeline': {'chunk_max_chars': 800}})
+    texts = [c['text'] for c in chunks][:args.texts]
+    report = {'python': platform.python_version(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+              'texts': len(texts), 'mean_chars': round(sum(map(len, texts)) / len(texts), 1), 'args': vars(args)}
+
+    st = SentenceTransformerEmbedder(args.model, args.batch_size)
+    ref, report['st_fp32'] = throughput(st.embed, texts, args.repeat)
+    _, report['st_lists'] = throughput(
+        lambda t: [e.tolist() for e in st._st_model.encode(t, batch_size=args.batch_size, show_progress_bar=False)],
+        texts, args.repeat)
+    for d in [d for d in args.onnx.split(',') if d]:
+        emb = OnnxEmbedder(d, args.batch_size, args.threads)
+        vecs, stats = throughput(emb.embed, texts, args.repeat)
+        stats['speedup'] = round(stats['texts_per_sec'] / report['st_fp32']['texts_per_sec'], 2)
+        stats.update(accuracy(vecs, ref, args.k))
+        report[emb.cache_key] = stats
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""Recall / latency benchmark for the retrieval stack.
+
+    python scripts/bench_retrieval.py --docs 2000 --queries 500 --out bench.json
+    python scripts/bench_retrieval.py --vectors 200000 --dim 384   # index-only recall sweep
+    python scripts/bench_retrieval.py --embedder config --config configs/config.yaml
+
+Builds a synthetic corpus from sample_data/ plus generated text. Times each
+ingest stage (load, chunk, embed, index). Measures query latency
+(p50/p95/p99) and QPS through RagMCPService.search, serially and with
+--threads concurrent clients. Reports recall@k of every FAISS index type
+against exact IndexFlatL2 ground truth. The default embedder is a
+deterministic hashing embedder, so runs are reproducible and need no model;
+use --embedder config to measure the configured one. Everything is written
+as one JSON document.
+"""
+
+import argparse, json, os, platform, random, re, sys, tempfile, time, zlib
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import numpy as np
+from core.chunker import chunk_docs
+from core.embedder import Embedder, embed_chunks, get_embedder, normalize
+from core.index_factory import FAISS_TYPES, _exact_knn, build_faiss
+from core.indexer import build_index
+from core.loaders.file_loader import FileLoader
+from core.utils import load_config
+from mcp.rag_service import RagMCPService
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = re.compile(r'\w+')
+
+
+class HashEmbedder(Embedder):
+    """Signed feature hashing of word unigrams, L2-normalised; fast and deterministic."""
+
+    def __init__(self, dim=256):
+        super().__init__('hash-%d' % dim)
+        self.dim = dim
+
+    def embed(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype='float32')
+        for i, t in enumerate(texts):
+            for w in TOKEN.findall(t.lower()):
+                h = zlib.crc32(w.encode('utf-8'))
+                out[i, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        return out / np.maximum(norms, 1e-6)
+
+
+def synthetic_docs(n, doc_words, seed=0):
+    """Sample documents plus random text drawn from their vocabulary."""
+    base = FileLoader(os.path.join(ROOT, 'sample_data', '**', '*.md')).load()
+    vocab = sorted({w for d in base for w in TOKEN.findall(d['text'].lower())}) or ['lorem', 'ipsum']
+    rnd = random.Random(seed)
+    docs = list(base)
+    for i in range(max(0, n - len(base))):
+        words, sentences = 0, []
+        while words < doc_words:
+            k = rnd.randint(5, 25)
+            sentences.append(' '.join(rnd.choice(vocab) for _ in range(k)).capitalize() + '.')
+            words += k
+        docs.append({'id': 'synthetic-%d' % i, 'text': ' '.join(sentences), 'meta': {'source': 'synthetic'}})
+    return docs
+
+
+def timed(stats, name, fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    stats[name] = {'seconds': round(time.perf_counter() - t0, 4)}
+    return out
+
+
+def latency_report(latencies, wall):
+    ms = np.asarray(latencies) * 1000.0
+    return {'queries': len(ms), 'p50_ms': round(float(np.percentile(ms, 50)), 3),
+            'p95_ms': round(float(np.percentile(ms, 95)), 3), 'p99_ms': round(float(np.percentile(ms, 99)), 3),
+            'mean_ms': round(float(ms.mean()), 3), 'qps': round(len(ms) / wall, 1)}
+
+
+def bench_service(svc, queries, top_k, threads, warmup=20):
+    for q in queries[:warmup]:
+        svc.search(q, top_k)
+
+    def one(q):
+        t0 = time.perf_counter()
+        svc.search(q, top_k)
+        return time.perf_counter() - t0
+
+    out = {}
+    t0 = time.perf_counter()
+    lat = [one(q) for q in queries]
+    out['serial'] = latency_report(lat, time.perf_counter() - t0)
+    if threads > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            t0 = time.perf_counter()
+            lat = list(pool.map(one, queries))
+            out['threads_%d' % threads] = latency_report(lat, time.perf_counter() - t0)
+    return out
+
+
+def _dist(queries, vectors, metric):
+    """Exact distance of query i to vectors[i, ...] (negated similarity for inner-product metrics)."""
+    if metric == 'l2':
+        return ((queries[:, None, :] - vectors) ** 2).sum(axis=-1)
+    return -(queries[:, None, :] * vectors).sum(axis=-1)
+
+
+def recall_sweep(vectors, queries, k, types, target_recall, metric='l2'):
+    """recall@k and search latency of each FAISS index type against exact search.
+
+    A returned id counts as a hit when its exact distance is within the k-th
+    true distance, so ties in the ground truth are not scored as misses.
+    """
+    truth = _exact_knn(queries, vectors, k, metric)
+    kth = _dist(queries, vectors[truth[:, -1:]], metric)[:, 0]
+    out = {}
+    for t in types:
+        t0 = time.perf_counter()
+        try:
+            index, params = build_faiss(vectors, t, {'target_recall': target_recall, 'metric': metric})
+        except Exception as e:
+            out[t] = {'error': repr(e)}
+            continue
+        build = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        _, I = index.search(queries, k)
+        search = time.perf_counter() - t0
+        found = _dist(queries, vectors[np.maximum(I, 0)], metric)
+        hits = (found <= kth[:, None] + np.abs(kth[:, None]) * 1e-5 + 1e-6) & (I >= 0)
+        out[t] = {'params': params, 'build_seconds': round(build, 4),
+                  'recall_at_%d' % k: round(float(hits.mean()), 4), 'batch_qps': round(len(queries) / search, 1)}
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--config', default=os.path.join(ROOT, 'configs', 'test_config.yaml'))
+    ap.add_argument('--embedder', choices=('hash', 'config'), default='hash')
+    ap.add_argument('--dim', type=int, default=256, help='hash embedder / --vectors dimension')
+    ap.add_argument('--docs', type=int, default=1000)
+    ap.add_argument('--doc-words', type=int, default=400)
+    ap.add_argument('--vectors', type=int, default=0, help='skip text ingest; sweep index types on random vectors')
+    ap.add_argument('--queries', type=int, default=300)
+    ap.add_argument('--top-k', type=int, default=10)
+    ap.add_argument('--threads', type=int, default=4)
+    ap.add_argument('--index-types', default=','.join(t for t in FAISS_TYPES if t != 'faiss'))
+    ap.add_argument('--target-recall', type=float, default=0.95)
+    ap.add_argument('--metric', choices=('l2', 'ip', 'cosine'), default='l2')
+    ap.add_argument('--out', help='write the JSON report here instead of stdout')
+    args = ap.parse_args()
+    types = [t for t in args.index_types.split(',') if t]
+    rng = np.random.default_rng(0)
+    report = {'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+              'machine': platform.machine(), 'cpus': os.cpu_count(), 'args': vars(args)}
+
+    if args.vectors:
+        vectors = rng.random((args.vectors, args.dim), dtype='float32')
+        queries = vectors[rng.choice(len(vectors), size=min(args.queries, len(vectors)), replace=False)]
+        queries = queries + rng.normal(0, 0.01, queries.shape).astype('float32')
+        if args.metric == 'cosine':
+            vectors, queries = normalize(vectors), normalize(queries)
+        report['recall'] = recall_sweep(vectors, queries, args.top_k, types, args.target_recall, args.metric)
+    else:
+        config = load_config(args.config) if args.embedder == 'config' else {}
+        config = dict(config, embedding=dict(config.get('embedding', {}), cache=None),
+                      index=dict(config.get('index', {}), metric=args.metric))
+        embedder = get_embedder(config) if args.embedder == 'config' else HashEmbedder(args.dim)
+        stages = report['ingest'] = {}
+        docs = timed(stages, 'load', synthetic_docs, args.docs, args.doc_words)
+        chunks = timed(stages, 'chunk', chunk_docs, docs, config)
+        timed(stages, 'embed', embed_chunks, chunks, config, embedder=embedder)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'bench.faiss')
+            timed(stages, 'index', build_index, chunks, backend='faiss', index_path=path,
+                  target_recall=args.target_recall, metric=args.metric)
+            nbytes = sum(len(d['text'].encode('utf-8')) for d in docs)
+            for name, unit, n in (('load', 'docs', len(docs)), ('chunk', 'docs', len(docs)),
+                                  ('embed', 'chunks', len(chunks)), ('index', 'chunks', len(chunks))):
+                stages[name]['%s_per_sec' % unit] = round(n / max(stages[name]['seconds'], 1e-9), 1)
+            stages['load']['mb_per_sec'] = round(nbytes / 1e6 / max(stages['load']['seconds'], 1e-9), 2)
+            report['corpus'] = {'docs': len(docs), 'bytes': nbytes, 'chunks': len(chunks)}
+
+            picks = rng.choice(len(chunks), size=min(args.queries, len(chunks)), replace=False)
+            queries = [' '.join(chunks[int(i)]['text'].split()[:12]) for i in picks]
+            svc = RagMCPService({'index': {'path': path, 'reload_interval': 3600, 'metric': args.metric}},
+                                embedder=embedder)
+            report['query'] = bench_service(svc, queries, args.top_k, args.threads)
+            vectors = np.asarray([c['embedding'] for c in chunks], dtype='float32')
+            qvecs = np.asarray(svc.embedder.embed(queries), dtype='float32')
+            report['recall'] = recall_sweep(vectors, qvecs, min(args.top_k, len(vectors)), types, args.target_recall,
+                                            args.metric)
+
+    text = json.dumps(report, indent=2, default=str)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
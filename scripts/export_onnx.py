@@ -0,0 +1,70 @@
+"""Export a sentence-transformers model for core.embedder.OnnxEmbedder.
+
+    python scripts/export_onnx.py --model all-MiniLM-L6-v2 --out models/minilm-onnx
+    python scripts/export_onnx.py --model all-MiniLM-L6-v2 --out models/minilm-int8 --int8
+
+Writes model.onnx (the transformer, dynamic batch and sequence axes),
+tokenizer.json, and embedder.json. embedder.json records the pooling,
+normalization and max length of the sentence-transformers pipeline, so the
+ONNX embedder reproduces its vectors. --int8 applies ONNX Runtime dynamic
+int8 quantization to the weights. Needs torch, sentence-transformers and
+onnxruntime; serving needs only onnxruntime and tokenizers.
+"""
+
+import argparse, json, os, sys
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pipeline_spec(st_model, name):
+    from sentence_transformers.models import Normalize, Pooling
+    spec = {'model': name, 'pooling': 'mean', 'normalize': False, 'max_length': st_model.max_seq_length,
+            'dim': st_model.get_sentence_embedding_dimension(), 'pad_id': st_model.tokenizer.pad_token_id or 0}
+    for module in st_model:
+        if isinstance(module, Pooling):
+            if module.pooling_mode_cls_token:
+                spec['pooling'] = 'cls'
+            elif not module.pooling_mode_mean_tokens:
+                raise SystemExit('only mean and cls pooling are supported')
+        elif isinstance(module, Normalize):
+            spec['normalize'] = True
+    return spec
+
+
+def export(model_name, out, int8=False, opset=14):
+    import torch
+    from sentence_transformers import SentenceTransformer
+    st = SentenceTransformer(model_name, device='cpu')
+    os.makedirs(out, exist_ok=True)
+    spec = pipeline_spec(st, model_name)
+    transformer = st[0].auto_model.eval()
+    sample = st.tokenizer(['export sample'], return_tensors='pt')
+    names = [n for n in ('input_ids', 'attention_mask', 'token_type_ids') if n in sample]
+    axes = {n: {0: 'batch', 1: 'seq'} for n in names}
+    axes['last_hidden_state'] = {0: 'batch', 1: 'seq'}
+    path = os.path.join(out, 'model.onnx')
+    with torch.no_grad():
+        torch.onnx.export(transformer, tuple(sample[n] for n in names), path, input_names=names,
+                          output_names=['last_hidden_state'], dynamic_axes=axes, opset_version=opset)
+    if int8:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(path, path + '.int8', weight_type=QuantType.QInt8)
+        os.replace(path + '.int8', path)
+        spec['quantize'] = 'int8'
+    st.tokenizer.backend_tokenizer.save(os.path.join(out, 'tokenizer.json'))
+    with open(os.path.join(out, 'embedder.json'), 'w', encoding='utf-8') as f:
+        json.dump(spec, f, indent=2)
+    return spec
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--model', default='all-MiniLM-L6-v2')
+    ap.add_argument('--out', required=True)
+    ap.add_argument('--int8', action='store_true', help='dynamic int8 quantization of the weights')
+    ap.add_argument('--opset', type=int, default=14)
+    args = ap.parse_args()
+    print(json.dumps(export(args.model, args.out, args.int8, args.opset), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ Integration test for RAG Tool
 Tests core functionality without external dependencies
 """
 
+import glob
 import sys
 import os
 sys.path.append('.')
@@ -97,11 +98,9 @@ def test_pipeline():
     assert len(results) > 0, "Should retrieve some results"
     print(f"Retrieved {len(results)} results for query: {query_text}")
     
-    # Cleanup
-    if os.path.exists('test_index.faiss'):
-        os.remove('test_index.faiss')
-    if os.path.exists('test_index.faiss.meta.json'):
-        os.remove('test_index.faiss.meta.json')
+    # Cleanup: the index and every sidecar (.meta.bin, .params.json, .bm25, .filters, .commit)
+    for path in glob.glob('test_index.faiss*'):
+        os.remove(path)
     
     print("✓ Pipeline test passed")
     return True
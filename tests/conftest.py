@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from core.embedder import Embedder, with_metric
+from core.indexer import build_index
+from mcp.rag_service import RagMCPService
+
+class FakeEmbedder(Embedder):
+    """Deterministic bag-of-characters embedder so service tests need no model."""
+
+    def __init__(self, dim=16):
+        super().__init__('fake')
+        self.dim = dim
+        self.calls = 0
+
+    def embed(self, texts):
+        self.calls += 1
+        out = np.zeros((len(texts), self.dim), dtype='float32')
+        for i, t in enumerate(texts):
+            for ch in t:
+                out[i, ord(ch) % self.dim] += 1
+        return out
+
+def random_chunks(n, dim=8, seed=0, prefix='doc', sources=3):
+    """`n` chunks with random unit-length embeddings, `sources` distinct sources and filterable meta."""
+    vecs = np.random.default_rng(seed).random((n, dim)).astype('float32')
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    return [{'id': '%s%d#chunk-0' % (prefix, i), 'source': 'src%d' % (i % sources), 'title': None, 'text': 'text %d' % i,
+             'meta': {'year': 2020 + i % 2, 'tags': ['t%d' % (i % 4)]}, 'embedding': vecs[i]} for i in range(n)]
+
+@pytest.fixture
+def make_chunks():
+    return random_chunks
+
+@pytest.fixture
+def fake_embedder():
+    return FakeEmbedder()
+
+@pytest.fixture
+def make_service(tmp_path):
+    def make(texts, query_cache=None, **index_cfg):
+        emb = FakeEmbedder()
+        vecs = with_metric(emb, {'index': index_cfg}).embed(texts)
+        chunks = [{'id': str(i), 'source': 'src%d' % i, 'title': None, 'text': t, 'meta': {}, 'embedding': vecs[i]}
+                  for i, t in enumerate(texts)]
+        path = str(tmp_path / 'idx.faiss')
+        build_index(chunks, backend='faiss', index_path=path, metric=index_cfg.get('metric'))
+        emb.calls = 0
+        return RagMCPService({'index': {'path': path, **index_cfg}, 'query_cache': query_cache}, embedder=emb)
+    return make
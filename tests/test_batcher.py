@@ -0,0 +1,63 @@
+import asyncio
+from mcp.batcher import MicroBatcher, Overloaded
+
+def test_concurrent_requests_share_one_batch(make_service):
+    svc = make_service(['aaaa', 'bbbb', 'cccc'])
+    batcher = MicroBatcher(svc, window_ms=20, max_batch=16)
+
+    async def run():
+        return await asyncio.gather(*(batcher.search(q, top_k=k) for q, k in [('aaa', 1), ('bbb', 2), ('ccc', 3)]))
+
+    results = asyncio.run(run())
+    assert svc.embedder.calls == 1
+    assert [len(r) for r in results] == [1, 2, 3]
+    assert results[1] == svc.search('bbb', top_k=2)
+    stats = batcher.stats()
+    assert stats['batches'] == 1 and stats['avg_batch_size'] == 3
+    assert stats['stages']['embed']['count'] == 1 and stats['stages']['total']['count'] == 3
+    assert stats['stages']['total']['p99_ms'] >= stats['stages']['total']['p50_ms'] > 0
+    assert not batcher._tasks  # batch tasks are held while running and dropped once done
+    batcher.shutdown()
+
+def test_rejects_when_queue_full(make_service):
+    svc = make_service(['aaaa', 'bbbb'])
+    batcher = MicroBatcher(svc, window_ms=50, max_batch=16, max_queue=2)
+
+    async def run():
+        return await asyncio.gather(*(batcher.search('a') for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert sum(isinstance(r, Overloaded) for r in results) == 1
+    assert batcher.stats()['rejected'] == 1
+    batcher.shutdown()
+
+def test_min_score_applied_per_request(make_service):
+    svc = make_service(['aaaa', 'aaab', 'cccc'], metric='cosine')
+    batcher = MicroBatcher(svc, window_ms=20, max_batch=16)
+
+    async def run():
+        return await asyncio.gather(batcher.search('aaaa', top_k=3), batcher.search('aaaa', top_k=3, min_score=0.5))
+
+    loose, strict = asyncio.run(run())
+    assert len(loose) == 3
+    assert strict == svc.search('aaaa', top_k=3, min_score=0.5)
+    batcher.shutdown()
+
+def test_first_async_request_builds_the_service_off_the_event_loop(monkeypatch):
+    import threading
+    from mcp import api
+    built = []
+
+    def build():
+        built.append(threading.current_thread())
+        monkeypatch.setattr(api, '_svc', object())
+        monkeypatch.setattr(api, '_batcher', 'batcher')
+
+    monkeypatch.setattr(api, '_svc', None)
+    monkeypatch.setattr(api, 'get_service', build)
+
+    async def run():
+        return await api.get_batcher_async(), threading.current_thread()
+
+    batcher, loop_thread = asyncio.run(run())
+    assert batcher == 'batcher' and built and built[0] is not loop_thread
@@ -0,0 +1,43 @@
+from core.bm25 import BM25Index, tokenize, write_bm25
+
+def test_tokenize_identifiers():
+    toks = tokenize('Call bt.Cerebro.adddata() or add_data for PROJ-1234.')
+    assert 'bt.cerebro.adddata' in toks and 'cerebro' in toks and 'adddata' in toks
+    assert 'add_data' in toks and 'data' in toks
+    assert 'proj-1234' in toks and '1234' in toks
+
+def test_bm25_ranking(tmp_path):
+    texts = ['the cat sat on the mat', 'dogs and cats', 'cerebro runs the strategy',
+             'the the the the', 'cerebro cerebro adddata feeds']
+    path = str(tmp_path / 'x.bm25')
+    write_bm25(path, texts)
+    idx = BM25Index(path)
+    assert len(idx) == 5
+    rows, scores = idx.search('cerebro', top_k=3)
+    assert list(rows) == [4, 2] and scores[0] > scores[1] > 0
+    rows, _ = idx.search('adddata cat', top_k=1)
+    assert list(rows) == [4]
+    assert len(idx.search('missingterm')[0]) == 0
+    assert len(idx.search('zzz')[0]) == 0
+
+def test_hybrid_finds_exact_identifier(make_service):
+    texts = ['aaaa aaaa', 'aaab aaaa', 'ticket PROJ-4711 mentions zz', 'cccc']
+    dense = make_service(texts)
+    hybrid = make_service(texts, hybrid=True)
+    assert 'PROJ-4711' not in dense.search('aaaa PROJ-4711', top_k=1)[0]['text']
+    hits = hybrid.search('aaaa PROJ-4711', top_k=2)
+    assert any('PROJ-4711' in h['text'] for h in hits)
+    assert hybrid.search_many(['aaaa PROJ-4711'], top_k=2) == [hits]
+
+def test_hybrid_applies_min_score_to_the_dense_score(make_service):
+    texts = ['aaaa aaaa', 'aaab aaaa', 'ticket PROJ-4711 mentions zz', 'cccc']
+    dense = make_service(texts)
+    hybrid = make_service(texts, hybrid=True)
+    # an l2 index: min_score is the largest distance returned
+    cut = dense.search('aaaa PROJ-4711', top_k=2)[1]['score']
+    expected = dense.search('aaaa PROJ-4711', top_k=4, min_score=cut)
+    assert not any('PROJ-4711' in h['text'] for h in expected)
+    hits = hybrid.search('aaaa PROJ-4711', top_k=4, min_score=cut)
+    assert sorted(h['text'] for h in hits) == sorted(h['text'] for h in expected)
+    assert all(h['dense_score'] <= cut for h in hits) and hits[0]['score'] < 0.1
+    assert hybrid.search('aaaa PROJ-4711', min_score=-1.0) == []
@@ -4,3 +4,32 @@ def test_chunk_small():
     s = 'a'*500
     chunks = chunk_text(s, max_chars=200, overlap=50)
     assert len(chunks) >= 3
+
+from core.chunker import docs_to_chunks
+
+def test_chunks_respect_max_with_overlap():
+    text = "This is a test sentence. This is another sentence. " * 10
+    chunks = chunk_text(text, max_chars=100, overlap=30)
+    assert len(chunks) > 1
+    assert all(len(c) <= 100 for c in chunks)
+    # consecutive chunks share a whole sentence
+    assert chunks[1].startswith(chunks[0].rsplit('. ', 1)[-1])
+
+def test_token_budget():
+    words = lambda s: len(s.split())
+    text = ' '.join('Sentence number %d has six words.' % i for i in range(20))
+    chunks = chunk_text(text, max_tokens=20, overlap=6, count_tokens=words)
+    assert all(words(c) <= 20 for c in chunks)
+    assert len(chunks) >= 7
+
+def test_offsets_and_process_pool():
+    docs = [{'id': 'd%d' % i, 'text': 'Alpha beta. Gamma delta! ' * (20 + i), 'meta': {'source': 's'}} for i in range(6)]
+    docs.append({'id': 'skip', 'unchanged': True})
+    serial = docs_to_chunks(docs, max_chars=60, overlap=15)
+    for c, d in ((c, docs[int(c['id'][1])]) for c in serial):
+        assert d['text'][c['char_start']:c['char_end']] == c['text']
+    assert docs_to_chunks(docs, max_chars=60, overlap=15, workers=2) == serial
+    # one shared pool per size, whose workers are never forked from the threaded parent
+    from core.procpool import process_pool
+    assert process_pool(2) is process_pool(2)
+    assert process_pool(2)._mp_context.get_start_method() in ('forkserver', 'spawn')
@@ -0,0 +1,54 @@
+import numpy as np
+from core.embed_cache import EmbeddingCache, cached_embed, text_key
+from core.embedder import embed_chunks
+
+def test_only_misses_are_embedded(tmp_path, fake_embedder):
+    cache = EmbeddingCache(str(tmp_path / 'emb.sqlite'))
+    first = cached_embed(fake_embedder, ['alpha', 'beta', 'alpha'], cache)
+    assert fake_embedder.calls == 1
+    assert cache.stats()['entries'] == 2
+    second = cached_embed(fake_embedder, ['beta', '  alpha\n', 'gamma'], cache)
+    assert fake_embedder.calls == 2
+    np.testing.assert_array_equal(second[1], first[0])
+    assert second.dtype == np.float32 and second.shape == (3, 16)
+    stats = cache.stats()
+    assert stats['hits'] == 2 and stats['misses'] == 4
+
+def test_persists_and_evicts_lru(tmp_path, fake_embedder):
+    path = str(tmp_path / 'emb.sqlite')
+    cache = EmbeddingCache(path, max_bytes=10 * 16 * 4)
+    cached_embed(fake_embedder, ['t%d' % i for i in range(6)], cache)
+    cached_embed(fake_embedder, ['t%d' % i for i in range(6, 12)], cache)
+    assert cache.stats()['evictions'] > 0
+    assert cache.stats()['bytes'] <= 10 * 16 * 4
+    cache.close()
+    reopened = EmbeddingCache(path)
+    assert reopened.get_many('fake', [text_key('t11')])[0] is not None
+    assert reopened.get_many('fake', [text_key('t0')])[0] is None
+
+def test_embed_chunks_uses_configured_cache(tmp_path, fake_embedder):
+    config = {'embedding': {'cache': {'path': str(tmp_path / 'emb.sqlite')}}}
+    chunks = [{'text': 'one'}, {'text': 'two'}]
+    embed_chunks(chunks, config, embedder=fake_embedder)
+    embed_chunks([dict(c) for c in chunks], config, embedder=fake_embedder)
+    assert fake_embedder.calls == 1
+    assert len(chunks[0]['embedding']) == 16
+
+def test_replacing_keys_does_not_grow_the_size(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'emb.sqlite'))
+    vecs = np.ones((3, 16), dtype=np.float32)
+    cache.put_many('fake', ['a', 'b', 'a'], vecs)
+    assert cache.stats()['bytes'] == 2 * 16 * 4
+    cache.put_many('fake', ['a', 'b'], vecs[:2])
+    cache.put_many('fake', ['c'], np.ones((1, 8), dtype=np.float32))
+    assert cache.stats()['bytes'] == 2 * 16 * 4 + 8 * 4 and cache.stats()['entries'] == 3
+
+def test_embed_chunks_closes_the_cache_it_opens(tmp_path, fake_embedder, monkeypatch):
+    closed = []
+    monkeypatch.setattr(EmbeddingCache, 'close', lambda self: closed.append(self))
+    config = {'embedding': {'cache': {'path': str(tmp_path / 'emb.sqlite')}}}
+    embed_chunks([{'text': 'one'}], config, embedder=fake_embedder)
+    assert len(closed) == 1
+    cache = EmbeddingCache(str(tmp_path / 'other.sqlite'))
+    embed_chunks([{'text': 'two'}], config, embedder=fake_embedder, cache=cache)
+    assert len(closed) == 1
@@ -1,38 +1,46 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import MagicMock
+import numpy as np
 from core.embedder import OpenAIEmbedder, SentenceTransformerEmbedder, get_embedder
 from core import constants
 
 class TestEmbedder(unittest.TestCase):
 
-    @patch('core.embedder.openai')
-    def test_openai_embedder(self, mock_openai):
-        mock_embedding = {
-            'data': [
-                {
-                    'embedding': [0.1, 0.2, 0.3]
-                }
-            ]
-        }
-        mock_openai.Embedding.create.return_value = mock_embedding
+    def test_openai_embedder(self):
+        def create(input, model):
+            raw = MagicMock(headers={})
+            # the API may answer out of order; rows carry their index
+            raw.parse.return_value.data = [MagicMock(index=i, embedding=[float(len(t)), 1.0])
+                                           for i, t in reversed(list(enumerate(input)))]
+            return raw
 
-        embedder = OpenAIEmbedder(model_name='text-embedding-3-small', api_key='test_key')
-        embedding = embedder.embed(['test text'])
+        embedder = OpenAIEmbedder(model_name='text-embedding-3-small', api_key='test_key', rpm=600, tpm=60000,
+                                  batch_size=2, concurrency=1)
+        self.assertEqual((embedder.requests.rate, embedder.tokens.rate), (10.0, 1000.0))
+        embedder.client = MagicMock()
+        embedder.client.embeddings.with_raw_response.create.side_effect = create
+        embedding = embedder.embed(['a', 'bb', 'ccc'])
 
-        self.assertEqual(embedding, [[0.1, 0.2, 0.3]])
-        mock_openai.Embedding.create.assert_called_once_with(input=['test text'], model='text-embedding-3-small')
+        self.assertEqual(embedding.dtype, np.float32)
+        np.testing.assert_array_equal(embedding, [[1.0, 1.0], [2.0, 1.0], [3.0, 1.0]])
+        calls = embedder.client.embeddings.with_raw_response.create.call_args_list
+        self.assertEqual([c.kwargs for c in calls], [{'input': ['a', 'bb'], 'model': 'text-embedding-3-small'},
+                                                     {'input': ['ccc'], 'model': 'text-embedding-3-small'}])
 
-    @patch('core.embedder.SentenceTransformer')
-    def test_sentence_transformer_embedder(self, mock_sentence_transformer):
+    def test_sentence_transformer_embedder(self):
         mock_model = MagicMock()
         mock_model.encode.return_value = [[0.4, 0.5, 0.6]]
-        mock_sentence_transformer.return_value = mock_model
 
         embedder = SentenceTransformerEmbedder(model_name='all-MiniLM-L6-v2')
+        # the model is loaded lazily on first use; inject it so the test needs no sentence_transformers
+        embedder._model = mock_model
         embedding = embedder.embed(['test text'])
 
-        self.assertEqual(embedding, [[0.4, 0.5, 0.6]])
-        mock_model.encode.assert_called_once_with(['test text'], show_progress_bar=False)
+        self.assertIsInstance(embedding, np.ndarray)
+        self.assertEqual(embedding.dtype, np.float32)
+        np.testing.assert_allclose(embedding, [[0.4, 0.5, 0.6]], rtol=1e-6)
+        mock_model.encode.assert_called_once_with(['test text'], batch_size=32, show_progress_bar=False,
+                                                  convert_to_numpy=True)
 
     def test_get_embedder_openai(self):
         config = {
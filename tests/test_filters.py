@@ -0,0 +1,83 @@
+import asyncio
+import numpy as np
+import pytest
+from core.filters import FilterIndex, Selection, write_filters
+from core.indexer import build_index
+from core.retriever import IndexHandle
+from mcp.batcher import MicroBatcher
+
+def _chunks(n, dim=16, seed=0):
+    vecs = np.random.default_rng(seed).random((n, dim)).astype('float32')
+    return [{'id': 's3://bucket/%s/doc%d#chunk-%d' % ('docs' if i % 2 else 'logs', i // 3, i % 3),
+             'source': 'src%d' % (i % 100), 'title': None, 'text': 'chunk %d' % i,
+             'meta': {'source': 'src%d' % (i % 100), 'year': 2020 + i % 5, 'tags': ['t%d' % (i % 3), 'all'],
+                      'draft': i % 7 == 0},
+             'embedding': vecs[i]} for i in range(n)]
+
+def test_filter_index_operators(tmp_path):
+    chunks = _chunks(60)
+    f = FilterIndex(write_filters(str(tmp_path / 'x.filters'), chunks))
+    ids = lambda flt: set(f.select(flt).ids.tolist())
+    assert ids({'source': 'src3'}) == {3}
+    assert ids({'source': ['src3', 'src4', 'nope']}) == {3, 4}
+    assert ids({'year': 2021}) == {i for i in range(60) if i % 5 == 1}
+    assert ids({'draft': True}) == {i for i in range(60) if i % 7 == 0}
+    assert ids({'tags': 't1', 'year': {'in': [2021, 2022]}}) == {i for i in range(60) if i % 3 == 1 and i % 5 in (1, 2)}
+    assert ids({'doc': {'prefix': 's3://bucket/docs/'}}) == {i for i in range(60) if i % 2}
+    assert ids({'doc': {'prefix': 's3://bucket/logs/doc1'}}) == {i for i in range(60) if not i % 2 and str(i // 3).startswith('1')}
+    assert ids({'unknown_field': 'x'}) == set()
+    assert f.select({'source': 'src3'}) is f.select({'source': 'src3'})  # compiled filters are cached
+    with pytest.raises(ValueError):
+        f.select({'source': {'regex': '.*'}})
+
+@pytest.mark.parametrize('backend', ['faiss-flat', 'faiss-ivf', 'faiss-hnsw'])
+def test_filtered_search_is_exact_within_the_subset(tmp_path, backend):
+    chunks = _chunks(4000)
+    path = str(tmp_path / 'idx.faiss')
+    build_index(chunks, backend=backend, index_path=path, target_recall=0.9)
+    handle = IndexHandle(path)
+    vecs = np.asarray([c['embedding'] for c in chunks])
+    # 2% of the corpus (a subset scan for HNSW) and 20% (searched through the graph)
+    for flt, allowed in [({'source': ['src7', 'src42']}, [i for i in range(4000) if i % 100 in (7, 42)]),
+                         ({'year': 2021}, [i for i in range(4000) if i % 5 == 1])]:
+        allowed = np.asarray(allowed)
+        recall = []
+        for q in vecs[:20] + 0.01:
+            hits = handle.search(q, top_k=10, filter=flt)
+            assert len(hits) == 10 and all(int(h['meta']['text'].split()[1]) in set(allowed) for h in hits)
+            exact = allowed[np.argsort(((vecs[allowed] - q) ** 2).sum(axis=1))[:10]]
+            recall.append(len({h['meta']['text'] for h in hits} & {'chunk %d' % i for i in exact}) / 10)
+        assert np.mean(recall) >= 0.9
+    assert handle.search(vecs[0], top_k=10, filter={'source': 'nope'}) == []
+    assert len(handle.search(vecs[0], top_k=10, filter={'source': 'src7'})) == 10
+
+def test_service_hybrid_and_batcher_filters(make_service):
+    svc = make_service(['aaaa', 'aaab', 'bbbb', 'aaac'], hybrid=True)
+    hits = svc.search('aaaa', top_k=4, filter={'source': ['src1', 'src2']})
+    assert {h['source'] for h in hits} == {'src1', 'src2'}
+    assert [h['source'] for h in svc.search_many(['aaaa'], top_k=4, filter={'source': 'src3'})[0]] == ['src3']
+    batcher = MicroBatcher(svc, window_ms=20, max_batch=16)
+
+    async def run():
+        return await asyncio.gather(batcher.search('aaaa', top_k=2), batcher.search('aaaa', 2, None, {'source': 'src2'}),
+                                    batcher.search('aaaa', 2, None, {'source': {'bad': 1}}), return_exceptions=True)
+
+    plain, filtered, bad = asyncio.run(run())
+    assert len(plain) == 2 and [h['source'] for h in filtered] == ['src2']
+    assert isinstance(bad, ValueError)
+    batcher.shutdown()
+
+def test_filters_can_be_disabled(tmp_path):
+    path = str(tmp_path / 'idx.faiss')
+    build_index(_chunks(20), backend='faiss', index_path=path, filters=False)
+    with pytest.raises(ValueError):
+        IndexHandle(path).search(np.zeros(16, dtype='float32'), filter={'source': 'src1'})
+
+def test_selection_is_built_once_across_threads():
+    from concurrent.futures import ThreadPoolExecutor
+    sel = Selection(np.arange(0, 5000, 3, dtype='int64'))
+    with ThreadPoolExecutor(8) as pool:
+        selectors = list(pool.map(lambda _: sel.selector, range(64)))
+        subsets = list(pool.map(lambda _: sel.subset(1000, 2000), range(64)))
+    assert all(s is selectors[0] for s in selectors) and all(s is subsets[0] for s in subsets)
+    assert selectors[0].is_member(3) and not selectors[0].is_member(4)
@@ -0,0 +1,90 @@
+import pytest
+from core.incremental import needs_rebuild, update_index, load_manifest, manifest_path
+from core.indexer import build_index
+from core.retriever import IndexHandle
+
+def _config(tmp_path):
+    return {'index': {'type': 'faiss', 'path': str(tmp_path / 'idx.faiss')},
+            'pipeline': {'chunk_max_chars': 50, 'chunk_overlap': 0}}
+
+def _docs(**texts):
+    return [{'id': k, 'text': v, 'meta': {'source': 'test'}} for k, v in texts.items()]
+
+def test_only_the_diff_is_embedded(tmp_path, fake_embedder):
+    config = _config(tmp_path)
+    stats = update_index(_docs(a='aaaa aaaa.', b='bbbb bbbb.', c='cccc cccc.'), config, embedder=fake_embedder)
+    assert stats['added'] == 3 and stats['chunks_added'] == 3
+    handle = IndexHandle(config['index']['path'])
+    assert handle.ntotal == 3
+
+    fake_embedder.calls = 0
+    stats = update_index(_docs(a='aaaa aaaa.', b='bbbb changed.', d='dddd dddd.'), config, embedder=fake_embedder)
+    assert (stats['added'], stats['changed'], stats['removed'], stats['unchanged']) == (1, 1, 1, 1)
+    assert fake_embedder.calls == 1
+    assert handle.maybe_reload(wait=True)
+    assert handle.ntotal == 3
+    hits = handle.search(fake_embedder.embed_query('bbbb changed.'), top_k=3)
+    assert hits[0]['meta']['text'] == 'bbbb changed.'
+    assert {h['meta']['id'] for h in hits} == {'a#chunk-0', 'b#chunk-0', 'd#chunk-0'}
+    # the keyword index is rebuilt in step with the patched metastore
+    hybrid = IndexHandle(config['index']['path'], hybrid=True)
+    hits = hybrid.search(fake_embedder.embed_query('dddd'), top_k=1, query='dddd')
+    assert hits[0]['meta']['id'] == 'd#chunk-0'
+    # so is the filter index, keyed by the patched FAISS ids
+    hits = hybrid.search(fake_embedder.embed_query('dddd'), top_k=3, query='dddd', filter={'doc': ['b', 'a']})
+    assert {h['meta']['id'] for h in hits} == {'a#chunk-0', 'b#chunk-0'}
+
+    manifest = load_manifest(manifest_path(config))
+    assert set(manifest['docs']) == {'a', 'b', 'd'}
+    assert manifest['docs']['b']['ids'][0] >= 3  # changed chunks get fresh ids
+    assert manifest['next_id'] == 5
+
+def test_unchanged_stubs_and_noop(tmp_path, fake_embedder):
+    config = _config(tmp_path)
+    update_index(_docs(a='aaaa.', b='bbbb.'), config, embedder=fake_embedder)
+    fake_embedder.calls = 0
+    stats = update_index([{'id': 'a', 'unchanged': True}] + _docs(b='bbbb.'), config, embedder=fake_embedder)
+    assert stats['unchanged'] == 2 and stats['chunks_added'] == 0
+    assert fake_embedder.calls == 0
+    stats = update_index(_docs(c='cccc.'), config, embedder=fake_embedder, full=False)
+    assert stats['removed'] == 0
+    assert IndexHandle(config['index']['path']).ntotal == 3
+
+def test_failed_fetches_are_not_removals(tmp_path, fake_embedder):
+    config = _config(tmp_path)
+    update_index(_docs(a='aaaa.', b='bbbb.'), config, embedder=fake_embedder)
+    stats = update_index([{'id': 'a', 'error': '503 Service Unavailable'}] + _docs(b='bbbb.'), config,
+                         embedder=fake_embedder)
+    assert (stats['removed'], stats['failed'], stats['unchanged']) == (0, 1, 1)
+    assert set(load_manifest(manifest_path(config))['docs']) == {'a', 'b'}
+    assert IndexHandle(config['index']['path']).ntotal == 2
+
+def test_empty_incremental_run_keeps_the_index(tmp_path, fake_embedder):
+    import yaml
+    from run_pipeline import main
+    config = _config(tmp_path)
+    update_index(_docs(a='aaaa.', b='bbbb.'), config, embedder=fake_embedder)
+    path = tmp_path / 'config.yaml'
+    path.write_text(yaml.safe_dump(dict(config, sources=[], embedding={},
+                                        pipeline=dict(config['pipeline'], incremental=True))))
+    main(['--config', str(path)])
+    assert set(load_manifest(manifest_path(config))['docs']) == {'a', 'b'}
+    assert IndexHandle(config['index']['path']).ntotal == 2
+
+def test_rebuild_refuses_stubs(tmp_path, fake_embedder):
+    config = _config(tmp_path)
+    assert needs_rebuild(config)
+    update_index(_docs(a='aaaa.', b='bbbb.', c='cccc.'), config, embedder=fake_embedder)
+    assert not needs_rebuild(config)
+    # a fresh full build addresses rows by position, so the next update has to start over
+    docs = _docs(a='aaaa.', b='bbbb.', c='cccc.')
+    chunks = [{'id': d['id'] + '#chunk-0', 'source': 'test', 'title': None, 'text': d['text'], 'meta': {},
+               'embedding': fake_embedder.embed([d['text']])[0]} for d in docs]
+    build_index(chunks, backend='faiss', index_path=config['index']['path'])
+    assert needs_rebuild(config)
+    with pytest.raises(ValueError):
+        update_index([{'id': 'a', 'unchanged': True}, {'id': 'b', 'unchanged': True}] + _docs(c='changed.'), config,
+                     embedder=fake_embedder)
+    assert IndexHandle(config['index']['path']).ntotal == 3
+    stats = update_index(_docs(a='aaaa.', b='bbbb.', c='changed.'), config, embedder=fake_embedder)
+    assert stats['added'] == 3 and IndexHandle(config['index']['path']).ntotal == 3
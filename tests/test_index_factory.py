@@ -0,0 +1,50 @@
+import faiss
+import numpy as np
+from core.index_factory import build_faiss, choose_index_type, choose_nlist, load_params, train_sample
+from core.indexer import build_index
+from core.retriever import IndexHandle
+
+def _vectors(n, dim=16, seed=0):
+    return np.random.default_rng(seed).random((n, dim)).astype('float32')
+
+def test_choose_index_type():
+    assert choose_index_type(1000, 384) == 'faiss-flat'
+    assert choose_index_type(200000, 384) == 'faiss-ivf'
+    assert choose_index_type(200000, 384, target_recall=0.99) == 'faiss-hnsw'
+    assert choose_index_type(200000, 384, memory_mb=64) == 'faiss-ivfpq'
+
+def test_small_corpus_never_undertrained():
+    vecs = _vectors(500)
+    nlist = choose_nlist(len(vecs))
+    assert len(vecs) >= nlist * 39
+    sample = train_sample(vecs, {'nlist': nlist})
+    assert len(sample) == len(vecs)
+    index, params = build_faiss(vecs, 'faiss-ivfpq')
+    assert index.is_trained and index.ntotal == 500
+    assert 2 ** params['nbits'] * 39 <= 500
+
+def test_tuned_params_persisted_and_applied(tmp_path):
+    vecs = _vectors(3000)
+    chunks = [{'id': str(i), 'text': 't%d' % i, 'meta': {}, 'embedding': v} for i, v in enumerate(vecs)]
+    path = str(tmp_path / 'idx.faiss')
+    build_index(chunks, backend='faiss-ivf', index_path=path, target_recall=0.9)
+    params = load_params(path)
+    assert params['type'] == 'faiss-ivf' and params['recall_at_10'] >= 0.9
+    handle = IndexHandle(path)
+    assert faiss.extract_index_ivf(handle.snapshot().index).nprobe == params['nprobe']
+    assert handle.search(vecs[7], top_k=1)[0]['meta']['id'] == '7'
+    override = IndexHandle(path, search_params={'nprobe': params['nlist']})
+    assert faiss.extract_index_ivf(override.snapshot().index).nprobe == params['nlist']
+
+def test_hnsw_build():
+    index, params = build_faiss(_vectors(2000), 'faiss-hnsw', {'target_recall': 0.9})
+    assert params['efSearch'] >= 16 and index.hnsw.efSearch == params['efSearch']
+
+def test_inner_product_variants():
+    vecs = _vectors(3000)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    for t in ('faiss-flat', 'faiss-ivf', 'faiss-hnsw'):
+        index, params = build_faiss(vecs, t, {'metric': 'cosine', 'target_recall': 0.9})
+        assert index.metric_type == faiss.METRIC_INNER_PRODUCT and params['metric'] == 'cosine'
+        D, I = index.search(vecs[:5], 1)
+        assert list(I[:, 0]) == [0, 1, 2, 3, 4] and np.allclose(D[:, 0], 1.0, atol=1e-4)
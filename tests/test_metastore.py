@@ -0,0 +1,31 @@
+import json
+from core.metastore import MetaStore, write_metastore, migrate_json
+
+def test_roundtrip_skips_embeddings_and_dedups_meta(tmp_path):
+    meta = {'source': 'file', 'path': 'a.md'}
+    chunks = [
+        {'id': 'a#chunk-0', 'source': 'file', 'title': None, 'text': 'héllo', 'meta': meta, 'embedding': [0.1, 0.2]},
+        {'id': 'a#chunk-1', 'source': 'file', 'title': 'T', 'text': '', 'meta': meta, 'embedding': [0.3, 0.4]},
+        {'id': 'b#chunk-0', 'source': None, 'title': None, 'text': 'x' * 5000, 'meta': {}, 'char_start': 7},
+    ]
+    path = str(tmp_path / 'm.meta.bin')
+    write_metastore(path, chunks)
+    store = MetaStore(path)
+    assert len(store) == 3
+    assert store[0] == {'id': 'a#chunk-0', 'source': 'file', 'title': None, 'text': 'héllo', 'meta': meta}
+    assert store[1]['text'] == '' and store[1]['title'] == 'T'
+    assert store[2]['source'] is None and store[2]['char_start'] == 7
+    assert store[-1]['text'] == 'x' * 5000
+    assert store.meta(0) is store.meta(1)
+    assert list(store.ids) == [0, 1, 2]
+    assert [r['id'] for r in store.get_many([2, 0])] == ['b#chunk-0', 'a#chunk-0']
+
+def test_migrate_json_is_smaller(tmp_path):
+    idx = str(tmp_path / 'idx.faiss')
+    chunks = [{'id': str(i), 'source': 's', 'title': None, 'text': 't%d' % i, 'meta': {'source': 's'},
+               'embedding': [0.123456789] * 384} for i in range(10)]
+    with open(idx + '.meta.json', 'w') as f:
+        json.dump(chunks, f)
+    path = migrate_json(idx)
+    assert (tmp_path / 'idx.faiss.meta.bin').stat().st_size * 10 < (tmp_path / 'idx.faiss.meta.json').stat().st_size
+    assert MetaStore(path)[3]['text'] == 't3'
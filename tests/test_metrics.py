@@ -0,0 +1,62 @@
+import json, pstats
+from core import metrics
+from core.pipeline import run_streaming
+
+def test_histogram_and_render():
+    h = metrics.Histogram(buckets=(0.01, 0.1, 1.0))
+    for s in (0.005, 0.05, 0.05, 0.5, 3.0):
+        h.observe(s)
+    snap = h.snapshot()
+    assert snap['count'] == 5 and snap['max_ms'] == 3000.0 and snap['p50_ms'] == 100.0 and snap['p99_ms'] == 3000.0
+    text = metrics.render([('t_seconds', 'histogram', 'test', [({'stage': 'a"b'}, h)]),
+                           ('t_total', 'counter', 'test', [({}, 7)]), ('t_gauge', 'gauge', 'test', [({}, None)])])
+    lines = text.splitlines()
+    assert '# TYPE t_seconds histogram' in lines
+    assert 't_seconds_bucket{stage="a\\"b",le="0.1"} 3' in lines
+    assert 't_seconds_bucket{stage="a\\"b",le="+Inf"} 5' in lines
+    assert 't_seconds_count{stage="a\\"b"} 5' in lines and 't_total 7' in lines and 't_gauge NaN' in lines
+
+def test_spans_only_inside_begin():
+    with metrics.span('fetch'):
+        pass
+    assert metrics.collect() == {}
+    metrics.begin()
+    with metrics.span('fetch'):
+        pass
+    with metrics.span('fetch'):
+        pass
+    spans = metrics.collect()
+    assert list(spans) == ['fetch'] and spans['fetch'] >= 0
+    assert metrics.collect() == {}
+
+def test_service_reports_stages(make_service):
+    svc = make_service(['aaaa', 'bbbb', 'cccc'], query_cache={'results': 10})
+    svc.search('aaaa', top_k=2)
+    svc.search('aaaa', top_k=2)
+    stages = svc.stage_stats()
+    assert stages['embed']['count'] == 2 and stages['search']['count'] == 1 and stages['fetch']['count'] == 1
+    assert stages['rerank']['count'] == 0
+    text = metrics.render(svc.metric_families())
+    assert 'rag_request_stage_seconds_count{stage="fetch"} 1' in text
+    assert 'rag_query_cache_hits_total{level="results"} 1' in text
+
+def test_run_report(tmp_path, fake_embedder):
+    docs = ({'id': 'doc-%d' % i, 'text': 'Document number %d.' % i, 'meta': {}} for i in range(10))
+    report = metrics.RunReport()
+    config = {'pipeline': {'chunk_max_chars': 200, 'chunk_overlap': 0}}
+    run_streaming(report.timed('load', docs), config, embedder=fake_embedder, index_path=str(tmp_path / 'idx.faiss'),
+                  batch_docs=4, report=report)
+    path = str(tmp_path / 'report.json')
+    report.write(path, sources={})
+    with open(path, encoding='utf-8') as f:
+        out = json.load(f)
+    assert out['stages']['load']['items'] == 10 and out['stages']['chunk']['calls'] == 3
+    assert out['stages']['embed']['items'] == 10 and out['stages']['embed']['bytes'] > 0
+    assert out['stages']['write']['bytes'] == 10 * 16 * 4 and out['stages']['build']['items'] == 10
+    assert out['peak_rss_bytes'] > 0 and out['sources'] == {}
+
+def test_profiled(tmp_path):
+    path = str(tmp_path / 'x.prof')
+    with metrics.profiled(path):
+        sorted(range(1000), key=lambda i: -i)
+    assert pstats.Stats(path).total_calls > 0
@@ -0,0 +1,75 @@
+import threading
+from core.loaders import notion_loader
+from core.loaders.notion_loader import NotionLoader
+from core.ratelimit import TokenBucket
+
+def _text(t):
+    return {'rich_text': [{'plain_text': t}]}
+
+class FakeNotion:
+    """Database with two rows; 'p1' has a toggle with a nested block and a child page 'c1'."""
+    def __init__(self, auth=None):
+        self.edited = {'p1': 't1', 'p2': 't1', 'c1': 't1'}
+        self.content = {
+            'p1': [{'id': 'b1', 'type': 'paragraph', 'paragraph': _text('page one')},
+                   {'id': 'tg', 'type': 'toggle', 'toggle': _text('toggle'), 'has_children': True},
+                   {'id': 'c1', 'type': 'child_page', 'child_page': {'title': 'Child'}, 'has_children': True}],
+            'tg': [{'id': 'b2', 'type': 'paragraph', 'paragraph': _text('nested')}],
+            'p2': [{'id': 'b3', 'type': 'paragraph', 'paragraph': _text('page two')}],
+            'c1': [{'id': 'b4', 'type': 'paragraph', 'paragraph': _text('child text')}],
+        }
+        self.block_calls = []
+        self._lock = threading.Lock()
+        fake = self
+
+        class _Children:
+            def list(self, block_id, start_cursor=None):
+                with fake._lock:
+                    fake.block_calls.append(block_id)
+                return {'results': fake.content[block_id], 'has_more': False}
+
+        class _Blocks:
+            children = _Children()
+
+        class _Databases:
+            def query(self, database_id, start_cursor=None):
+                rows = [{'id': p, 'last_edited_time': fake.edited[p],
+                         'properties': {'Name': {'type': 'title', 'title': [{'plain_text': p.upper()}]}}}
+                        for p in ('p1', 'p2')]
+                return {'results': rows, 'has_more': False}
+
+        class _Pages:
+            def retrieve(self, page_id):
+                return {'id': page_id, 'last_edited_time': fake.edited[page_id], 'properties': {}}
+
+        self.blocks = _Blocks()
+        self.databases = _Databases()
+        self.pages = _Pages()
+
+def _loader(monkeypatch, tmp_path, client=None):
+    client = client or FakeNotion()
+    monkeypatch.setattr(notion_loader, 'Client', lambda auth=None: client)
+    loader = NotionLoader(token='x', database_id='db', extract_workers=0, limiter=TokenBucket(1000),
+                          state_path=str(tmp_path / 'state.json'))
+    return loader, client
+
+def test_loads_pages_nested_blocks_and_child_pages(monkeypatch, tmp_path):
+    loader, client = _loader(monkeypatch, tmp_path)
+    docs = {d['id']: d for d in loader.load()}
+    assert set(docs) == {'p1', 'p2', 'c1'}
+    assert 'nested' in docs['p1']['text'] and docs['p1']['meta']['title'] == 'P1'
+    assert docs['c1']['text'] == 'child text'
+    assert docs['p2']['meta']['last_edited_time'] == 't1'
+
+def test_skips_pages_with_same_last_edited_time(monkeypatch, tmp_path):
+    loader, client = _loader(monkeypatch, tmp_path)
+    loader.load()
+    loader.commit()
+    client.edited['c1'] = 't2'
+    loader, _ = _loader(monkeypatch, tmp_path, client)
+    client.block_calls.clear()
+    docs = {d['id']: d for d in loader.load()}
+    assert docs['p1'] == {'id': 'p1', 'unchanged': True} and docs['p2'].get('unchanged')
+    # the child page is still reached through the stored links of its unchanged parent
+    assert docs['c1']['text'] == 'child text'
+    assert client.block_calls == ['c1']
@@ -0,0 +1,48 @@
+import json
+import numpy as np
+from core.embedder import OnnxEmbedder
+
+class FakeEncoding:
+    def __init__(self, ids):
+        self.ids = ids
+
+class FakeTokenizer:
+    def encode_batch(self, texts):
+        return [FakeEncoding([ord(c) % 50 + 1 for c in t]) for t in texts]
+
+class FakeSession:
+    """Per-token hidden states from a fixed table, like a transformer without attention."""
+    def __init__(self, dim=8):
+        self.table = np.random.default_rng(0).random((64, dim)).astype('float32')
+        self.batches = []
+
+    def run(self, outputs, feeds):
+        self.batches.append(feeds['input_ids'].shape)
+        return [self.table[feeds['input_ids']]]
+
+def _embedder(tmp_path, **spec):
+    spec = dict({'model': 'fake', 'pooling': 'mean', 'normalize': True, 'max_length': 128, 'dim': 8, 'pad_id': 0},
+                **spec)
+    (tmp_path / 'embedder.json').write_text(json.dumps(spec))
+    emb = OnnxEmbedder(str(tmp_path), batch_size=2)
+    emb._tokenizer, emb._inputs, emb._session = FakeTokenizer(), {'input_ids', 'attention_mask'}, FakeSession()
+    return emb
+
+def test_length_sorted_batches_match_single_texts(tmp_path):
+    emb = _embedder(tmp_path, quantize='int8')
+    texts = ['a much longer text here', 'hi', 'medium text', 'x', 'another long-ish one']
+    out = emb.embed(texts)
+    assert out.dtype == np.float32 and out.shape == (5, 8) and out.flags['C_CONTIGUOUS']
+    # batches group similar lengths: widths of (x, hi), (medium, another), (longest)
+    assert emb._session.batches == [(2, 2), (2, 20), (1, 23)]
+    single = np.vstack([emb.embed([t]) for t in texts])
+    np.testing.assert_allclose(out, single, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(np.linalg.norm(out, axis=1), 1.0, rtol=1e-5)
+    assert emb.cache_key == 'fake#onnx-int8'
+    assert emb.embed([]).shape == (0, 8)
+
+def test_cls_pooling_without_normalize(tmp_path):
+    emb = _embedder(tmp_path, pooling='cls', normalize=False)
+    out = emb.embed(['abc'])
+    np.testing.assert_allclose(out[0], emb._session.table[ord('a') % 50 + 1])
+    assert emb.cache_key == 'fake#onnx-fp32'
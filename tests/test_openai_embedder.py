@@ -0,0 +1,114 @@
+import base64, json, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pytest
+from core.embedder import OpenAIEmbedder
+
+def _vector(text, dim=4):
+    return [float(len(text)), float(sum(map(ord, text)) % 97), 1.0, float(dim)]
+
+class StubAPI:
+    """OpenAI-compatible /v1/embeddings with scripted failures and request accounting."""
+
+    def __init__(self):
+        self.batches = []
+        self.failures = []  # (status, headers) returned before succeeding
+        self.delay = 0.0
+        self.headers = {}
+        self.active = self.max_active = 0
+        self.lock = threading.Lock()
+
+    def handle(self, req):
+        with self.lock:
+            if self.failures:
+                return self.failures.pop(0) + ({'error': {'message': 'scripted', 'type': 'x'}},)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+            self.batches.append(list(req['input']))
+        data = []
+        for i, t in enumerate(req['input']):
+            v = _vector(t)
+            if req.get('encoding_format') == 'base64':
+                v = base64.b64encode(np.asarray(v, dtype='float32').tobytes()).decode()
+            data.append({'object': 'embedding', 'index': i, 'embedding': v})
+        # answer out of order: the client must restore it from `index`
+        body = {'object': 'list', 'model': req['model'], 'data': data[::-1],
+                'usage': {'prompt_tokens': 1, 'total_tokens': 1}}
+        return 200, self.headers, body
+
+@pytest.fixture
+def stub():
+    api = StubAPI()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            req = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            status, headers, body = api.handle(req)
+            raw = json.dumps(body).encode()
+            self.send_response(status)
+            for k, v in dict(headers, **{'Content-Type': 'application/json'}).items():
+                self.send_header(k, v)
+            self.send_header('Content-Length', str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+    api.url = 'http://127.0.0.1:%d/v1' % server.server_port
+    yield api
+    server.shutdown()
+
+def _embedder(stub, **kw):
+    return OpenAIEmbedder('text-embedding-3-small', 'test-key', base_url=stub.url, **kw)
+
+def test_packs_by_tokens_and_keeps_order(stub):
+    emb = _embedder(stub, batch_size=4, batch_tokens=40, concurrency=4, rpm=60000, tpm=10 ** 8)
+    texts = ['text number %d %s' % (i, 'x' * (i % 7) * 10) for i in range(30)]
+    out = emb.embed(texts)
+    assert out.dtype == np.float32 and out.shape == (30, 4)
+    np.testing.assert_array_equal(out, np.asarray([_vector(t) for t in texts], dtype='float32'))
+    assert sorted(t for b in stub.batches for t in b) == sorted(texts)
+    for b in stub.batches:
+        assert len(b) <= 4
+        assert len(b) == 1 or sum(emb._count(t) for t in b) <= 40
+    assert emb.embed([]).shape == (0, 0)
+
+def test_requests_run_concurrently(stub):
+    stub.delay = 0.05
+    emb = _embedder(stub, batch_size=1, concurrency=4, rpm=60000)
+    t0 = time.monotonic()
+    emb.embed(['t%d' % i for i in range(8)])
+    assert stub.max_active >= 2
+    assert time.monotonic() - t0 < 8 * 0.05
+
+def test_retries_throttling_and_server_errors(stub):
+    stub.failures = [(429, {'retry-after-ms': '20'}), (503, {'retry-after-ms': '10'})]
+    emb = _embedder(stub, rpm=60000)
+    t0 = time.monotonic()
+    assert emb.embed(['hello']).shape == (1, 4)
+    assert time.monotonic() - t0 >= 0.03
+    assert not stub.failures
+
+def test_client_errors_are_not_retried(stub):
+    stub.failures = [(400, {}), (200, {})]
+    with pytest.raises(Exception) as exc:
+        _embedder(stub).embed(['hello'])
+    assert getattr(exc.value, 'status_code', None) == 400
+    assert len(stub.failures) == 1
+
+def test_rate_limit_headers_adapt_budget(stub):
+    stub.headers = {'x-ratelimit-limit-requests': '120', 'x-ratelimit-remaining-requests': '0',
+                    'x-ratelimit-reset-requests': '50ms', 'x-ratelimit-limit-tokens': '600000'}
+    emb = _embedder(stub, rpm=3000, tpm=10 ** 6, batch_size=1)
+    emb.embed(['a'])
+    assert emb.requests.rate == 2.0 and emb.tokens.rate == 10000.0
+    # the exhausted request budget holds the next request until the reset
+    t0 = time.monotonic()
+    emb.embed(['b'])
+    assert time.monotonic() - t0 >= 0.04
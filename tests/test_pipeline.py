@@ -0,0 +1,68 @@
+import os
+import pytest
+from core.loader_base import LoaderState
+from core.pipeline import make_loader, run_streaming, batched
+from core.retriever import IndexHandle
+
+def _docs(n):
+    for i in range(n):
+        yield {'id': 'doc-%d' % i, 'text': 'Document number %d. It has two sentences.' % i, 'meta': {'source': 'test'}}
+
+def _crashing(n, crash_at):
+    for d in _docs(n):
+        if d['id'] == 'doc-%d' % crash_at:
+            raise RuntimeError('loader died')
+        yield d
+
+def test_batched():
+    assert [len(b) for b in batched(range(7), 3)] == [3, 3, 1]
+
+def test_streaming_build(tmp_path, fake_embedder):
+    path = str(tmp_path / 'idx.faiss')
+    config = {'pipeline': {'chunk_max_chars': 200, 'chunk_overlap': 0}}
+    stats = run_streaming(_docs(25), config, embedder=fake_embedder, index_path=path, batch_docs=4)
+    assert stats['docs'] == 25 and stats['chunks'] == 25
+    assert fake_embedder.calls == 7
+    assert not os.path.exists(path + '.work')
+    handle = IndexHandle(path)
+    assert handle.ntotal == 25
+    hit = handle.search(fake_embedder.embed_query('Document number 13. It has two sentences.'), top_k=1)[0]
+    assert hit['meta']['id'] == 'doc-13#chunk-0'
+
+def test_resume_after_crash(tmp_path, fake_embedder):
+    path = str(tmp_path / 'idx.faiss')
+    config = {'pipeline': {'chunk_max_chars': 200, 'chunk_overlap': 0}}
+    with pytest.raises(RuntimeError):
+        run_streaming(_crashing(25, 14), config, embedder=fake_embedder, index_path=path,
+                      batch_docs=4, checkpoint_every=2)
+    assert os.path.exists(path + '.work/state.json')
+    stats = run_streaming(_docs(25), config, embedder=fake_embedder, index_path=path, batch_docs=4)
+    assert stats['resumed_chunks'] == 8  # two full batches were checkpointed before the crash
+    assert stats['docs_skipped'] == 8 and stats['docs'] == 17
+    store = IndexHandle(path).snapshot().meta
+    assert sorted(r['id'] for r in store) == sorted('doc-%d#chunk-0' % i for i in range(25))
+
+def test_streaming_closes_the_embedding_cache(tmp_path, fake_embedder, monkeypatch):
+    from core import embed_cache
+    closed = []
+    monkeypatch.setattr(embed_cache.EmbeddingCache, 'close', lambda self: closed.append(self))
+    config = {'pipeline': {'chunk_max_chars': 200, 'chunk_overlap': 0},
+              'embedding': {'cache': {'path': str(tmp_path / 'emb.sqlite')}}}
+    stats = run_streaming(_docs(5), config, embedder=fake_embedder, index_path=str(tmp_path / 'a.faiss'))
+    assert stats['embed_cache']['misses'] == 5 and len(closed) == 1
+    with pytest.raises(RuntimeError):
+        run_streaming(_crashing(5, 3), config, embedder=fake_embedder, index_path=str(tmp_path / 'b.faiss'))
+    assert len(closed) == 2
+
+def test_refetch_ignores_loader_state(tmp_path):
+    path = tmp_path / 'state.json'
+    path.write_text('{"https://example.com/": {"etag": "x"}}')
+
+    class Loader:
+        def __init__(self, url, **opts):
+            self.state = LoaderState(str(path))
+
+    source = {'type': 'url', 'value': 'https://example.com/'}
+    assert make_loader(source, {'URLLoader': Loader}, incremental=True).state.get('https://example.com/')
+    assert make_loader(source, {'URLLoader': Loader}, incremental=True, refetch=True).state.get(
+        'https://example.com/') is None
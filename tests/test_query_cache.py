@@ -0,0 +1,61 @@
+import time
+from core.embedder import with_metric
+from core.indexer import build_index
+from core.query_cache import LRUCache
+
+CACHE = {'embeddings': 100, 'results': 100, 'ttl': 60}
+
+def test_repeated_queries_skip_embedding_and_search(make_service):
+    svc = make_service(['aaaa', 'bbbb', 'cccc'], query_cache=CACHE)
+    first = svc.search('aaa', top_k=2)
+    assert svc.embedder.calls == 1
+    # whitespace variants normalize to the same cached query
+    assert svc.search('  aaa ', top_k=2) == first
+    assert svc.search_many(['aaa', 'bbb', 'aaa'], top_k=2)[0] == first
+    assert svc.embedder.calls == 2  # only 'bbb' was new
+    stats = svc.cache_stats()
+    assert stats['embeddings']['hits'] == 3 and stats['embeddings']['entries'] == 2
+    assert stats['results']['hits'] == 3 and stats['results']['bytes'] > 0
+    assert len(svc.search('aaa', top_k=1)) == 1  # top_k is part of the result key
+
+def test_rebuild_invalidates_results(make_service):
+    svc = make_service(['aaaa', 'bbbb'], query_cache=CACHE)
+    assert svc.search('aaa', top_k=1)[0]['text'] == 'aaaa'
+    emb = with_metric(svc.embedder, svc.config)
+    chunks = [{'id': '0', 'source': 'new', 'title': None, 'text': 'aaab', 'meta': {}, 'embedding': emb.embed(['aaab'])[0]}]
+    build_index(chunks, backend='faiss', index_path=svc.index_path)
+    assert svc.index.maybe_reload(wait=True)
+    calls = svc.embedder.calls
+    assert svc.search('aaa', top_k=1)[0]['text'] == 'aaab'
+    assert svc.embedder.calls == calls  # the query embedding survives the rebuild
+    assert svc.cache_stats()['generation'] == 2
+
+def test_lru_ttl_and_byte_budget():
+    c = LRUCache(max_entries=2, max_bytes=100, ttl=0.05)
+    c.put('a', 1, 10)
+    c.put('b', 2, 10)
+    assert c.get('a') == 1
+    c.put('c', 3, 10)  # evicts 'b', the least recently used
+    assert c.get('b') is None and c.get('a') == 1
+    c.put('d', 4, 95)  # over the byte budget: everything older goes
+    assert len(c) == 1 and c.bytes == 95
+    time.sleep(0.06)
+    assert c.get('d') is None
+    s = c.stats()
+    assert s['expired'] == 1 and s['evictions'] == 3 and s['entries'] == 0
+
+def test_disabled_without_config(make_service):
+    svc = make_service(['aaaa', 'bbbb'])
+    assert svc.cache is None and svc.cache_stats() is None
+    svc.search('aaa')
+    svc.search('aaa')
+    assert svc.embedder.calls == 2
+
+def test_shared_store_across_services(make_service, tmp_path):
+    cfg = dict(CACHE, shared_path=str(tmp_path / 'q.sqlite'))
+    a = make_service(['aaaa', 'bbbb'], query_cache=cfg)
+    a.search('aaa')
+    b = make_service(['aaaa', 'bbbb'], query_cache=cfg)
+    assert b.search('aaa') == a.search('aaa')
+    assert b.embedder.calls == 0
+    assert b.cache_stats()['shared']['hits'] == 1
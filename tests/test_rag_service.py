@@ -0,0 +1,27 @@
+def test_search_many_matches_search(make_service):
+    svc = make_service(['aaaa', 'bbbb', 'cccc', 'abab'])
+    queries = ['aaa', 'ccc', 'bab']
+    batched = svc.search_many(queries, top_k=2)
+    assert svc.embedder.calls == 1
+    assert len(batched) == 3
+    for q, res in zip(queries, batched):
+        assert res == svc.search(q, top_k=2)
+    assert batched[0][0]['text'] == 'aaaa'
+    assert svc.search_many([], top_k=2) == []
+
+def test_cosine_scores_and_min_score(make_service):
+    svc = make_service(['aaaa', 'aaab', 'cccc'], metric='cosine')
+    assert svc.index.similarity
+    hits = svc.search('aaaa', top_k=3)
+    assert hits[0]['text'] == 'aaaa' and abs(hits[0]['score'] - 1.0) < 1e-5
+    assert all(-1.0 <= h['score'] <= 1.0 + 1e-5 for h in hits)
+    assert [h['score'] for h in hits] == sorted((h['score'] for h in hits), reverse=True)
+    kept = svc.search('aaaa', top_k=3, min_score=0.5)
+    assert [h['text'] for h in kept] == ['aaaa', 'aaab']
+    assert svc.search_many(['aaaa'], top_k=3, min_score=0.5) == [kept]
+
+def test_l2_min_score_is_max_distance(make_service):
+    svc = make_service(['aaaa', 'aaab', 'cccc'])
+    assert not svc.index.similarity
+    hits = svc.search('aaaa', top_k=3, min_score=2.0)
+    assert [h['text'] for h in hits] == ['aaaa', 'aaab']
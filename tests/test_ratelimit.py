@@ -0,0 +1,81 @@
+import time
+import pytest
+from core.ratelimit import TokenBucket, is_retryable, retry_call, retry_after, get_limiter, parse_duration
+from core.pipeline import iter_source_docs_concurrent, source_report
+
+class _Throttled(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__('HTTP %d' % status_code)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+def test_token_bucket_paces_after_burst():
+    bucket = TokenBucket(rate=50, burst=5)
+    t0 = time.monotonic()
+    for _ in range(10):
+        bucket.acquire()
+    assert time.monotonic() - t0 >= 0.08
+
+def test_retry_call_honours_retry_after_and_pauses_bucket():
+    calls = []
+    bucket = TokenBucket(rate=1000)
+
+    def flaky():
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise _Throttled(429, {'retry-after': '0.05'})
+        return 'ok'
+
+    assert retry_call(flaky, limiter=bucket) == 'ok'
+    assert len(calls) == 3 and calls[1] - calls[0] >= 0.05
+    assert retry_after(_Throttled(429, {'Retry-After': '2'})) == 2.0
+
+def test_openai_style_reset_headers():
+    assert parse_duration('6m0s') == 360.0 and parse_duration('20ms') == 0.02 and parse_duration('1.5') == 1.5
+    headers = {'x-ratelimit-remaining-requests': '12', 'x-ratelimit-reset-requests': '1s',
+               'x-ratelimit-remaining-tokens': '0', 'x-ratelimit-reset-tokens': '6m0s'}
+    assert retry_after(_Throttled(429, headers)) == 360.0  # the exhausted budget decides
+    assert retry_after(_Throttled(429, {'retry-after-ms': '250'})) == 0.25
+    assert retry_after(_Throttled(500, headers)) is None
+
+def test_retry_call_does_not_retry_client_errors():
+    calls = []
+
+    def bad():
+        calls.append(1)
+        raise _Throttled(404)
+
+    with pytest.raises(_Throttled):
+        retry_call(bad, base=0.001)
+    assert len(calls) == 1
+
+def test_limiters_are_shared_by_name():
+    assert get_limiter('test:x', 5) is get_limiter('test:x', 10)
+
+def test_concurrent_sources_report_failures(tmp_path):
+    for i in range(3):
+        (tmp_path / ('%d.md' % i)).write_text('doc %d' % i)
+    sources = [{'type': 'file', 'value': str(tmp_path / '*.md')}, {'type': 'bogus', 'value': 'x'}]
+    report = {}
+    docs = list(iter_source_docs_concurrent(sources, max_workers=2, report=report))
+    assert len(docs) == 3
+    stats = source_report(report)
+    assert stats['file:%s' % (tmp_path / '*.md')]['docs'] == 3
+    assert stats['bogus:x']['error']
+
+def test_only_transient_errors_are_retried():
+    httpx = pytest.importorskip('httpx')
+    assert is_retryable(_Throttled(503)) and is_retryable(_Throttled(429)) and not is_retryable(_Throttled(400))
+    assert is_retryable(TimeoutError()) and is_retryable(ConnectionResetError())
+    assert is_retryable(httpx.ConnectTimeout('slow'))
+    for exc in (TypeError('bug'), KeyError('data'), ValueError('bad json'), FileNotFoundError('x')):
+        assert not is_retryable(exc)
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise KeyError('data')
+
+    with pytest.raises(KeyError):
+        retry_call(broken, base=0.001)
+    assert len(calls) == 1
@@ -0,0 +1,61 @@
+import json, threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import numpy as np
+import pytest
+from core import constants
+from core.embedder import RemoteEmbedder, SentenceTransformerEmbedder, get_embedder, pack_vectors, unpack_vectors
+
+@pytest.fixture
+def embed_server(fake_embedder):
+    """Stdlib stand-in for mcp/embed_server.py speaking the same protocol."""
+    model = fake_embedder
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self._reply({'status': 'ok', 'model': 'fake#onnx-int8'})
+
+        def do_POST(self):
+            req = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            self._reply({'model': 'fake#onnx-int8', 'embeddings': pack_vectors(model.embed(req['texts']))})
+
+        def _reply(self, obj):
+            body = json.dumps(obj).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, args=(0.01,), daemon=True).start()
+    yield 'http://127.0.0.1:%d' % server.server_port, model
+    server.shutdown()
+
+def test_pack_roundtrip():
+    v = np.random.default_rng(0).random((3, 5)).astype('float32')
+    assert np.array_equal(unpack_vectors(json.loads(json.dumps(pack_vectors(v)))), v)
+
+def test_remote_embedder_matches_local(embed_server):
+    url, model = embed_server
+    remote = RemoteEmbedder(url, 'fake')
+    texts = ['abc', 'hello world']
+    assert np.array_equal(remote.embed(texts), model.embed(texts))
+    assert remote.embed_query('abc').shape == (16,)
+    assert remote.cache_key == 'fake#onnx-int8'
+    assert RemoteEmbedder(url, 'fake').cache_key == 'fake#onnx-int8'  # asked via /health
+    with pytest.raises(RuntimeError):
+        RemoteEmbedder(url, 'other-model').embed(['abc'])
+
+def test_get_embedder_remote_and_lazy_local(embed_server):
+    url, _ = embed_server
+    cfg = {constants.EMBEDDING: {constants.MODEL: 'fake', constants.REMOTE_URL: url},
+           constants.INDEX: {constants.METRIC: 'cosine'}}
+    emb = get_embedder(cfg)
+    assert isinstance(emb.inner, RemoteEmbedder)
+    assert abs(np.linalg.norm(emb.embed(['abc'])[0]) - 1.0) < 1e-5
+    # constructing a local model embedder must not load the model
+    local = get_embedder({constants.EMBEDDING: {constants.MODEL: 'all-MiniLM-L6-v2'}})
+    assert isinstance(local, SentenceTransformerEmbedder) and local._model is None
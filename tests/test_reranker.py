@@ -0,0 +1,51 @@
+import time
+import numpy as np
+from core.reranker import Reranker
+
+class FakeScorer:
+    """Scores a pair by how many times the query occurs in the text; optionally slow per pair."""
+
+    def __init__(self, pair_ms=0.0):
+        self.pair_ms = pair_ms
+        self.batches = []
+
+    def score(self, pairs):
+        self.batches.append(len(pairs))
+        time.sleep(self.pair_ms * len(pairs) / 1000)
+        return np.asarray([t.count(q) for q, t in pairs], dtype='float32')
+
+def _hits(texts):
+    return [{'score': float(i), 'meta': {'text': t, 'source': 's%d' % i}} for i, t in enumerate(texts)]
+
+def test_rerank_orders_by_scorer_and_keeps_top_k():
+    rr = Reranker(FakeScorer(), candidates=10)
+    out = rr.rerank(['ab', 'c'], [_hits(['x', 'ab ab', 'ab']), _hits(['c', 'ccc'])], top_k=2)
+    assert [[h['meta']['text'] for h in hits] for hits in out] == [['ab ab', 'ab'], ['ccc', 'c']]
+    assert out[0][0]['rerank_score'] == 2.0 and out[0][0]['score'] == 1.0
+    # one scoring call for every pair of the search call
+    assert rr.scorer.batches == [5] and rr.stats()['pairs'] == 5
+    assert rr.rerank(['q'], [[]], top_k=2) == [[]]
+
+def test_budget_caps_candidates():
+    rr = Reranker(FakeScorer(pair_ms=1.0), candidates=100, budget_ms=20)
+    assert rr.candidates_for(5) == 100  # no cost estimate yet
+    rr.rerank(['a'], [_hits(['a'] * 10)], top_k=5)
+    assert rr.pair_ms >= 1.0
+    assert 5 <= rr.candidates_for(5) <= 20
+    # more queries per call share the budget, but never fetch fewer than top_k
+    assert rr.candidates_for(5, n_queries=8) == 5
+    assert rr.stats()['capped'] == 2
+    assert Reranker(FakeScorer(), candidates=30).candidates_for(5) == 30
+
+def test_service_reranks_candidates(make_service):
+    svc = make_service(['aaaa', 'aaab', 'abab', 'bbbb', 'bbba'], query_cache={'results': 100})
+    plain = svc.search('aaaa', top_k=2)
+    assert [h['text'] for h in plain] == ['aaaa', 'aaab']
+    svc.reranker = Reranker(FakeScorer(), candidates=5)
+    # 'ba' occurs most often in 'bbba' / 'abab', which are not dense neighbours of the query
+    hits = svc.search('ba', top_k=2)
+    assert [h['text'] for h in hits] == ['abab', 'bbba'] and hits[0]['rerank_score'] == 1.0
+    assert svc.search_many(['ba'], top_k=2) == [hits]
+    stages = svc.stage_stats()
+    assert stages['rerank']['count'] == 1 and stages['search']['count'] == 2
+    assert svc.rerank_stats()['calls'] == 1
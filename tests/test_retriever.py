@@ -0,0 +1,44 @@
+import numpy as np
+from core.indexer import build_index
+from core.retriever import IndexHandle, retrieve_top_k
+
+def test_handle_matches_retrieve_top_k(tmp_path, make_chunks):
+    path = str(tmp_path / 'idx.faiss')
+    chunks = make_chunks(20)
+    build_index(chunks, backend='faiss', index_path=path)
+    handle = IndexHandle(path)
+    q = chunks[3]['embedding']
+    hits = handle.search(q, top_k=3)
+    assert hits[0]['meta']['id'] == 'doc3#chunk-0'
+    assert [h['meta']['id'] for h in hits] == [h['meta']['id'] for h in retrieve_top_k(q, 3, path)]
+
+def test_handle_hot_reload_keeps_old_snapshot(tmp_path, make_chunks):
+    path = str(tmp_path / 'idx.faiss')
+    build_index(make_chunks(10), backend='faiss', index_path=path)
+    handle = IndexHandle(path, check_interval=0)
+    old = handle.snapshot()
+    assert handle.generation == 1
+
+    new_chunks = make_chunks(5, seed=1, prefix='new')
+    build_index(new_chunks, backend='faiss', index_path=path)
+    assert handle.maybe_reload(wait=True)
+    assert handle.generation == 2
+    assert handle.ntotal == 5
+    assert old.index.ntotal == 10  # in-flight searches keep their snapshot
+    assert handle.search(new_chunks[0]['embedding'], top_k=1)[0]['meta']['id'] == 'new0#chunk-0'
+    assert not handle.maybe_reload(wait=True)
+
+def test_mmap_handle_matches_heap_and_survives_rebuild(tmp_path, make_chunks):
+    path = str(tmp_path / 'idx.faiss')
+    chunks = make_chunks(50)
+    build_index(chunks, backend='faiss-hnsw', index_path=path)
+    heap, mapped = IndexHandle(path), IndexHandle(path, check_interval=0, mmap=True)
+    for c in chunks[:5]:
+        assert heap.search(c['embedding'], top_k=3) == mapped.search(c['embedding'], top_k=3)
+    old = mapped.snapshot()
+    new_chunks = make_chunks(5, seed=1, prefix='new')
+    build_index(new_chunks, backend='faiss', index_path=path)
+    assert mapped.maybe_reload(wait=True)
+    # the rebuild replaced the file, so the old mapping still reads the old inode
+    assert old.index.search(np.asarray([chunks[0]['embedding']], dtype='float32'), 1)[1][0][0] == 0
+    assert mapped.search(new_chunks[0]['embedding'], top_k=1)[0]['meta']['id'] == 'new0#chunk-0'
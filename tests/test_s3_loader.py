@@ -0,0 +1,75 @@
+import io
+import threading
+import pytest
+
+pytest.importorskip('boto3')
+from core.loaders.s3_loader import S3Loader
+
+class FakeS3:
+    def __init__(self, objects):
+        self.objects = objects
+        self.gets = []
+        self._lock = threading.Lock()
+
+    def get_paginator(self, name):
+        fake = self
+
+        class _P:
+            def paginate(self, Bucket, Prefix):
+                keys = [k for k in fake.objects if k.startswith(Prefix)]
+                yield {'Contents': [{'Key': k, 'ETag': '"%d"' % hash(v), 'LastModified': 'T', 'Size': len(v)}
+                                    for k, v in ((k, fake.objects[k]) for k in keys)]}
+        return _P()
+
+    def get_object(self, Bucket, Key):
+        with self._lock:
+            self.gets.append(Key)
+        return {'Body': io.BytesIO(self.objects[Key])}
+
+    def download_fileobj(self, Bucket, Key, f):
+        with self._lock:
+            self.gets.append(Key)
+        f.write(self.objects[Key])
+
+def _loader(objects, tmp_path, **kw):
+    loader = S3Loader('bucket', prefix='docs/', aws_region='us-east-1', extract_workers=0,
+                      state_path=str(tmp_path / 'state.json'), **kw)
+    loader.s3 = FakeS3(objects)
+    return loader
+
+def test_parallel_fetch_and_spooling(tmp_path):
+    objects = {'docs/%d.md' % i: ('doc %d' % i).encode() for i in range(20)}
+    objects['docs/big.txt'] = b'x' * 4096
+    objects['docs/skip.bin'] = b'\0'
+    loader = _loader(objects, tmp_path, max_workers=4, spool_bytes=1024)
+    docs = loader.load()
+    assert len(docs) == 21
+    assert {d['id'] for d in docs} >= {'s3://bucket/docs/big.txt', 's3://bucket/docs/7.md'}
+    assert 'docs/skip.bin' not in loader.s3.gets
+
+def test_unchanged_objects_are_not_downloaded_after_commit(tmp_path):
+    objects = {'docs/a.md': b'alpha', 'docs/b.md': b'beta'}
+    loader = _loader(objects, tmp_path)
+    assert len(loader.load()) == 2
+    loader.commit()
+
+    objects['docs/b.md'] = b'beta v2'
+    again = _loader(objects, tmp_path)
+    docs = {d['id']: d for d in again.load()}
+    assert docs['s3://bucket/docs/a.md'] == {'id': 's3://bucket/docs/a.md', 'unchanged': True}
+    assert docs['s3://bucket/docs/b.md']['text'] == 'beta v2'
+    assert again.s3.gets == ['docs/b.md']
+
+def test_failed_downloads_yield_error_stubs(tmp_path):
+    objects = {'docs/a.md': b'alpha', 'docs/b.md': b'beta'}
+    loader = _loader(objects, tmp_path, max_retries=0)
+    get_object = loader.s3.get_object
+
+    def flaky(Bucket, Key):
+        if Key == 'docs/b.md':
+            raise ConnectionError('read timed out')
+        return get_object(Bucket, Key)
+    loader.s3.get_object = flaky
+    docs = {d['id']: d for d in loader.load()}
+    assert docs['s3://bucket/docs/b.md'] == {'id': 's3://bucket/docs/b.md', 'error': 'read timed out'}
+    assert docs['s3://bucket/docs/a.md']['text'] == 'alpha'
@@ -0,0 +1,91 @@
+import glob, json
+import numpy as np
+import pytest
+from core.indexer import build_index
+from core.pipeline import run_streaming
+from core.retriever import IndexHandle, load_index, search_index_many
+from core.shards import ShardedIndex, is_sharded, merge_topk, rebuild_shard
+
+def _ids(hits):
+    return [[h['meta']['id'] for h in q] for q in hits]
+
+def test_merge_topk_keeps_the_best_of_every_shard():
+    D = [np.array([[0.1, 0.5, 0.9]]), np.array([[0.2, 0.3, np.inf]])]
+    I = [np.array([[1, 2, 3]]), np.array([[10, 11, -1]])]
+    d, i = merge_topk(D, I, 4, similarity=False)
+    assert i.tolist() == [[1, 10, 11, 2]] and np.allclose(d, [[0.1, 0.2, 0.3, 0.5]])
+    d, i = merge_topk([np.array([[0.9, 0.1]]), np.array([[0.5, 0.4]])], [np.array([[1, 2]]), np.array([[3, 4]])],
+                      3, similarity=True)
+    assert i.tolist() == [[1, 3, 4]]
+
+@pytest.mark.parametrize('metric', ['l2', 'cosine'])
+def test_sharded_flat_matches_single_index(tmp_path, metric, make_chunks):
+    chunks = make_chunks(500, dim=16, sources=10)
+    single, sharded = str(tmp_path / 'one.faiss'), str(tmp_path / 'many.faiss')
+    build_index(chunks, backend='faiss-flat', index_path=single, metric=metric)
+    build_index(chunks, backend='faiss-flat', index_path=sharded, metric=metric, shards=4)
+    assert is_sharded(sharded) and not is_sharded(single)
+    manifest = json.load(open(sharded))
+    assert [s['ntotal'] for s in manifest['shards']] == [125] * 4 and manifest['ntotal'] == 500
+    a, b = IndexHandle(single), IndexHandle(sharded)
+    assert isinstance(b.snapshot().index, ShardedIndex) and b.ntotal == 500
+    queries = np.asarray([c['embedding'] for c in chunks[:20]]) + 0.01
+    assert _ids(a.search_many(queries, top_k=10)) == _ids(b.search_many(queries, top_k=10))
+    flt = {'source': ['src3', 'src7']}
+    assert _ids(a.search_many(queries, top_k=10, filter=flt)) == _ids(b.search_many(queries, top_k=10, filter=flt))
+    assert b.search(queries[0], top_k=5, filter={'source': 'nope'}) == []
+    index, meta = load_index(sharded, mmap=True)
+    assert _ids(search_index_many(index, meta, queries, 10)) == _ids(a.search_many(queries, top_k=10))
+
+def test_rebuild_one_shard(tmp_path, make_chunks):
+    path = str(tmp_path / 'idx.faiss')
+    chunks = make_chunks(400, dim=16, sources=10)
+    build_index(chunks, backend='faiss-flat', index_path=path, shards=2)
+    handle = IndexHandle(path, check_interval=0)
+    before = json.load(open(path))
+    queries = np.asarray([c['embedding'] for c in chunks[:10]]) + 0.01
+    expected = _ids(handle.search_many(queries, top_k=5))
+
+    manifest = rebuild_shard(path, 1, index_type='faiss-hnsw')
+    assert manifest['shards'][0] == before['shards'][0]
+    assert manifest['shards'][1]['params']['type'] == 'faiss-hnsw'
+    assert manifest['version'] == before['version'] + 1
+    assert sorted(glob.glob(path + '.shard*')) == sorted(str(tmp_path / s['file']) for s in manifest['shards'])
+    assert handle.maybe_reload(wait=True) and handle.generation == 2
+    got = _ids(handle.search_many(queries, top_k=5))
+    assert np.mean([len(set(x) & set(y)) / 5 for x, y in zip(got, expected)]) >= 0.9
+    with pytest.raises(ValueError):
+        rebuild_shard(path, 0, vectors=np.zeros((3, 16), dtype='float32'))
+    with pytest.raises(ValueError):
+        rebuild_shard(path, 5)
+
+def test_unsharded_rebuild_removes_shard_files(tmp_path, make_chunks):
+    path = str(tmp_path / 'idx.faiss')
+    build_index(make_chunks(100, dim=16), backend='faiss', index_path=path, shards=3)
+    assert len(glob.glob(path + '.shard*')) == 3
+    build_index(make_chunks(100, dim=16), backend='faiss', index_path=path)
+    assert not is_sharded(path) and glob.glob(path + '.shard*') == []
+
+def test_streaming_build_sharded(tmp_path, fake_embedder):
+    path = str(tmp_path / 'idx.faiss')
+    docs = ({'id': 'doc-%d' % i, 'text': 'Document number %d.' % i, 'meta': {'source': 'test'}} for i in range(30))
+    config = {'pipeline': {'chunk_max_chars': 200, 'chunk_overlap': 0}, 'index': {'shards': 3}}
+    run_streaming(docs, config, embedder=fake_embedder, index_path=path, batch_docs=4)
+    handle = IndexHandle(path)
+    assert isinstance(handle.snapshot().index, ShardedIndex) and handle.ntotal == 30
+    hit = handle.search(fake_embedder.embed_query('Document number 23.'), top_k=1)[0]
+    assert hit['meta']['id'] == 'doc-23#chunk-0'
+
+def test_reloads_share_one_search_pool(tmp_path, make_chunks):
+    import threading
+    path = str(tmp_path / 'idx.faiss')
+    chunks = make_chunks(200, dim=16)
+    build_index(chunks, backend='faiss-flat', index_path=path, shards=2)
+    handle = IndexHandle(path, check_interval=0)
+    handle.search(chunks[0]['embedding'], top_k=3)
+    before = threading.active_count()
+    for _ in range(5):
+        rebuild_shard(path, 0)
+        assert handle.maybe_reload(wait=True)
+        assert handle.search(chunks[0]['embedding'], top_k=1)[0]['meta']['id'] == 'doc0#chunk-0'
+    assert threading.active_count() <= before
@@ -0,0 +1,75 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from core.loaders.url_loader import URLLoader
+
+PAGES = {
+    '/docs/': '<h1>Index</h1><p>Start here.</p><a href="a.html">a</a><a href="b.html#frag">b</a>'
+              '<a href="http://elsewhere.example/x">x</a><a href="/blog/post">blog</a>',
+    '/docs/a.html': '<h1>A</h1><p>Alpha page.</p><a href="b.html">b</a><a href="/docs/">up</a>',
+    '/docs/b.html': '<h1>B</h1><p>Beta page.</p>',
+    '/blog/post': '<h1>Blog</h1><p>Out of scope.</p>',
+}
+
+@pytest.fixture
+def site():
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            body = PAGES.get(self.path)
+            if body is None:
+                self.send_response(404); self.end_headers(); return
+            if body == 503:
+                self.send_response(503); self.end_headers(); return
+            etag = '"%d"' % len(body)
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304); self.end_headers(); return
+            data = body.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:%d' % server.server_port, hits
+    server.shutdown()
+
+def test_crawl_fetches_each_page_once_and_stays_in_scope(site):
+    base, hits = site
+    loader = URLLoader(base + '/docs/', delay=0, max_workers=4, allow_patterns=[r'/docs/'])
+    docs = loader.load()
+    assert sorted(d['meta']['title'] for d in docs) == ['A', 'B', 'Index']
+    assert sorted(hits) == ['/docs/', '/docs/a.html', '/docs/b.html']
+
+def test_recrawl_uses_conditional_requests(site, tmp_path):
+    base, hits = site
+    state = str(tmp_path / 'state.json')
+    first = URLLoader(base + '/docs/', delay=0, allow_patterns=[r'/docs/'], state_path=state)
+    assert len(first.load()) == 3
+    first.commit()
+    again = URLLoader(base + '/docs/', delay=0, allow_patterns=[r'/docs/'], state_path=state)
+    docs = again.load()
+    assert len(docs) == 3 and all(d.get('unchanged') for d in docs)
+
+def test_failed_fetch_on_recrawl_is_an_error_stub(site, tmp_path):
+    base, hits = site
+    state = str(tmp_path / 'state.json')
+    first = URLLoader(base + '/docs/', delay=0, allow_patterns=[r'/docs/'], state_path=state)
+    assert len(first.load()) == 3
+    first.commit()
+    saved, PAGES['/docs/a.html'] = PAGES['/docs/a.html'], 503
+    try:
+        again = URLLoader(base + '/docs/', delay=0, allow_patterns=[r'/docs/'], state_path=state)
+        docs = {d['id']: d for d in again.load()}
+    finally:
+        PAGES['/docs/a.html'] = saved
+    assert docs[base + '/docs/a.html']['error']
+    assert len(docs) == 3 and docs[base + '/docs/b.html'].get('unchanged')
@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+from core.filters import filter_terms
+from core.indexer import build_index
+from core.vector_store import FaissStore, get_vector_store
+from mcp.rag_service import RagMCPService
+
+def _exact(chunks, q, k, metric):
+    vecs = np.asarray([c['embedding'] for c in chunks])
+    order = np.argsort(-(vecs @ q)) if metric != 'l2' else np.argsort(((vecs - q) ** 2).sum(axis=1))
+    return [chunks[i]['id'] for i in order[:k]]
+
+def _config(tmp_path, backend, metric):
+    if backend == 'faiss':
+        return {'index': {'type': 'faiss', 'path': str(tmp_path / 'idx.faiss'), 'metric': metric}}
+    if backend == 'chroma':
+        pytest.importorskip('chromadb')
+        return {'index': {'type': 'chroma', 'persist_directory': str(tmp_path / 'chroma'), 'metric': metric,
+                          'collection_name': 'rag_test', 'batch_size': 7}}
+    pytest.importorskip('pymilvus')
+    pytest.importorskip('milvus_lite')
+    # Milvus Lite: a local-file stand-in for a server
+    return {'index': {'type': 'milvus', 'uri': str(tmp_path / 'milvus.db'), 'metric': metric,
+                      'collection_name': 'rag_test', 'batch_size': 7, 'milvus_index_type': 'FLAT',
+                      'milvus_index_params': {}}}
+
+@pytest.mark.parametrize('backend', ['faiss', 'chroma', 'milvus'])
+@pytest.mark.parametrize('metric', ['l2', 'cosine'])
+def test_store_build_search_update(tmp_path, backend, metric, make_chunks):
+    config = _config(tmp_path, backend, metric)
+    store = get_vector_store(config)
+    chunks = make_chunks(40)
+    store.build(chunks)
+    store.open()
+    q = chunks[5]['embedding'] + 0.01
+    hits = store.search(q, top_k=5)
+    assert [h['meta']['id'] for h in hits] == _exact(chunks, q, 5, metric)
+    assert hits[0]['meta']['text'] == 'text 5' and hits[0]['meta']['meta']['year'] == 2021
+    assert store.similarity == (metric == 'cosine')
+    cut = hits[2]['score']
+    assert len(store.search(q, top_k=5, min_score=cut)) == 3
+
+    flt = {'source': ['src1', 'src2'], 'year': 2021}
+    allowed = [c for c in chunks if c['source'] in ('src1', 'src2') and c['meta']['year'] == 2021]
+    assert [h['meta']['id'] for h in store.search(q, top_k=4, filter=flt)] == _exact(allowed, q, 4, metric)
+
+    if backend == 'faiss':
+        # `build` output addresses rows by position; updates start over from an IndexIDMap2
+        with pytest.raises(ValueError):
+            store.upsert(chunks[:1])
+        store.update(chunks, replace=True)
+        assert store.patchable
+    generation = store.generation
+    fresh = make_chunks(3, seed=1, prefix='new')
+    store.update(fresh, delete_ids=['doc5#chunk-0'])
+    store.maybe_reload(wait=True)
+    assert store.generation > generation
+    ids = [h['meta']['id'] for h in store.search(q, top_k=50)]
+    assert 'doc5#chunk-0' not in ids and len(ids) == 40 - 1 + 3
+    moved = dict(chunks[7], embedding=q, text='moved')
+    store.upsert([moved])
+    store.maybe_reload(wait=True)
+    top = store.search(q, top_k=2)
+    assert top[0]['meta']['text'] == 'moved' and top[1]['meta']['id'] != 'doc7#chunk-0'
+
+@pytest.mark.parametrize('backend', ['chroma', 'milvus'])
+def test_service_serves_non_faiss_stores(tmp_path, fake_embedder, backend):
+    config = _config(tmp_path, backend, 'l2')
+    texts = ['aaaa', 'bbbb', 'abab', 'cccc']
+    vecs = fake_embedder.embed(texts)
+    build_index([{'id': 'd%d#chunk-0' % i, 'source': 's%d' % i, 'title': None, 'text': t, 'meta': {},
+                  'embedding': vecs[i]} for i, t in enumerate(texts)], backend=backend, **config['index'])
+    svc = RagMCPService(config, embedder=fake_embedder)
+    assert [h['text'] for h in svc.search('bbbb', top_k=2)] == ['bbbb', 'abab']
+    assert [h['source'] for h in svc.search_many(['aaaa'], top_k=4, filter={'source': 's3'})[0]] == ['s3']
+
+def test_milvus_prefix_filters(tmp_path, make_chunks):
+    store = get_vector_store(_config(tmp_path, 'milvus', 'l2'))
+    chunks = make_chunks(12)
+    for i, c in enumerate(chunks):
+        c['id'] = 's3://bucket/%s_%d#chunk-0' % ('docs' if i % 2 else 'logs', i)
+    store.build(chunks)
+    hits = store.search(chunks[0]['embedding'], top_k=12, filter={'doc': {'prefix': 's3://bucket/docs_'}})
+    assert sorted(h['meta']['id'] for h in hits) == sorted(c['id'] for c in chunks[1::2])
+    hits = store.search(chunks[0]['embedding'], top_k=12, filter={'tags': ['t1', 't2']})
+    assert sorted(h['meta']['id'] for h in hits) == sorted(c['id'] for c in chunks if c['meta']['tags'][0] in ('t1', 't2'))
+
+def test_filter_terms_and_chroma_rejects_prefix():
+    assert filter_terms({'b': {'in': [1, 2], 'prefix': 'x'}, 'a': 'v'}) == [('a', ['v'], []), ('b', [1, 2], ['x'])]
+    with pytest.raises(ValueError):
+        filter_terms({'a': {'regex': '.*'}})
+    chroma = pytest.importorskip('core.indexer_chroma', exc_type=ImportError)
+    with pytest.raises(ValueError):
+        chroma.where({'doc': {'prefix': 's3://'}})
+
+def test_faiss_store_from_config(tmp_path):
+    store = get_vector_store({'index': {'type': 'faiss-hnsw', 'path': str(tmp_path / 'x.faiss'), 'hybrid': True,
+                                        'nprobe': 8}})
+    assert isinstance(store, FaissStore) and store.index_type == 'faiss-hnsw'
+    assert not store.patchable
+    with pytest.raises(NotImplementedError):
+        get_vector_store({'index': {'type': 'pinecone'}})
+
+def test_chroma_filters_list_fields(tmp_path, make_chunks):
+    store = get_vector_store(_config(tmp_path, 'chroma', 'l2'))
+    chunks = make_chunks(12)
+    store.build(chunks)
+    hits = store.search(chunks[0]['embedding'], top_k=12, filter={'tags': ['t1', 't2'], 'year': 2021})
+    assert sorted(h['meta']['id'] for h in hits) == sorted(
+        c['id'] for c in chunks if c['meta']['tags'][0] in ('t1', 't2') and c['meta']['year'] == 2021)
+    assert hits[0]['meta']['meta']['tags'] in (['t1'], ['t2'])
+
+def test_milvus_rejects_oversized_ids(make_chunks):
+    milvus = pytest.importorskip('core.indexer_milvus', exc_type=ImportError)
+    chunk = dict(make_chunks(1)[0], id='x' * (milvus.MAX_VARCHAR + 1))
+    with pytest.raises(ValueError):
+        milvus._row(chunk)
+
+@pytest.mark.parametrize('backend', ['chroma', 'milvus'])
+def test_service_does_not_cache_results_of_shared_stores(tmp_path, fake_embedder, backend):
+    config = dict(_config(tmp_path, backend, 'l2'), query_cache={'results': 10})
+    vecs = fake_embedder.embed(['aaaa', 'bbbb'])
+    build_index([{'id': 'd%d#chunk-0' % i, 'source': 's', 'title': None, 'text': t, 'meta': {}, 'embedding': vecs[i]}
+                 for i, t in enumerate(['aaaa', 'bbbb'])], backend=backend, **config['index'])
+    svc = RagMCPService(config, embedder=fake_embedder)
+    assert [h['text'] for h in svc.search('aaaa', top_k=1)] == ['aaaa']
+    # another process rewrites the collection; this process's generation does not move
+    other = get_vector_store(config)
+    other.upsert([{'id': 'd0#chunk-0', 'source': 's', 'title': None, 'text': 'changed', 'meta': {},
+                   'embedding': vecs[0]}])
+    assert [h['text'] for h in svc.search('aaaa', top_k=1)] == ['changed']
+    assert svc.cache_stats()['results']['entries'] == 0
+
+def test_faiss_update_recovers_from_an_interrupted_write(tmp_path, monkeypatch, make_chunks):
+    import faiss
+    from core.retriever import IndexHandle
+    store = get_vector_store(_config(tmp_path, 'faiss', 'l2'))
+    chunks = make_chunks(4)
+    store.update(chunks)
+    handle = IndexHandle(store.index_path, check_interval=0)
+
+    def killed(*args):
+        raise RuntimeError('killed')
+    # the writer dies after the sidecars went in but before the index file: doc3 keeps a vector and loses its row
+    with monkeypatch.context() as m:
+        m.setattr(faiss, 'write_index', killed)
+        with pytest.raises(RuntimeError):
+            store.delete(['doc3#chunk-0'])
+    # the serving process keeps the last complete set
+    assert not handle.maybe_reload(wait=True) and handle.ntotal == 4
+    store.update(make_chunks(1, seed=1, prefix='new'))
+    assert handle.maybe_reload(wait=True)
+    assert handle.ntotal == 4 and {h['meta']['id'] for h in handle.search(chunks[0]['embedding'], top_k=10)} == {
+        'doc0#chunk-0', 'doc1#chunk-0', 'doc2#chunk-0', 'new0#chunk-0'}